@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Аналитика торговли: агрегаты по закрытым позициям (symbol, side, close_reason),
+поддерживаемые инкрементально при закрытии. Отчёт читает только position_stats
+"""
+
+import argparse
+
+from storage import db, POSITION_STATS_ACCUMULATE_SQL
+from hyperliquid_api import hl_api
+
+GROUP_COLUMNS = ("symbol", "side", "close_reason")
+
+# Позиций с неизвестным PnL, дополняемых за один проход сверки (запрос fills на каждую)
+BACKFILL_PROFIT_BATCH = 20
+
+_STATS_FIELDS = (
+    "trades", "wins", "losses", "total_pnl", "gross_profit", "gross_loss",
+    "best_pnl", "worst_pnl", "total_hold_ms", "last_closed_at",
+)
+
+
+def realized_pnl(coin, opened_at_ms, closed_at_ms=None, api=None):
+    """Реализованный PnL позиции по fills с момента открытия. None, если биржа недоступна."""
+    if not opened_at_ms:
+        return None
+    return (api or hl_api).get_realized_pnl(coin, opened_at_ms, closed_at_ms)
+
+
+def record_closed_position(position_id, storage=db):
+    """
+    Добавление закрытой позиции в агрегаты. Вызывать после UPDATE закрытия
+    в том же unit of work (изменения применяются по порядку).
+    """
+    storage.write(POSITION_STATS_ACCUMULATE_SQL.format(where="id = ?"), (position_id,))
+
+
+def backfill_profit(api=None, storage=db, limit=BACKFILL_PROFIT_BATCH):
+    """
+    Повторный запрос PnL закрытых позиций с profit NULL (биржа была недоступна при закрытии,
+    позиция из старой БД) и добавление их в агрегаты. Не больше limit позиций за вызов;
+    при ошибке API — до следующего вызова. Возвращает количество дополненных позиций.
+    """
+    rows = storage.fetchall(
+        """
+        SELECT id, symbol, opened_at, closed_at FROM positions
+        WHERE status='closed' AND profit IS NULL AND opened_at IS NOT NULL
+        ORDER BY closed_at DESC LIMIT ?
+        """,
+        (limit,),
+    )
+    filled = []
+    for pos_id, symbol, opened_at, closed_at in rows:
+        profit = realized_pnl(symbol.replace("USDT", ""), opened_at, closed_at, api=api)
+        if profit is None:
+            break
+        filled.append((pos_id, profit))
+    if filled:
+        with storage.unit_of_work():
+            for pos_id, profit in filled:
+                storage.write("UPDATE positions SET profit=? WHERE id=? AND profit IS NULL", (profit, pos_id))
+                record_closed_position(pos_id, storage=storage)
+    return len(filled)
+
+
+def rebuild_stats(storage=db):
+    """Полный пересчёт агрегатов по истории positions (однократное обслуживание)."""
+    with storage.transaction():
+        storage.execute("DELETE FROM position_stats")
+        storage.execute(POSITION_STATS_ACCUMULATE_SQL.format(where="1"))
+
+
+def _derive(row):
+    stats = dict(row)
+    trades = stats["trades"] or 0
+    gross_loss = abs(stats["gross_loss"] or 0.0)
+    stats["win_rate"] = (stats["wins"] / trades * 100) if trades else 0.0
+    stats["avg_pnl"] = (stats["total_pnl"] / trades) if trades else 0.0
+    stats["avg_hold_minutes"] = (stats["total_hold_ms"] / trades / 60000) if trades else 0.0
+    stats["profit_factor"] = (stats["gross_profit"] / gross_loss) if gross_loss > 0 else None
+    return stats
+
+
+def get_stats(group_by=GROUP_COLUMNS, symbol=None, side=None, close_reason=None, storage=db):
+    """
+    Агрегаты, сгруппированные по подмножеству (symbol, side, close_reason).
+    Возвращает список словарей с trades, win_rate, total_pnl, avg_pnl, avg_hold_minutes и т.д.
+    """
+    group_by = tuple(group_by)
+    if any(col not in GROUP_COLUMNS for col in group_by):
+        raise ValueError(f"Группировка возможна только по {GROUP_COLUMNS}")
+
+    filters, params = [], []
+    for col, value in (("symbol", symbol), ("side", side), ("close_reason", close_reason)):
+        if value is not None:
+            filters.append(f"{col} = ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+    select_keys = ", ".join(group_by)
+    rows = storage.fetchall(
+        f"""
+        SELECT {select_keys + ',' if group_by else ''}
+            SUM(trades), SUM(wins), SUM(losses), SUM(total_pnl), SUM(gross_profit),
+            SUM(gross_loss), MAX(best_pnl), MIN(worst_pnl), SUM(total_hold_ms), MAX(last_closed_at)
+        FROM position_stats
+        {where}
+        {'GROUP BY ' + select_keys if group_by else ''}
+        ORDER BY SUM(total_pnl) DESC
+        """,
+        params,
+    )
+
+    result = []
+    for row in rows:
+        if row[len(group_by)] is None:
+            continue
+        keys = dict(zip(group_by, row[:len(group_by)]))
+        keys.update(zip(_STATS_FIELDS, row[len(group_by):]))
+        result.append(_derive(keys))
+    return result
+
+
+def get_summary(storage=db):
+    """Итог по всем закрытым позициям (одна строка) или None, если сделок нет."""
+    rows = get_stats(group_by=(), storage=storage)
+    return rows[0] if rows else None
+
+
+def print_report(group_by=("symbol",), **filters):
+    rows = get_stats(group_by=group_by, **filters)
+    summary = get_summary()
+
+    print("=" * 60)
+    print(f"📈 АНАЛИТИКА ПОЗИЦИЙ (группировка: {', '.join(group_by) or 'всё'})")
+    print("=" * 60)
+
+    if not summary:
+        print("Нет закрытых позиций")
+        return
+
+    for row in rows:
+        key = " / ".join(str(row[col]) for col in group_by)
+        sign = "+" if row["total_pnl"] >= 0 else ""
+        print(
+            f"{key:<28} сделок {row['trades']:>4} | win {row['win_rate']:5.1f}% | "
+            f"PnL {sign}${row['total_pnl']:.2f} (ср. ${row['avg_pnl']:.2f}) | "
+            f"удержание {row['avg_hold_minutes']:.0f} мин"
+        )
+
+    pf = summary["profit_factor"]
+    pf_text = f" | profit factor {pf:.2f}" if pf is not None else ""
+    print("-" * 60)
+    print(
+        f"Всего: {summary['trades']} сделок | win {summary['win_rate']:.1f}% | "
+        f"PnL ${summary['total_pnl']:.2f}{pf_text}"
+    )
+    print(f"Лучшая: ${summary['best_pnl']:.2f} | Худшая: ${summary['worst_pnl']:.2f}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчёт по закрытым позициям")
+    parser.add_argument("--by", default="symbol", help="Группировка: symbol,side,close_reason")
+    parser.add_argument("--symbol", default=None)
+    parser.add_argument("--side", default=None)
+    parser.add_argument("--reason", default=None)
+    parser.add_argument("--rebuild", action="store_true", help="Пересчитать агрегаты по всей истории")
+    args = parser.parse_args()
+
+    db.init_schema()
+    if args.rebuild:
+        rebuild_stats()
+        print("🔁 Агрегаты пересчитаны")
+
+    group_by = tuple(col.strip() for col in args.by.split(",") if col.strip())
+    print_report(group_by, symbol=args.symbol, side=args.side, close_reason=args.reason)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
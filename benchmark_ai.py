@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк AI-конвейера: analyze_with_ai end-to-end против локального mock OpenRouter
+"""
+
+import io
+import os
+import json
+import time
+import random
+import argparse
+import contextlib
+
+from mock_openrouter import MockBehavior, start_mock_server
+
+
+def generate_synthetic_market_data(symbols, seed=None, limits=None):
+    """Синтетические свечи (случайное блуждание) в формате get_market_data."""
+    rng = random.Random(seed)
+    limits = limits or {"1d": 360, "1h": 200, "1m": 1440}
+    seconds = {"1d": 86400, "1h": 3600, "1m": 60}
+    now = int(time.time())
+
+    data = {}
+    for symbol in symbols:
+        base_price = rng.uniform(1, 50000)
+        tf_data = {}
+        for interval, limit in limits.items():
+            price = base_price
+            step = seconds[interval]
+            vol = 0.02 if interval == "1d" else (0.005 if interval == "1h" else 0.001)
+            candles = []
+            for i in range(limit):
+                o = price
+                c = max(o * (1 + rng.gauss(0, vol)), 1e-8)
+                h = max(o, c) * (1 + abs(rng.gauss(0, vol / 2)))
+                l = min(o, c) * (1 - abs(rng.gauss(0, vol / 2)))
+                candles.append({
+                    "t": now - (limit - i) * step,
+                    "o": o, "h": h, "l": l, "c": c,
+                    "v": rng.uniform(100, 10000),
+                })
+                price = c
+            tf_data[interval] = candles
+        data[symbol] = tf_data
+    return data
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def check_stream_consistency(utils):
+    """
+    Один и тот же ответ (с кириллицей) в обычном и SSE-режиме должен разбираться одинаково.
+    Возвращает (совпали, {stream: поля или ошибка}).
+    """
+    behavior = MockBehavior(latency_ms=0.0)
+    behavior.replay = [{"content": "Action: buy_SYM0USDT\nReason: Mock-сигнал: пробой уровня"}]
+    server, base_url = start_mock_server(behavior)
+    replies = {}
+    try:
+        for stream in (False, True):
+            url, headers, payload = utils.build_openrouter_request("mock/check", "SYM0USDT: 1", base_url=base_url)
+            payload["stream"] = stream
+            fields, error = utils.request_ai_fields(url, headers, payload, "Mock")
+            replies[stream] = fields or error
+    finally:
+        server.shutdown()
+    return replies[False] == replies[True], replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк analyze_with_ai против mock OpenRouter")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--symbols", type=int, default=5)
+    parser.add_argument("--mode", choices=("single", "per_symbol"), default=None)
+    parser.add_argument("--two-level", action="store_true")
+    parser.add_argument("--hedging", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal", "exponential"), default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--replay", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Сохранить результаты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="Не подавлять вывод бота")
+    parser.add_argument("--check-stream", action="store_true",
+                        help="Только проверить, что SSE и обычный ответ разбираются одинаково")
+    args = parser.parse_args()
+
+    behavior = MockBehavior(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        malformed_rate=args.malformed_rate,
+        replay_file=args.replay,
+        seed=args.seed,
+    )
+    server, base_url = start_mock_server(behavior)
+
+    # Конфигурация читается при импорте utils — окружение задаём до него
+    os.environ["OPENROUTER_BASE_URL"] = base_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "mock-key")
+    os.environ["AI_RECORD_RESPONSES_FILE"] = ""
+
+    import utils
+    from bot_logging import setup_logging
+
+    # Без файла логов; консоль бота — только с --verbose
+    setup_logging(console=args.verbose, path="")
+
+    utils.OPENROUTER_BASE_URL = base_url
+    utils.AI_RECORD_RESPONSES_FILE = ""
+    if args.mode:
+        utils.AI_ANALYSIS_MODE = args.mode
+    utils.ENABLE_TWO_LEVEL_VERIFICATION = args.two_level
+    utils.ENABLE_AI_HEDGING = args.hedging
+    utils.OPENROUTER_STREAM = args.stream
+
+    if args.check_stream:
+        server.shutdown()
+        ok, replies = check_stream_consistency(utils)
+        print(f"{'✅' if ok else '❌'} SSE / обычный ответ: {replies[True]} | {replies[False]}")
+        raise SystemExit(0 if ok else 1)
+
+    symbols = [f"SYM{i}USDT" for i in range(args.symbols)]
+    market_data = generate_synthetic_market_data(symbols, seed=args.seed)
+
+    print(f"🧪 Mock: {base_url} | {args.latency} {args.latency_ms:.0f}ms | malformed {args.malformed_rate:.0%}")
+    print(f"📊 {args.iterations} итераций, {len(symbols)} символов, режим {utils.AI_ANALYSIS_MODE}")
+
+    latencies = []
+    decisions = {}
+    for _ in range(args.iterations):
+        started = time.perf_counter()
+        sink = io.StringIO()
+        with contextlib.redirect_stdout(sink) if not args.verbose else contextlib.nullcontext():
+            decision, _ = utils.analyze_with_ai(market_data)
+        latencies.append(time.perf_counter() - started)
+        kind = decision.split("_", 1)[0]
+        decisions[kind] = decisions.get(kind, 0) + 1
+
+    server.shutdown()
+
+    total = sum(latencies)
+    results = {
+        "iterations": args.iterations,
+        "symbols": len(symbols),
+        "mode": utils.AI_ANALYSIS_MODE,
+        "mean_s": total / len(latencies),
+        "p50_s": percentile(latencies, 50),
+        "p90_s": percentile(latencies, 90),
+        "p99_s": percentile(latencies, 99),
+        "max_s": max(latencies),
+        "cycles_per_s": len(latencies) / total if total > 0 else 0.0,
+        "decisions": decisions,
+        "mock": dict(behavior.stats),
+        "usage": utils.get_ai_usage_stats(),
+    }
+
+    print("=" * 60)
+    print(f"⏱️ mean {results['mean_s']:.3f}s | p50 {results['p50_s']:.3f}s | "
+          f"p90 {results['p90_s']:.3f}s | p99 {results['p99_s']:.3f}s | max {results['max_s']:.3f}s")
+    print(f"🔁 {results['cycles_per_s']:.2f} циклов/с | решения: {decisions}")
+    print(f"🧪 Mock: {behavior.stats}")
+    for model, stats in results["usage"].items():
+        print(f"📏 {model}: {stats['requests']} запросов, prompt {stats['prompt_tokens']} "
+              f"(оценка {stats['prompt_estimate']}), completion {stats['completion_tokens']}")
+    print("=" * 60)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Структурированный лог бота: модули пишут в логгеры "bot.*". До setup_logging() записи
+просто печатаются в консоль; точки входа (бот, симулятор, бенчмарк) вызывают его явно,
+и тогда запись только кладётся в очередь (QueueHandler), а вывод в консоль и в JSONL-файл
+с ротацией по размеру делает отдельный поток (QueueListener). Контекст (task, cycle,
+phase, symbol, oid) задаётся log_context() и попадает в каждую запись JSON.
+"""
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_LEVEL, LOG_CONSOLE, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
+CONTEXT_FIELDS = ("task", "cycle", "phase", "symbol", "oid")
+
+_context = contextvars.ContextVar("bot_log_context", default={})
+
+_setup_lock = threading.Lock()
+_queue = None
+_listener = None
+_handler = None  # Обработчик логгера "bot" после setup_logging()
+
+
+# ---------- Контекст ----------
+@contextmanager
+def log_context(**fields):
+    """Поля контекста для всех записей внутри блока (в пределах потока)."""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    """Поля log_context() → атрибуты записи (явный extra имеет приоритет)."""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+# ---------- Форматы ----------
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время UTC, уровень, логгер, сообщение, контекст."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage().strip(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Консоль — как раньше print: только текст сообщения (и traceback)."""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            message = f"{message}\n{record.exc_text}"
+        return message
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Вывод в текущий sys.stdout, а не захваченный при создании (работает redirect_stdout)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    В очередь уходит запись с готовым текстом и traceback, но без форматирования
+    под конкретный вывод: консоль и JSON форматируют её сами в потоке listener.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# ---------- Настройка ----------
+def setup_logging(level=LOG_LEVEL, console=LOG_CONSOLE, path=LOG_FILE,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Очередь, поток вывода, консоль и JSONL-файл для логгера "bot". Вызывается точкой входа;
+    повторные вызовы ничего не меняют до stop_logging().
+    """
+    global _queue, _listener, _handler
+    with _setup_lock:
+        if _handler is not None:
+            return
+
+        handlers = []
+        if console:
+            console_handler = _StdoutHandler()
+            console_handler.setFormatter(ConsoleFormatter())
+            handlers.append(console_handler)
+        if path:
+            file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        if handlers:
+            _queue = queue.Queue()
+            _handler = _NonBlockingQueueHandler(_queue)
+            _handler.addFilter(_ContextFilter())
+            _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(stop_logging)
+        else:
+            _handler = logging.NullHandler()
+
+        _root.removeHandler(_default_handler)
+        _root.addHandler(_handler)
+        _root.setLevel(level)
+
+
+def flush_logging():
+    """Ожидание вывода всех записей, уже поставленных в очередь."""
+    queue_, listener = _queue, _listener
+    if queue_ is not None and listener is not None:
+        queue_.join()
+
+
+def stop_logging():
+    """Вывод оставшихся записей, остановка потока и возврат к простому выводу в консоль."""
+    global _queue, _listener, _handler
+    with _setup_lock:
+        if _handler is None:
+            return
+        _root.removeHandler(_handler)
+        _root.addHandler(_default_handler)
+        listener = _listener
+        _queue, _listener, _handler = None, None, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def get_logger(name):
+    """Логгер "bot.<name>"."""
+    return logging.getLogger(f"bot.{name}")
+
+
+# До setup_logging() — синхронный вывод текста в консоль, без файла
+_default_handler = _StdoutHandler()
+_default_handler.setFormatter(ConsoleFormatter())
+
+_root = logging.getLogger("bot")
+_root.setLevel(LOG_LEVEL)
+_root.addHandler(_default_handler)
+_root.propagate = False
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Периодические задачи бота и общее состояние между ними: сверка рисков, обновление
+свечей и решения AI идут каждая со своим интервалом. В потоках (CONCURRENT_TASKS)
+или по очереди в одном потоке — для симулятора с управляемым временем. Задача
+запускается раз в интервал или по закрытиям свечей (scheduler.py).
+"""
+
+import time
+import threading
+
+from storage import now_ms
+from metrics import metrics
+from bot_logging import get_logger, log_context
+
+log = get_logger("bot_tasks")
+
+
+class SharedState:
+    def __init__(self):
+        """
+        Последние данные задач под одной блокировкой. trading_lock — исключительный
+        доступ к ордерам биржи: решение (place_order) и сверка SL/TP не идут одновременно.
+        """
+        self._lock = threading.Lock()
+        self._market_data = None
+        self._market_data_at = None
+        self._snapshot = None
+        self._snapshot_at = None
+        self.trading_lock = threading.RLock()
+        self.stop = threading.Event()
+
+    def set_market_data(self, data, fetched_at=None):
+        """fetched_at — начало загрузки (epoch ms): свечи не старше этого момента."""
+        with self._lock:
+            self._market_data = data
+            self._market_data_at = fetched_at if fetched_at is not None else now_ms()
+
+    def get_market_data(self, max_age=None, since_ms=None):
+        """
+        Свечи не старше max_age секунд и загруженные не раньше since_ms (например,
+        после закрытия бара) или None.
+        """
+        with self._lock:
+            if self._market_data is None:
+                return None
+            if max_age is not None and now_ms() - self._market_data_at > max_age * 1000:
+                return None
+            if since_ms is not None and self._market_data_at < since_ms:
+                return None
+            return self._market_data
+
+    def set_snapshot(self, snapshot):
+        with self._lock:
+            self._snapshot = snapshot
+            self._snapshot_at = now_ms()
+
+    def get_snapshot(self, max_age=None):
+        """Последний снимок сверки (не старше max_age секунд) или None."""
+        with self._lock:
+            if self._snapshot is None:
+                return None
+            if max_age is not None and now_ms() - self._snapshot_at > max_age * 1000:
+                return None
+            return self._snapshot
+
+    def request_stop(self):
+        self.stop.set()
+
+
+class PeriodicTask:
+    def __init__(self, name, interval, func, schedule=None):
+        """
+        func(state) вызывается раз в interval секунд (от начала предыдущего запуска).
+        Если запуск дольше интервала, следующий идёт сразу, пропущенные не догоняются.
+        schedule (CandleCloseSchedule) — запуски по закрытиям свечей вместо interval.
+        Первый запуск — сразу после старта.
+        """
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.schedule = schedule
+        self.next_due = None
+        self.stats = {"runs": 0, "errors": 0, "overruns": 0, "last_seconds": 0.0, "max_seconds": 0.0}
+
+    def prepare(self):
+        self.next_due = time.monotonic()
+
+    def seconds_until_due(self):
+        if self.schedule is not None and self.schedule.target is not None:
+            return self.schedule.seconds_until_due()
+        return self.next_due - time.monotonic()
+
+    def run_once(self, state):
+        if self.schedule is not None and self.schedule.target is not None:
+            self.schedule.record_fire()
+        started = time.monotonic()
+        with log_context(task=self.name, cycle=self.stats["runs"] + 1):
+            try:
+                self.func(state)
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.exception(f"❌ Ошибка задачи {self.name}: {e}")
+        elapsed = time.monotonic() - started
+
+        self.stats["runs"] += 1
+        self.stats["last_seconds"] = elapsed
+        self.stats["max_seconds"] = max(self.stats["max_seconds"], elapsed)
+        if elapsed > self.interval:
+            self.stats["overruns"] += 1
+        self.next_due = max(started + self.interval, time.monotonic())
+        if self.schedule is not None:
+            self.schedule.arm()
+
+
+class TaskRunner:
+    def __init__(self, tasks, state, concurrent=True, shutdown_timeout=30):
+        """
+        tasks — PeriodicTask в порядке первого запуска. concurrent — по потоку на задачу
+        (ожидание через state.stop, остановка без ожидания интервала); иначе задачи
+        идут по очереди в вызывающем потоке, а паузы — через time.sleep (учитываются в metrics).
+        """
+        self.tasks = list(tasks)
+        self.state = state
+        self.concurrent = concurrent
+        self.shutdown_timeout = shutdown_timeout
+        self._threads = []
+
+    def run(self):
+        """Работа до state.stop или KeyboardInterrupt; затем задачи останавливаются."""
+        if not self.concurrent:
+            self._run_sequential()
+            return
+
+        self.start()
+        try:
+            while not self.state.stop.wait(1.0):
+                if not any(t.is_alive() for t in self._threads):
+                    break
+        finally:
+            self.stop()
+
+    def start(self):
+        for task in self.tasks:
+            thread = threading.Thread(target=self._task_loop, args=(task,), name=f"task-{task.name}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        """Сигнал остановки и ожидание текущих запусков (не дольше shutdown_timeout)."""
+        self.state.request_stop()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                log.warning(f"⚠️ Задача {thread.name} не завершилась за {self.shutdown_timeout} с")
+        self._threads = []
+
+    def _task_loop(self, task):
+        task.prepare()
+        while not self.state.stop.is_set():
+            # Срок пересчитывается после каждого ожидания: ранний выход из wait
+            # или уход часов приводят к повторному ожиданию, а не к раннему запуску
+            delay = task.seconds_until_due()
+            if delay > 0:
+                started = time.monotonic()
+                self.state.stop.wait(delay)
+                metrics.inc("sleep_seconds_total", time.monotonic() - started, reason="idle")
+                continue
+            task.run_once(self.state)
+
+    def _run_sequential(self):
+        for task in self.tasks:
+            task.prepare()
+        while not self.state.stop.is_set():
+            # min() берёт первую из равных — порядок tasks сохраняется
+            task = min(self.tasks, key=lambda t: t.seconds_until_due())
+            delay = task.seconds_until_due()
+            if delay > 0:
+                metrics.sleep(delay, "idle")
+            task.run_once(self.state)
+
+
+class Prefetcher:
+    def __init__(self, func, interval, enabled=True):
+        """
+        Контекст: пока выполняется тело with (вызов AI), func() повторяется в фоне
+        раз в interval секунд. На выходе ждёт текущий запуск, чтобы данные были
+        готовы к следующему шагу.
+        """
+        self.func = func
+        self.interval = interval
+        self.enabled = enabled
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"runs": 0, "errors": 0}
+
+    def __enter__(self):
+        if self.enabled:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=max(self.interval, 5.0))
+            self._thread = None
+        return False
+
+    def _loop(self):
+        while True:
+            try:
+                self.func()
+                self.stats["runs"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.warning(f"⚠️ Предзагрузка: {e}")
+            if self._stop.wait(self.interval):
+                return
@@ -15,6 +15,64 @@ HYPERLIQUID_ACCOUNT_ADDRESS = os.getenv("HYPERLIQUID_ACCOUNT_ADDRESS", "")
 HYPERLIQUID_PRIVATE_KEY = os.getenv("HYPERLIQUID_PRIVATE_KEY", "")
 USE_HYPERLIQUID = True
 
+# Кеш метаданных активов (szDecimals, maxLeverage) на диске: старт без ожидания сети,
+# обновление в фоне, если кеш старше TTL
+ASSET_META_CACHE_FILE = "asset_meta_cache.json"
+ASSET_META_TTL_SECONDS = 6 * 3600
+
+# Загрузка исполнений (fills.py): глубина первой загрузки без курсора и
+# перекрытие окна (fills с задержкой публикации), дубли отсекаются по tid
+FILLS_INITIAL_LOOKBACK_HOURS = 24
+FILLS_CURSOR_OVERLAP_MS = 60 * 1000
+
+# Push-состояние аккаунта по WebSocket (user_stream.py): ордера и позиции отдаются
+# из книги в памяти, REST — для сверки раз в USER_STREAM_RESYNC_SECONDS или если
+# книга устарела (нет сообщений USER_STREAM_STALE_SECONDS)
+USER_STREAM_ENABLED = False
+USER_STREAM_URL = HYPERLIQUID_API_URL.replace("https://", "wss://") + "/ws"
+USER_STREAM_RESYNC_SECONDS = 60
+USER_STREAM_STALE_SECONDS = 30
+USER_STREAM_PING_SECONDS = 20
+
+# Метрики (metrics.py): время фаз цикла, запросы API по endpoint, ошибки, паузы.
+# HTTP /metrics в формате Prometheus на METRICS_HOST:METRICS_PORT (0 — без сервера)
+ENABLE_METRICS = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+METRICS_SUMMARY_INTERVAL = 300       # Секунд между сводными строками
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# ==================== Логи ====================
+LOG_LEVEL = "INFO"                   # DEBUG / INFO / WARNING / ERROR
+LOG_CONSOLE = True                   # Дублировать сообщения в консоль (текстом, как print)
+LOG_FILE = "bot.log.jsonl"           # JSON Lines; "" — без файла
+LOG_MAX_BYTES = 10 * 1024 * 1024     # Ротация по размеру файла
+LOG_BACKUP_COUNT = 5                 # bot.log.jsonl.1 ... .5
+
+# ==================== База данных ====================
+DB_PATH = "positions.db"
+DB_CACHE_SIZE_KB = 8192          # PRAGMA cache_size
+DB_MMAP_SIZE = 64 * 1024 * 1024  # PRAGMA mmap_size
+DB_BUSY_TIMEOUT_MS = 5000
+DB_STATEMENT_CACHE = 256         # Кеш подготовленных выражений sqlite3
+
+# Фоновая запись: изменения уходят в ограниченную очередь, поток-писатель
+# применяет их пачками; чтения из БД дожидаются записи очереди
+DB_ASYNC_WRITES = True
+DB_WRITE_QUEUE_SIZE = 1000       # Пачек в очереди (при переполнении put() ждёт)
+DB_WRITE_BATCH_SIZE = 500        # Изменений в одной транзакции писателя
+
+# Ретеншн trade_events: события старше самого длинного окна cooldown
+# (+ запас) переносятся из горячей таблицы в архив
+ENABLE_TRADE_EVENTS_RETENTION = True
+RETENTION_INTERVAL_SECONDS = 3600
+RETENTION_GRACE_MINUTES = 60         # Запас сверх самого длинного окна cooldown
+RETENTION_ARCHIVE_MODE = "table"     # "table" — trade_events_archive, "file" — JSONL, "none" — удалить
+RETENTION_ARCHIVE_FILE = "trade_events_archive.jsonl"
+RETENTION_DAILY_AGGREGATES = True    # Дневные счётчики в trade_events_daily
+RETENTION_BATCH_SIZE = 5000          # Строк за одну транзакцию
+RETENTION_VACUUM_PAGES = 1000        # PRAGMA incremental_vacuum(N) за проход
+
 # ==================== AI API ====================
 USE_PERPLEXITY = False
 USE_OPENROUTER = True
@@ -25,8 +83,13 @@ PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_MODEL = "x-ai/grok-4.1-fast"  
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 OPENROUTER_ENABLE_CACHE_CONTROL = False
+OPENROUTER_STREAM = False
+OPENROUTER_INCLUDE_USAGE = True  # usage/cost в ответе (учёт токенов)
+
+# Запись ответов AI (JSONL) для последующего воспроизведения в mock_openrouter.py
+AI_RECORD_RESPONSES_FILE = os.getenv("AI_RECORD_RESPONSES_FILE", "")
 
 # Двухуровневая верификация
 ENABLE_TWO_LEVEL_VERIFICATION = False
@@ -35,6 +98,33 @@ OPENROUTER_MODEL_LEVEL2 = "deepseek/deepseek-v3.2"
 
 SIGNAL_STRATEGY = "any"
 
+AI_REQUEST_TIMEOUT = 120
+
+# Хеджированные запросы: если основная модель не ответила за перцентиль
+# своей наблюдаемой задержки, тот же промпт уходит резервной модели/провайдеру
+ENABLE_AI_HEDGING = False
+AI_HEDGE_BACKUP_MODEL = "deepseek/deepseek-v3.2"
+AI_HEDGE_BACKUP_BASE_URL = ""                    # Пусто — тот же провайдер (OPENROUTER_BASE_URL)
+AI_HEDGE_BACKUP_API_KEY_ENV = "OPENROUTER_API_KEY"
+AI_HEDGE_PERCENTILE = 90.0
+AI_HEDGE_MIN_SAMPLES = 5                         # Замеров до использования перцентиля
+AI_HEDGE_DEFAULT_DELAY = 20.0                    # Секунд, пока замеров мало
+AI_LATENCY_WINDOW = 50                           # Последних замеров на модель
+
+# Пре-скрининг: вызов AI только при изменении состояния индикаторов
+ENABLE_AI_PRESCREEN = True
+PRESCREEN_SCORE_THRESHOLD = 2.0      # Минимальный score изменения сигналов для вызова AI
+PRESCREEN_MAX_STALENESS = 900        # Секунд: принудительный вызов AI не реже этого интервала
+PRESCREEN_WEIGHTS = {
+    "rsi_state": 1.0,
+    "stoch_state": 1.0,
+    "willr_state": 1.0,
+    "stochrsi_state": 0.5,
+    "macd_sign": 1.5,
+    "ema_order": 2.0,
+}
+PRESCREEN_TIMEFRAME_WEIGHTS = {"1d": 2.0, "1h": 1.5, "1m": 1.0}
+
 # ==================== Торговые параметры ====================
 TEST_MODE = False
 TEST_BALANCE = 1000.0
@@ -43,6 +133,45 @@ SYMBOLS = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "BNBUSDT", "DOGEUSDT"]
 MAX_SYMBOLS = 5
 INTERVAL = 180  # ✅ 10 минут
 
+# Параллельные задачи бота (bot_tasks.py): сверка SL/TP не ждёт AI. Решения AI —
+# раз в INTERVAL, свечи — раз в MARKET_DATA_INTERVAL, сверка — раз в RISK_LOOP_INTERVAL
+CONCURRENT_TASKS = True              # False — те же задачи по очереди в одном потоке
+RISK_LOOP_INTERVAL = 5               # Секунд между сверками позиций и SL/TP
+MARKET_DATA_INTERVAL = 60            # Секунд между обновлениями свечей
+MARKET_DATA_MAX_AGE = 300            # Секунд: более старые свечи решение не использует
+TASK_SHUTDOWN_TIMEOUT = 30           # Секунд ожидания задачи при остановке
+
+# Предзагрузка на время вызова AI: баланс/позиции, цены, L2-стакан и метаданные
+# вероятных монет сделки обновляются в фоне, place_order берёт их без запросов
+ENABLE_PREFETCH = True
+PREFETCH_REFRESH_SECONDS = 1.0       # Период обновления, пока ждём AI
+PREFETCH_MAX_AGE = 3.0               # Секунд: более старый ответ запрашивается заново
+PREFETCH_TARGETS = 1                 # Монет с наибольшим изменением сигналов (L2 + метаданные)
+
+# Запуск по закрытиям свечей (scheduler.py): решение AI и обновление свечей идут через
+# смещение после границы бара (UTC), а не через фиксированную паузу после обработки.
+# {таймфрейм: секунд после закрытия}; при False — INTERVAL / MARKET_DATA_INTERVAL
+ALIGN_TO_CANDLE_CLOSE = True
+DECISION_CANDLE_OFFSETS = {"3m": 2.0}
+MARKET_DATA_CANDLE_OFFSETS = {"1m": 1.0}
+SCHEDULE_JITTER_WINDOW = 500         # Запусков в окне статистики jitter
+
+# Рыночный контекст (market_context.py): цены, funding, OI и premium всей вселенной
+# одним запросом metaAndAssetCtxs раз за цикл свечей и во время вызова AI
+ENABLE_MARKET_CONTEXT = True
+MARKET_CONTEXT_MAX_AGE = 300         # Секунд: контекст в промпте и расчёте размера
+MARKET_CONTEXT_PRICE_MAX_AGE = 3.0   # Секунд: цена из контекста вместо all_mids
+MAX_POSITION_OI_PERCENT = 0          # Позиция не больше этой доли open interest, % (0 — без лимита)
+
+# Скрининг всей вселенной perp (screener.py): один запрос metaAndAssetCtxs на цикл
+# свечей, в свечи и AI идут SCAN_TOP_K монет вместо SYMBOLS
+SCAN_UNIVERSE = False
+SCAN_TOP_K = 5
+SCAN_MIN_DAY_VOLUME = 1_000_000      # 24h объём, $
+SCAN_MIN_OPEN_INTEREST = 500_000     # Open interest, $
+SCAN_WEIGHTS = {"volume": 1.0, "open_interest": 0.5, "move": 1.0, "funding": 0.5}
+SCAN_EXCLUDE = []                    # Монеты, которые не торгуем
+
 # Лимиты свечей
 LIMIT_1D = 360
 LIMIT_1H = 200
@@ -66,6 +195,9 @@ NO_ADD_AFTER_TP_MINUTES = 30
 ENABLE_NO_REOPEN_AFTER_SL = True
 NO_REOPEN_AFTER_SL_MINUTES = 90
 
+# Окно подсчёта противоположных сигналов для переворота
+OPPOSITE_SIGNAL_WINDOW_MINUTES = 30
+
 # Пороги перекупленности/перепроданности
 RSI_OVERBOUGHT = 70.0
 RSI_OVERSOLD = 30.0
@@ -93,6 +225,49 @@ AI_SYSTEM_PROMPT = """Ты профессиональный криптотрей
 Action: buy_ETHUSDT | sell_BTCUSDT | hold
 Reason: [Краткое обоснование, до 20 слов на русском]"""
 
+# Режим анализа: "single" — один промпт на все символы,
+# "per_symbol" — параллельные компактные промпты по каждому символу + локальный рейтинг
+AI_ANALYSIS_MODE = "single"
+AI_PARALLEL_MAX_WORKERS = 4
+AI_PER_SYMBOL_MIN_SCORE = 60.0
+
+AI_PER_SYMBOL_SYSTEM_PROMPT = """Ты профессиональный криптотрейдер. Проанализируй данные ОДНОГО актива и оцени силу торгового сигнала.
+
+### Анализ:
+1. Оцени цены и объёмы на таймфреймах 1d, 1h, 1m.
+2. Используй EMA(10,20,50,100,200), MACD, RSI и осцилляторы (Stochastic, StochRSI, Williams %R).
+3. Определи направление и силу сигнала.
+
+### Правила:
+- Score: 0 — сигнала нет, 100 — максимально сильный сигнал
+- Если сигнал слабый - выбирай 'hold'
+- Не выдумывай значения индикаторов
+- СТРОГО следуй формату ответа
+
+### Формат ответа:
+Action: buy | sell | hold
+Score: [число 0-100]
+Reason: [Краткое обоснование, до 20 слов на русском]"""
+
+# Бюджет промпта в токенах (0 — без ограничения). При превышении поля
+# отбрасываются в порядке AI_PROMPT_DROP_ORDER: (таймфрейм, поле)
+AI_PROMPT_TOKEN_BUDGET = 0
+AI_PROMPT_DROP_ORDER = [
+    ("1d", "osc"),
+    ("1m", "osc"),
+    ("1d", "macd"),
+    ("1d", "ema"),
+    ("1h", "osc"),
+    ("1m", "ema"),
+    ("1m", "macd"),
+    ("24h", "ctx"),
+    ("1d", "rsi"),
+    ("1m", "rsi"),
+    ("1h", "ema"),
+    ("1h", "macd"),
+    ("1h", "rsi"),
+]
+
 AI_USER_DATA_TEMPLATE = """Данные рынка:
 
 {market_data}"""
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory индекс недавних событий trade_events для cooldown-проверок без SQL
+и запись событий (БД + индекс). Время — epoch миллисекунды, как в БД.
+"""
+
+import time
+import threading
+from collections import deque
+
+from config import (
+    NO_ADD_AFTER_TP_MINUTES,
+    NO_REOPEN_AFTER_SL_MINUTES,
+    OPPOSITE_SIGNAL_WINDOW_MINUTES,
+)
+from storage import db, now_ms
+
+# Самое длинное окно cooldown + запас: более старые события индексу не нужны
+MAX_COOLDOWN_SECONDS = max(
+    NO_ADD_AFTER_TP_MINUTES,
+    NO_REOPEN_AFTER_SL_MINUTES,
+    OPPOSITE_SIGNAL_WINDOW_MINUTES,
+    5,
+) * 60
+INDEX_RETENTION_SECONDS = MAX_COOLDOWN_SECONDS + 300
+
+
+class TradeEventIndex:
+    def __init__(self, retention_seconds=INDEX_RETENTION_SECONDS):
+        """Упорядоченные по времени события по ключу (symbol, event_type, side)."""
+        self.retention_seconds = retention_seconds
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def load(self, storage, now_ms=None):
+        """Загрузка событий за окно хранения из БД (при старте)."""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        cutoff_ms = now_ms - self.retention_seconds * 1000
+        rows = storage.fetchall(
+            """
+            SELECT symbol, event_type, side, event_time FROM trade_events
+            WHERE event_time > ?
+            ORDER BY event_time
+            """,
+            (cutoff_ms,),
+        )
+        with self._lock:
+            self._events.clear()
+            for symbol, event_type, side, event_time in rows:
+                self._append(symbol, event_type, side, int(event_time))
+        return len(rows)
+
+    def _append(self, symbol, event_type, side, ts_ms):
+        events = self._events.setdefault((symbol, event_type, side), deque())
+        # Вставка с сохранением порядка (события почти всегда приходят по возрастанию)
+        if events and events[-1] > ts_ms:
+            items = sorted(list(events) + [ts_ms])
+            events.clear()
+            events.extend(items)
+        else:
+            events.append(ts_ms)
+        cutoff_ms = events[-1] - self.retention_seconds * 1000
+        while events and events[0] < cutoff_ms:
+            events.popleft()
+
+    def add(self, symbol, event_type, side, ts_ms):
+        with self._lock:
+            self._append(symbol, event_type, side, int(ts_ms))
+
+    def remove(self, symbol, event_type):
+        """Удаление всех событий типа по символу (аналог DELETE при перевороте)."""
+        with self._lock:
+            for key in [k for k in self._events if k[0] == symbol and k[1] == event_type]:
+                del self._events[key]
+
+    def _keys(self, symbol, event_type, side):
+        if side is not None:
+            return [(symbol, event_type, side)]
+        return [k for k in ((symbol, event_type, "long"), (symbol, event_type, "short")) if k in self._events]
+
+    def latest(self, symbol, event_type, side=None, window_seconds=None, now_ms=None):
+        """Время последнего события в окне (epoch мс) или None."""
+        cutoff_ms = self._cutoff(window_seconds, now_ms)
+        with self._lock:
+            latest = None
+            for key in self._keys(symbol, event_type, side):
+                events = self._events.get(key)
+                if events and (latest is None or events[-1] > latest):
+                    latest = events[-1]
+        if latest is None or (cutoff_ms is not None and latest <= cutoff_ms):
+            return None
+        return latest
+
+    def count(self, symbol, event_type, side=None, window_seconds=None, now_ms=None):
+        """Количество событий в окне."""
+        cutoff_ms = self._cutoff(window_seconds, now_ms)
+        total = 0
+        with self._lock:
+            for key in self._keys(symbol, event_type, side):
+                for ts_ms in reversed(self._events.get(key, ())):
+                    if cutoff_ms is not None and ts_ms <= cutoff_ms:
+                        break
+                    total += 1
+        return total
+
+    @staticmethod
+    def _cutoff(window_seconds, now_ms):
+        """Граница окна как в SQL: event_time > now - window."""
+        if window_seconds is None:
+            return None
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        return now_ms - int(window_seconds * 1000)
+
+
+event_index = TradeEventIndex()
+
+
+def log_trade_event(symbol, event_type, side, details="", storage=db, event_time=None):
+    """Логирование торговых событий (TP/SL/opposite_signal) с записью в индекс cooldown"""
+    ts_ms = event_time if event_time is not None else now_ms()
+    storage.insert_trade_event(symbol, event_type, side, details, ts_ms)
+    storage.after_commit(lambda: event_index.add(symbol, event_type, side, ts_ms))
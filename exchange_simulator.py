@@ -0,0 +1,798 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный симулятор биржи Hyperliquid: поверхность Info/Exchange, используемая HyperliquidAPI
+(user_state, open_orders, all_mids, l2_snapshot, candles_snapshot, order, cancel, trigger TP/SL).
+Цены воспроизводятся из хранилища свечей на ускоренных часах — для paper trading и нагрузки
+"""
+
+import json
+import math
+import time
+import argparse
+import threading
+
+import numpy as np
+
+SIM_ADDRESS = "0x000000000000000000000000000000000000dEaD"
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "8h": 28_800_000,
+    "12h": 43_200_000,
+    "1d": 86_400_000,
+}
+
+_real_time = time
+
+
+class SimulationFinished(BaseException):
+    """Свечи закончились. BaseException — чтобы не глушилось общими except Exception в цикле бота."""
+
+
+# ---------- Хранилище свечей ----------
+def _normalize_candle(candle):
+    """Свеча SDK ({"t": мс, "o": "..."}), бота ({"t": сек}) или массив [t, o, h, l, c, v] → кортеж."""
+    if isinstance(candle, dict):
+        t = float(candle["t"])
+        o, h, l, c = (float(candle[k]) for k in ("o", "h", "l", "c"))
+        v = float(candle.get("v", 0))
+    else:
+        t, o, h, l, c, v = (float(x) for x in candle[:6])
+    # Секунды (формат get_market_data) → миллисекунды
+    t_ms = int(t * 1000) if t < 1e11 else int(t)
+    return t_ms, o, h, l, c, v
+
+
+def load_candle_store(source):
+    """
+    Загрузка свечей: путь к JSON или dict вида {coin: {interval: [candles]}}.
+    Символы вида BTCUSDT приводятся к монете BTC.
+    """
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8") as f:
+            source = json.load(f)
+
+    store = {}
+    for symbol, intervals in source.items():
+        coin = symbol[:-4] if symbol.endswith("USDT") else symbol
+        store[coin] = {}
+        for interval, candles in intervals.items():
+            if interval not in INTERVAL_MS or not candles:
+                continue
+            rows = sorted(_normalize_candle(c) for c in candles)
+            store[coin][interval] = np.array(rows, dtype=float)
+    return store
+
+
+def save_candle_store(path, store):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {coin: {i: arr.tolist() for i, arr in intervals.items()} for coin, intervals in store.items()},
+            f,
+        )
+
+
+def _aggregate(base, interval_ms):
+    """OHLCV базовых свечей → свечи interval_ms (начало корзины кратно interval_ms)."""
+    if len(base) == 0:
+        return base
+    buckets = (base[:, 0] // interval_ms).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(base)]
+    out = np.empty((len(starts), 6), dtype=float)
+    out[:, 0] = buckets[starts] * interval_ms
+    out[:, 1] = base[starts, 1]
+    out[:, 2] = np.maximum.reduceat(base[:, 2], starts)
+    out[:, 3] = np.minimum.reduceat(base[:, 3], starts)
+    out[:, 4] = base[ends - 1, 4]
+    out[:, 5] = np.add.reduceat(base[:, 5], starts)
+    return out
+
+
+# ---------- Часы ----------
+class SimClock:
+    """
+    Симулированное время. speed=N — в N раз быстрее реального (sleep ждёт s/N);
+    speed=None — время двигают только sleep(), без реального ожидания.
+    """
+
+    def __init__(self, start_ms, speed=None):
+        self.start_ms = int(start_ms)
+        self.speed = speed
+        self._offset_ms = 0
+        self._real_start = _real_time.monotonic()
+        self._lock = threading.Lock()
+
+    def now_ms(self):
+        with self._lock:
+            now = self.start_ms + self._offset_ms
+            if self.speed:
+                now += int((_real_time.monotonic() - self._real_start) * self.speed * 1000)
+            return now
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.speed:
+            _real_time.sleep(seconds / self.speed)
+        else:
+            with self._lock:
+                self._offset_ms += int(seconds * 1000)
+
+
+class SimTime:
+    """Замена модуля time для кода бота: time/monotonic/sleep идут по SimClock, остальное — реальное."""
+
+    def __init__(self, clock, on_sleep=None):
+        self._clock = clock
+        self._on_sleep = on_sleep
+
+    def time(self):
+        return self._clock.now_ms() / 1000
+
+    def monotonic(self):
+        return self._clock.now_ms() / 1000
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+        if self._on_sleep:
+            self._on_sleep()
+
+    def __getattr__(self, name):
+        return getattr(_real_time, name)
+
+
+# ---------- Биржа ----------
+class ExchangeSimulator:
+    def __init__(self, candles, balance=1000.0, clock=None, speed=None, leverage=10,
+                 taker_fee=0.00045, spread_bps=2.0, base_interval=None, start_ms=None):
+        """
+        candles — результат load_candle_store() (или путь/словарь для него).
+        Цена монеты в момент t — close последней базовой свечи с началом <= t.
+        """
+        self.store = candles if _is_loaded_store(candles) else load_candle_store(candles)
+        if not self.store:
+            raise ValueError("Нет свечей для симуляции")
+
+        self.leverage = leverage
+        self.taker_fee = taker_fee
+        self.spread = spread_bps / 10000
+        self.balance = float(balance)
+        self.lock = threading.RLock()
+
+        self._base_interval = {}
+        self._base = {}
+        self._aggregated = {}
+        for coin, intervals in self.store.items():
+            interval = base_interval if base_interval in intervals else min(intervals, key=INTERVAL_MS.get)
+            self._base_interval[coin] = interval
+            self._base[coin] = intervals[interval]
+
+        first = max(arr[0, 0] for arr in self._base.values())
+        self.end_ms = int(min(arr[-1, 0] for arr in self._base.values()))
+        # По умолчанию старт с запасом истории для индикаторов (половина данных)
+        if start_ms is None:
+            start_ms = first + (self.end_ms - first) // 2
+        self.clock = clock or SimClock(start_ms, speed)
+
+        self.positions = {}   # coin → {"szi", "entry_px"}
+        self.orders = {}      # oid → order dict
+        self.fills = []
+        self.stats = {"orders": 0, "fills": 0, "triggers": 0, "cancels": 0, "rejects": 0}
+        self._next_oid = 1
+        # on_event(channel, data) — события как в WebSocket user events (mock_user_stream)
+        self.on_event = None
+        self._state_changed = False
+        self._cursor = {coin: self._index_at(coin, self.clock.now_ms()) for coin in self._base}
+
+        self.sz_decimals = {coin: _default_sz_decimals(self._base[coin][0, 4]) for coin in self._base}
+        self.info = SimInfo(self)
+        self.exchange = SimExchange(self)
+
+    # ---------- Рынок ----------
+    def _index_at(self, coin, now_ms):
+        """Индекс последней базовой свечи с началом <= now_ms."""
+        return max(0, int(np.searchsorted(self._base[coin][:, 0], now_ms, side="right")) - 1)
+
+    def mid(self, coin):
+        return float(self._base[coin][self._cursor[coin], 4])
+
+    def finished(self):
+        return self.clock.now_ms() > self.end_ms
+
+    def advance(self):
+        """Продвижение рынка до текущего времени часов: исполнение триггеров и лимиток по h/l свечей."""
+        with self.lock:
+            now = self.clock.now_ms()
+            for coin, base in self._base.items():
+                target = self._index_at(coin, now)
+                cursor = self._cursor[coin]
+                while cursor < target:
+                    cursor += 1
+                    self._cursor[coin] = cursor
+                    _, _, high, low, _, _ = base[cursor]
+                    self._match_resting(coin, high, low)
+            self._publish_state()
+
+    # ---------- События ----------
+    def _emit(self, channel, data):
+        if self.on_event is not None:
+            self._state_changed = True
+            self.on_event(channel, data)
+
+    def _emit_order(self, order, status):
+        self._emit("orderUpdates", [{
+            "order": {
+                "coin": order["coin"], "side": "B" if order["is_buy"] else "A",
+                "limitPx": str(order["limit_px"]), "sz": str(order["sz"]), "oid": order["oid"],
+                "timestamp": order["timestamp"], "origSz": str(order["sz"]),
+            },
+            "status": status,
+            "statusTimestamp": self.clock.now_ms(),
+        }])
+
+    def _publish_state(self):
+        """Снимок webData2 после изменений (как поток Hyperliquid после каждого блока с событиями)."""
+        if self.on_event is not None and self._state_changed:
+            self._state_changed = False
+            self.on_event("webData2", self.info.web_data())
+
+    def _match_resting(self, coin, high, low):
+        for oid in sorted(self.orders):
+            order = self.orders.get(oid)
+            if order is None or order["coin"] != coin:
+                continue
+
+            px = order["trigger_px"] if order["trigger_px"] is not None else order["limit_px"]
+            if order["trigger_px"] is not None:
+                # Покупка срабатывает на росте для SL (шорт) и на падении для TP (шорт); продажа — наоборот
+                rising = (order["is_buy"] and order["tpsl"] == "sl") or (not order["is_buy"] and order["tpsl"] == "tp")
+                hit = high >= px if rising else low <= px
+            else:
+                hit = low <= px if order["is_buy"] else high >= px
+            if not hit:
+                continue
+
+            del self.orders[oid]
+            if order["trigger_px"] is not None:
+                self.stats["triggers"] += 1
+            self._emit_order(order, "filled")
+            self._fill(coin, order["is_buy"], order["sz"], px, oid, order["reduce_only"])
+
+    # ---------- Исполнение ----------
+    def _fill(self, coin, is_buy, sz, px, oid, reduce_only=False):
+        position = self.positions.get(coin, {"szi": 0.0, "entry_px": 0.0})
+        szi = position["szi"]
+        signed = sz if is_buy else -sz
+
+        if reduce_only:
+            if szi == 0 or (szi > 0) == is_buy:
+                return 0.0
+            signed = math.copysign(min(abs(signed), abs(szi)), signed)
+
+        closed_pnl = 0.0
+        if szi != 0 and (szi > 0) != (signed > 0):
+            closing = min(abs(signed), abs(szi))
+            closed_pnl = (px - position["entry_px"]) * closing * (1 if szi > 0 else -1)
+            new_szi = szi + signed
+            if abs(new_szi) < 1e-12:
+                new_szi = 0.0
+            entry_px = position["entry_px"] if (new_szi == 0 or (new_szi > 0) == (szi > 0)) else px
+        else:
+            new_szi = szi + signed
+            entry_px = (abs(szi) * position["entry_px"] + abs(signed) * px) / abs(new_szi)
+
+        fee = abs(signed) * px * self.taker_fee
+        self.balance += closed_pnl - fee
+
+        if new_szi == 0:
+            self.positions.pop(coin, None)
+        else:
+            self.positions[coin] = {"szi": new_szi, "entry_px": entry_px}
+
+        self.fills.append({
+            "coin": coin,
+            "px": str(px),
+            "sz": str(abs(signed)),
+            "side": "B" if signed > 0 else "A",
+            "time": self.clock.now_ms(),
+            "startPosition": str(szi),
+            "dir": _fill_direction(szi, new_szi),
+            "tid": len(self.fills) + 1,
+            "closedPnl": str(closed_pnl),
+            "fee": str(fee),
+            "oid": oid,
+            "crossed": True,
+        })
+        self.stats["fills"] += 1
+        self._emit("userFills", {"isSnapshot": False, "user": SIM_ADDRESS, "fills": [self.fills[-1]]})
+        return abs(signed)
+
+    def place(self, coin, is_buy, sz, limit_px, order_type, reduce_only=False):
+        with self.lock:
+            result = self._place(coin, is_buy, sz, limit_px, order_type, reduce_only)
+            self._publish_state()
+            return result
+
+    def _place(self, coin, is_buy, sz, limit_px, order_type, reduce_only):
+        with self.lock:
+            self.advance()
+            self.stats["orders"] += 1
+
+            if coin not in self._base:
+                return self._reject(f"Unknown asset {coin}")
+            if sz <= 0:
+                return self._reject("Order has zero size.")
+
+            oid = self._next_oid
+            self._next_oid += 1
+
+            trigger = order_type.get("trigger") if isinstance(order_type, dict) else None
+            if trigger:
+                self.orders[oid] = {
+                    "coin": coin, "oid": oid, "is_buy": is_buy, "sz": float(sz),
+                    "limit_px": float(limit_px), "trigger_px": float(trigger["triggerPx"]),
+                    "tpsl": trigger.get("tpsl"), "reduce_only": reduce_only,
+                    "timestamp": self.clock.now_ms(),
+                }
+                self._emit_order(self.orders[oid], "open")
+                return _order_response({"resting": {"oid": oid}})
+
+            mid = self.mid(coin)
+            touch = mid * (1 + self.spread / 2) if is_buy else mid * (1 - self.spread / 2)
+            marketable = limit_px >= touch if is_buy else limit_px <= touch
+
+            if marketable:
+                filled = self._fill(coin, is_buy, float(sz), touch, oid, reduce_only)
+                if filled <= 0:
+                    return self._reject("Reduce only order would increase position.")
+                return _order_response({"filled": {"totalSz": str(filled), "avgPx": str(touch), "oid": oid}})
+
+            tif = order_type.get("limit", {}).get("tif") if isinstance(order_type, dict) else None
+            if tif == "Ioc":
+                return self._reject("Order could not immediately match against any resting orders.")
+
+            self.orders[oid] = {
+                "coin": coin, "oid": oid, "is_buy": is_buy, "sz": float(sz),
+                "limit_px": float(limit_px), "trigger_px": None, "tpsl": None,
+                "reduce_only": reduce_only, "timestamp": self.clock.now_ms(),
+            }
+            self._emit_order(self.orders[oid], "open")
+            return _order_response({"resting": {"oid": oid}})
+
+    def cancel(self, coin, oid):
+        with self.lock:
+            order = self.orders.get(oid)
+            if order is None or order["coin"] != coin:
+                return {"status": "ok", "response": {"type": "cancel", "data": {
+                    "statuses": [{"error": "Order was never placed, already canceled, or filled."}]
+                }}}
+            del self.orders[oid]
+            self.stats["cancels"] += 1
+            self._emit_order(order, "canceled")
+            self._publish_state()
+            return {"status": "ok", "response": {"type": "cancel", "data": {"statuses": ["success"]}}}
+
+    def _reject(self, message):
+        self.stats["rejects"] += 1
+        return _order_response({"error": message})
+
+    # ---------- Состояние ----------
+    def account_value(self):
+        unrealized = sum(
+            (self.mid(coin) - p["entry_px"]) * p["szi"] for coin, p in self.positions.items()
+        )
+        return self.balance + unrealized
+
+    def margin_used(self):
+        return sum(abs(p["szi"]) * self.mid(coin) / self.leverage for coin, p in self.positions.items())
+
+    def candles(self, coin, interval, start_ms, end_ms):
+        """Свечи без заглядывания в будущее: закрытые корзины + текущая частичная из базовых свечей."""
+        with self.lock:
+            self.advance()
+            if coin not in self._base or interval not in INTERVAL_MS:
+                return []
+
+            now = self.clock.now_ms()
+            end_ms = min(end_ms, now)
+            base_interval = self._base_interval[coin]
+            interval_ms = INTERVAL_MS[interval]
+
+            if interval_ms < INTERVAL_MS[base_interval]:
+                return []
+            if interval == base_interval:
+                arr = self._base[coin][: self._cursor[coin] + 1]
+            else:
+                key = (coin, interval)
+                if key not in self._aggregated:
+                    self._aggregated[key] = _aggregate(self._base[coin], interval_ms)
+                full = self._aggregated[key]
+                bucket_start = (now // interval_ms) * interval_ms
+                closed = full[: int(np.searchsorted(full[:, 0], bucket_start, side="left"))]
+                base = self._base[coin]
+                lo = int(np.searchsorted(base[:, 0], bucket_start, side="left"))
+                partial = _aggregate(base[lo: self._cursor[coin] + 1], interval_ms)
+                arr = np.vstack([closed, partial]) if len(partial) else closed
+
+            lo = int(np.searchsorted(arr[:, 0], start_ms, side="left"))
+            hi = int(np.searchsorted(arr[:, 0], end_ms, side="right"))
+            return [
+                {
+                    "t": int(t), "T": int(t) + interval_ms - 1, "s": coin, "i": interval,
+                    "o": str(o), "h": str(h), "l": str(l), "c": str(c), "v": str(v), "n": 0,
+                }
+                for t, o, h, l, c, v in arr[lo:hi]
+            ]
+
+    def summary(self):
+        with self.lock:
+            return {
+                "sim_time_ms": self.clock.now_ms(),
+                "balance": self.balance,
+                "account_value": self.account_value(),
+                "positions": {c: dict(p) for c, p in self.positions.items()},
+                "open_orders": len(self.orders),
+                **self.stats,
+            }
+
+
+class SimInfo:
+    """Поверхность hyperliquid.info.Info."""
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def meta(self):
+        return {"universe": [
+            {"name": coin, "szDecimals": self.sim.sz_decimals[coin], "maxLeverage": 50}
+            for coin in sorted(self.sim._base)
+        ]}
+
+    def meta_and_asset_ctxs(self):
+        """Контексты по базовым свечам: prevDayPx — цена сутки назад, объём за 24 ч, OI и funding — модельные."""
+        sim = self.sim
+        with sim.lock:
+            sim.advance()
+            now = sim.clock.now_ms()
+            ctxs = []
+            for coin in sorted(sim._base):
+                base = sim._base[coin][: sim._cursor[coin] + 1]
+                day = base[int(np.searchsorted(base[:, 0], now - 86_400_000, side="left")):]
+                mid = sim.mid(coin)
+                prev_day = float(day[0, 4]) if len(day) else mid
+                volume = float((day[:, 5] * day[:, 4]).sum()) if len(day) else 0.0
+                ctxs.append({
+                    "markPx": str(mid), "midPx": str(mid), "oraclePx": str(mid),
+                    "prevDayPx": str(prev_day), "dayNtlVlm": str(volume),
+                    "openInterest": str(volume / mid / 4 if mid else 0.0),
+                    "funding": str(max(-0.0005, min(0.0005, (mid / prev_day - 1) * 0.01))),
+                    "premium": "0.0",
+                })
+            return self.meta(), ctxs
+
+    def all_mids(self):
+        sim = self.sim
+        with sim.lock:
+            sim.advance()
+            return {coin: str(sim.mid(coin)) for coin in sim._base}
+
+    def user_state(self, address):
+        with self.sim.lock:
+            self.sim.advance()
+            return self._user_state()
+
+    def _user_state(self):
+        sim = self.sim
+        with sim.lock:
+            asset_positions = []
+            for coin, p in sim.positions.items():
+                mid = sim.mid(coin)
+                asset_positions.append({"type": "oneWay", "position": {
+                    "coin": coin,
+                    "szi": str(p["szi"]),
+                    "entryPx": str(p["entry_px"]),
+                    "positionValue": str(abs(p["szi"]) * mid),
+                    "unrealizedPnl": str((mid - p["entry_px"]) * p["szi"]),
+                    "leverage": {"type": "cross", "value": sim.leverage},
+                }})
+            account_value = sim.account_value()
+            margin_used = sim.margin_used()
+            return {
+                "marginSummary": {
+                    "accountValue": str(account_value),
+                    "totalMarginUsed": str(margin_used),
+                    "totalNtlPos": str(margin_used * sim.leverage),
+                },
+                "withdrawable": str(max(0.0, account_value - margin_used)),
+                "assetPositions": asset_positions,
+                "time": sim.clock.now_ms(),
+            }
+
+    def open_orders(self, address):
+        with self.sim.lock:
+            self.sim.advance()
+            return self._open_orders()
+
+    def web_data(self, address=None):
+        """Данные канала webData2 (без продвижения рынка)."""
+        with self.sim.lock:
+            return {"clearinghouseState": self._user_state(), "openOrders": self._open_orders()}
+
+    def _open_orders(self):
+        sim = self.sim
+        with sim.lock:
+            result = []
+            for order in sim.orders.values():
+                if order["trigger_px"] is not None:
+                    order_type = {"trigger": {
+                        "triggerPx": str(order["trigger_px"]), "isMarket": True, "tpsl": order["tpsl"],
+                    }}
+                else:
+                    order_type = {"limit": {"tif": "Gtc"}}
+                result.append({
+                    "coin": order["coin"],
+                    "oid": order["oid"],
+                    "side": "B" if order["is_buy"] else "A",
+                    "sz": str(order["sz"]),
+                    "limitPx": str(order["limit_px"]),
+                    "reduceOnly": order["reduce_only"],
+                    "orderType": order_type,
+                    "timestamp": order["timestamp"],
+                })
+            return result
+
+    def l2_snapshot(self, coin):
+        sim = self.sim
+        with sim.lock:
+            sim.advance()
+            mid = sim.mid(coin)
+            half = sim.spread / 2
+            return {
+                "coin": coin,
+                "time": sim.clock.now_ms(),
+                "levels": [
+                    [{"px": str(mid * (1 - half)), "sz": "1000000", "n": 1}],
+                    [{"px": str(mid * (1 + half)), "sz": "1000000", "n": 1}],
+                ],
+            }
+
+    def candles_snapshot(self, name, interval, startTime, endTime):
+        return self.sim.candles(name, interval, startTime, endTime)
+
+    def user_fills_by_time(self, address, start_time, end_time=None):
+        sim = self.sim
+        with sim.lock:
+            end_time = end_time if end_time is not None else sim.clock.now_ms()
+            return [f for f in sim.fills if start_time <= f["time"] <= end_time]
+
+    def user_fills(self, address):
+        with self.sim.lock:
+            return list(self.sim.fills)
+
+
+class SimExchange:
+    """Поверхность hyperliquid.exchange.Exchange."""
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def order(self, name, is_buy, sz, limit_px, order_type, reduce_only=False, cloid=None, builder=None):
+        return self.sim.place(name, is_buy, float(sz), float(limit_px), order_type, reduce_only)
+
+    def cancel(self, name, oid):
+        return self.sim.cancel(name, oid)
+
+    def bulk_orders(self, order_requests, builder=None):
+        return _bulk_response("order", [
+            self.order(r["coin"], r["is_buy"], r["sz"], r["limit_px"], r["order_type"], r.get("reduce_only", False))
+            for r in order_requests
+        ])
+
+    def bulk_cancel(self, cancel_requests):
+        return _bulk_response("cancel", [self.cancel(r["coin"], r["oid"]) for r in cancel_requests])
+
+    def bulk_modify_orders_new(self, modify_requests):
+        """Modify как на бирже: старый ордер снимается, новый ставится с новым oid."""
+        responses = []
+        for r in modify_requests:
+            order = r["order"]
+            cancelled = self.cancel(order["coin"], r["oid"])
+            if "error" in cancelled["response"]["data"]["statuses"][0]:
+                responses.append(cancelled)
+                continue
+            responses.append(self.order(
+                order["coin"], order["is_buy"], order["sz"], order["limit_px"],
+                order["order_type"], order.get("reduce_only", False),
+            ))
+        return _bulk_response("order", responses)
+
+
+def _order_response(status):
+    return {"status": "ok", "response": {"type": "order", "data": {"statuses": [status]}}}
+
+
+def _fill_direction(start, end):
+    """Поле dir fills Hyperliquid: Open/Close Long/Short или переворот."""
+    if start and end and (start > 0) != (end > 0):
+        return "Long > Short" if start > 0 else "Short > Long"
+    if abs(end) > abs(start) or not start:
+        return "Open Long" if end > 0 else "Open Short"
+    return "Close Long" if start > 0 else "Close Short"
+
+
+def _bulk_response(kind, responses):
+    statuses = [r["response"]["data"]["statuses"][0] for r in responses]
+    return {"status": "ok", "response": {"type": kind, "data": {"statuses": statuses}}}
+
+
+def _is_loaded_store(candles):
+    return isinstance(candles, dict) and all(
+        isinstance(arr, np.ndarray) for intervals in candles.values() for arr in intervals.values()
+    )
+
+
+def _default_sz_decimals(price):
+    """Грубая оценка szDecimals по цене (BTC ~5, ETH ~4, DOGE ~0)."""
+    if price <= 0:
+        return 0
+    return max(0, min(5, int(math.floor(math.log10(price))) + 1))
+
+
+# ---------- Запуск бота против симулятора ----------
+def run_paper_trading(sim, db_path, max_cycles=None, mock_ai=False, user_stream=False):
+    """
+    Основной цикл trading_bot против симулятора: время модулей бота заменяется на SimTime,
+    HyperliquidAPI получает SimInfo/SimExchange, БД и кеш метаданных — отдельные файлы.
+    user_stream — ордера и позиции через UserStream и локальный mock_user_stream.
+    """
+    import os
+
+    if mock_ai:
+        from mock_openrouter import MockBehavior, start_mock_server
+        server, base_url = start_mock_server(MockBehavior(latency_ms=0))
+        os.environ["OPENROUTER_BASE_URL"] = base_url
+        os.environ.setdefault("OPENROUTER_API_KEY", "mock-key")
+
+    import storage
+    import event_index
+    import retention
+    import utils
+    import hyperliquid_api
+    import metrics
+    import scheduler
+    import bot_tasks
+    import trading_bot
+
+    if mock_ai:
+        utils.OPENROUTER_BASE_URL = base_url
+
+    cycles = {"count": 0}
+
+    def on_sleep():
+        if sim.finished():
+            raise SimulationFinished()
+        if max_cycles is not None and cycles["count"] >= max_cycles:
+            raise SimulationFinished()
+
+    sim_time = SimTime(sim.clock, on_sleep)
+    for module in (storage, event_index, retention, utils, hyperliquid_api, metrics, scheduler, bot_tasks):
+        module.time = sim_time
+
+    stream, server = None, None
+    if user_stream:
+        from mock_user_stream import start_user_stream_server
+        from user_stream import UserStream
+        server, stream_url = start_user_stream_server(snapshot_provider=sim.info.web_data)
+        sim.on_event = server.publish
+        stream = UserStream(url=stream_url, address=SIM_ADDRESS)
+
+    storage.db.path = db_path
+    hyperliquid_api.ASSET_META_CACHE_FILE = db_path + ".meta.json"
+    hyperliquid_api.set_hl_api(
+        hyperliquid_api.HyperliquidAPI(
+            info=sim.info, exchange=sim.exchange, address=SIM_ADDRESS, stream=stream
+        ).connect()
+    )
+    if stream is not None and not stream.wait_ready():
+        print("⚠️ User stream не готов, состояние через REST")
+    trading_bot.TEST_MODE = False
+    trading_bot.SYMBOLS = [coin + "USDT" for coin in sorted(sim._base)]
+    # Задачи по очереди в одном потоке: время симуляции двигают только их паузы
+    original_concurrent = trading_bot.CONCURRENT_TASKS
+    trading_bot.CONCURRENT_TASKS = False
+    original_metrics_port = trading_bot.METRICS_PORT
+    trading_bot.METRICS_PORT = 0
+
+    original_decision = trading_bot.decision_cycle
+
+    def counted_decision_cycle(state):
+        cycles["count"] += 1
+        return original_decision(state)
+
+    trading_bot.decision_cycle = counted_decision_cycle
+
+    started = _real_time.perf_counter()
+    try:
+        trading_bot.main()
+    except SimulationFinished:
+        pass
+    finally:
+        trading_bot.decision_cycle = original_decision
+        trading_bot.CONCURRENT_TASKS = original_concurrent
+        trading_bot.METRICS_PORT = original_metrics_port
+        storage.db.close()
+        hyperliquid_api.close_hl_api()
+        if server is not None:
+            sim.on_event = None
+            server.stop()
+
+    summary = sim.summary()
+    if stream is not None:
+        summary["stream"] = dict(stream.stats)
+    summary["cycles"] = cycles["count"]
+    summary["wall_seconds"] = _real_time.perf_counter() - started
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулятор Hyperliquid для paper trading")
+    parser.add_argument("--candles", default=None, help="JSON со свечами {coin: {interval: [...]}}")
+    parser.add_argument("--synthetic", type=int, default=0, help="Сгенерировать N синтетических символов")
+    parser.add_argument("--save-candles", default=None, help="Сохранить используемые свечи в JSON")
+    parser.add_argument("--balance", type=float, default=1000.0)
+    parser.add_argument("--speed", type=float, default=None, help="Ускорение; по умолчанию — только sleep двигает время")
+    parser.add_argument("--cycles", type=int, default=None, help="Остановиться после N циклов решений бота")
+    parser.add_argument("--db", default="sim_positions.db")
+    parser.add_argument("--mock-ai", action="store_true", help="AI через локальный mock_openrouter")
+    parser.add_argument("--user-stream", action="store_true", help="Ордера и позиции через WebSocket-заменитель")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.candles:
+        store = load_candle_store(args.candles)
+    elif args.synthetic:
+        from benchmark_ai import generate_synthetic_market_data
+        symbols = [f"SIM{i}USDT" for i in range(args.synthetic)]
+        store = load_candle_store(generate_synthetic_market_data(
+            symbols, seed=args.seed, limits={"1m": 4 * 1440}
+        ))
+    else:
+        parser.error("Нужен --candles или --synthetic")
+
+    if args.save_candles:
+        save_candle_store(args.save_candles, store)
+
+    # Лог бота — рядом с БД симуляции, а не в bot.log.jsonl боевого запуска
+    from bot_logging import setup_logging, stop_logging
+    setup_logging(path=args.db + ".log.jsonl")
+
+    sim = ExchangeSimulator(store, balance=args.balance, speed=args.speed)
+    summary = run_paper_trading(
+        sim, args.db, max_cycles=args.cycles, mock_ai=args.mock_ai, user_stream=args.user_stream
+    )
+
+    # Сводка — после всех сообщений бота из очереди логов (trading_bot.main() уже мог остановить вывод)
+    stop_logging()
+
+    print("=" * 60)
+    print(f"🧪 Симуляция: {summary['cycles']} циклов за {summary['wall_seconds']:.1f} с")
+    print(f"💰 Баланс: ${summary['balance']:.2f} | Equity: ${summary['account_value']:.2f}")
+    print(f"📊 Ордеров {summary['orders']} | fills {summary['fills']} | триггеров {summary['triggers']} | "
+          f"отмен {summary['cancels']} | отказов {summary['rejects']}")
+    if "stream" in summary:
+        stream = summary["stream"]
+        print(f"🔌 User stream: сообщений {stream['messages']} | чтений из книги {stream['reads']} | "
+              f"сверок REST {stream['resets']} | расхождений {stream['drift']} | пропусков {stream['gaps']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
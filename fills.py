@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальная загрузка исполнений (user fills) с курсором в БД. Каждый fill
+атрибутируется по oid (entry/tp/sl/flip, иначе manual) и меняет состояние
+позиции ровно один раз: уровни TP, событие SL, размер и закрытие с причиной.
+"""
+
+from config import FILLS_INITIAL_LOOKBACK_HOURS, FILLS_CURSOR_OVERLAP_MS
+from storage import db, now_ms
+from event_index import log_trade_event
+from hyperliquid_api import hl_api
+from analytics import record_closed_position
+from bot_logging import get_logger
+
+log = get_logger("fills")
+
+FILLS_CURSOR = "user_fills"
+ORDER_KINDS = ("entry", "tp", "sl", "flip")
+
+# Причина закрытия по назначению закрывающего ордера
+_CLOSE_REASONS = {"tp": "tp", "sl": "sl", "flip": "flip"}
+
+# Остаток позиции меньше этой доли размера fill считается нулём
+_ZERO_EPS = 1e-9
+
+_CLOSE_SQL = """
+UPDATE positions
+SET status='closed', closed_at=?, close_reason=?, last_known_size=0,
+    profit=(
+        SELECT SUM(f.closed_pnl - f.fee) FROM fills f
+        WHERE f.coin = ? AND f.time <= ? AND (
+            f.position_id = positions.id
+            OR (f.position_id IS NULL AND f.time >= COALESCE(positions.opened_at, 0))
+        )
+    )
+WHERE id=?
+"""
+
+
+# ---------- Назначение ордеров ----------
+def result_oid(result):
+    """oid первого статуса ответа Exchange (resting или filled) или None."""
+    try:
+        status = result["response"]["data"]["statuses"][0]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return status_oid(status)
+
+
+def status_oid(status):
+    if not isinstance(status, dict):
+        return None
+    for key in ("resting", "filled"):
+        if isinstance(status.get(key), dict) and status[key].get("oid") is not None:
+            return int(status[key]["oid"])
+    return None
+
+
+def tag_order(symbol, kind, oid, storage=db):
+    """Запоминание назначения ордера (oid → kind) для атрибуции его fills."""
+    if oid is None:
+        return
+    if kind not in ORDER_KINDS:
+        raise ValueError(f"Неизвестное назначение ордера: {kind}")
+    storage.write(
+        "INSERT OR REPLACE INTO order_tags (oid, symbol, kind, created_at) VALUES (?, ?, ?, ?)",
+        (int(oid), symbol, kind, now_ms()),
+    )
+
+
+def tag_orders(orders, storage=db):
+    """
+    Назначение открытых TP/SL ордеров из снимка (ордера, выставленные до учёта oid).
+    Пишутся только ордера без назначения: при неизменных ордерах сверка ничего не пишет.
+    """
+    candidates = {
+        int(o["oid"]): (o["symbol"], o["tpsl"])
+        for o in orders
+        if o.get("tpsl") in ("tp", "sl") and o.get("oid") is not None
+    }
+    known = _fetch_map(storage, "SELECT oid, kind FROM order_tags WHERE oid IN ({})", candidates)
+    rows = [
+        (oid, symbol, kind, now_ms())
+        for oid, (symbol, kind) in candidates.items()
+        if oid not in known
+    ]
+    if not rows:
+        return
+    with storage.unit_of_work():
+        for row in rows:
+            storage.write(
+                "INSERT OR IGNORE INTO order_tags (oid, symbol, kind, created_at) VALUES (?, ?, ?, ?)",
+                row,
+            )
+
+
+# ---------- Курсор ----------
+def get_cursor(storage=db, name=FILLS_CURSOR):
+    row = storage.fetchone("SELECT value FROM sync_cursors WHERE name=?", (name,))
+    return row[0] if row else None
+
+
+def _initial_cursor(storage):
+    """Без курсора: от самой ранней открытой позиции, но не глубже FILLS_INITIAL_LOOKBACK_HOURS."""
+    floor_ms = now_ms() - FILLS_INITIAL_LOOKBACK_HOURS * 3600 * 1000
+    row = storage.fetchone("SELECT MIN(opened_at) FROM positions WHERE status='open'")
+    return max(floor_ms, row[0]) if row and row[0] else floor_ms
+
+
+# ---------- Загрузка ----------
+def ingest_fills(api=None, storage=db):
+    """
+    Загрузка новых fills с курсора и применение к позициям одним unit of work.
+    Возвращает {coin: {kind, ...}} для монет с новыми исполнениями или None при ошибке API.
+    """
+    api = api or hl_api
+    cursor = get_cursor(storage)
+    start_ms = (cursor - FILLS_CURSOR_OVERLAP_MS) if cursor is not None else _initial_cursor(storage)
+
+    raw_fills = api.get_user_fills(start_ms)
+    if raw_fills is None:
+        return None
+
+    fills = _new_fills(raw_fills, storage)
+    if not fills:
+        return {}
+
+    oids = {f["oid"] for f in fills if f["oid"] is not None}
+    tags = _fetch_map(storage, "SELECT oid, kind FROM order_tags WHERE oid IN ({})", oids)
+    seen_oids = set(_fetch_map(storage, "SELECT DISTINCT oid, 1 FROM fills WHERE oid IN ({})", oids))
+
+    open_positions = {}
+    for pos_id, symbol, side, tp1_hit, tp2_hit in storage.fetchall(
+        "SELECT id, symbol, side, tp1_hit, tp2_hit FROM positions WHERE status='open'"
+    ):
+        open_positions[(symbol, side)] = {"id": pos_id, "tp1_hit": tp1_hit, "tp2_hit": tp2_hit}
+
+    applied = {}
+    with storage.unit_of_work():
+        for fill in fills:
+            kind = _apply_fill(fill, tags, seen_oids, open_positions, storage)
+            applied.setdefault(fill["coin"], set()).add(kind)
+
+        storage.write(
+            """
+            INSERT INTO sync_cursors (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = max(value, excluded.value)
+            """,
+            (FILLS_CURSOR, max(f["time"] for f in fills)),
+        )
+
+    return applied
+
+
+def _new_fills(raw_fills, storage):
+    """Нормализация fills API и отсев уже загруженных (по tid)."""
+    fills = []
+    for raw in raw_fills:
+        if raw.get("tid") is None:
+            continue
+        sz = float(raw.get("sz", 0))
+        signed = sz if raw.get("side") == "B" else -sz
+        start = float(raw.get("startPosition", 0))
+        fills.append({
+            "tid": int(raw["tid"]),
+            "oid": int(raw["oid"]) if raw.get("oid") is not None else None,
+            "coin": raw.get("coin", ""),
+            "side": raw.get("side", ""),
+            "px": float(raw.get("px", 0)),
+            "sz": sz,
+            "start": start,
+            "end": start + signed,
+            "closed_pnl": float(raw.get("closedPnl", 0)),
+            "fee": float(raw.get("fee", 0)),
+            "time": int(raw.get("time", 0)),
+        })
+
+    known = set(_fetch_map(storage, "SELECT tid, 1 FROM fills WHERE tid IN ({})", {f["tid"] for f in fills}))
+    return [f for f in fills if f["tid"] not in known]
+
+
+def _fetch_map(storage, sql, keys):
+    if not keys:
+        return {}
+    keys = list(keys)
+    return dict(storage.fetchall(sql.format(", ".join("?" * len(keys))), keys))
+
+
+def _apply_fill(fill, tags, seen_oids, open_positions, storage):
+    """Применение одного fill: запись в fills и изменения позиции. Возвращает назначение."""
+    coin, start, end, oid = fill["coin"], fill["start"], fill["end"], fill["oid"]
+    symbol = coin + "USDT"
+    eps = fill["sz"] * _ZERO_EPS
+    closing = abs(start) > eps and (abs(end) < abs(start) or (end > 0) != (start > 0))
+
+    if closing:
+        side = "buy" if start > 0 else "sell"
+        kind = tags.get(oid) or "manual"
+    else:
+        side = "buy" if end > 0 else "sell"
+        kind = tags.get(oid) or "entry"
+
+    position = open_positions.get((symbol, side))
+    first_fill_of_order = oid not in seen_oids
+    if oid is not None:
+        seen_oids.add(oid)
+
+    storage.write(
+        """
+        INSERT OR IGNORE INTO fills
+        (tid, oid, coin, side, px, sz, start_position, closed_pnl, fee, time, kind, position_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (fill["tid"], oid, coin, fill["side"], fill["px"], fill["sz"], start,
+         fill["closed_pnl"], fill["fee"], fill["time"], kind, position["id"] if position else None),
+    )
+
+    if position is None:
+        return kind
+
+    pos_id = position["id"]
+    direction = "long" if side == "buy" else "short"
+    context = {"symbol": symbol, "oid": oid}
+
+    if not closing:
+        storage.write("UPDATE positions SET last_known_size=? WHERE id=?", (abs(end), pos_id))
+        return kind
+
+    if kind == "tp" and first_fill_of_order:
+        if not position["tp1_hit"]:
+            position["tp1_hit"] = 1
+            log_trade_event(symbol, "tp", direction, "TP1 triggered", storage=storage, event_time=fill["time"])
+            storage.write("UPDATE positions SET tp1_hit=1 WHERE id=?", (pos_id,))
+            log.info(f"✅ {coin}: TP1 сработал (fill {fill['sz']} @ {fill['px']})", extra=context)
+        else:
+            log_trade_event(symbol, "tp", direction, "TP2 triggered", storage=storage, event_time=fill["time"])
+            storage.write("UPDATE positions SET tp2_hit=1, tp2_count=tp2_count+1 WHERE id=?", (pos_id,))
+            log.info(f"✅ {coin}: TP2 сработал (fill {fill['sz']} @ {fill['px']})", extra=context)
+            position["tp2_hit"] = 1
+    elif kind == "sl" and first_fill_of_order:
+        log_trade_event(symbol, "sl", direction, "Position closed by SL", storage=storage, event_time=fill["time"])
+        log.info(f"🔴 {symbol}: SL сработал для {direction}", extra=context)
+
+    if abs(end) <= eps or (end > 0) != (start > 0):
+        close_reason = _CLOSE_REASONS.get(kind, "manual")
+        storage.write(_CLOSE_SQL, (fill["time"], close_reason, coin, fill["time"], pos_id))
+        record_closed_position(pos_id, storage=storage)
+        del open_positions[(symbol, side)]
+        log.info(f"📕 {symbol}: позиция {direction} закрыта ({close_reason})", extra=context)
+    else:
+        storage.write("UPDATE positions SET last_known_size=? WHERE id=?", (abs(end), pos_id))
+
+    return kind
@@ -1,69 +1,215 @@
 # -*- coding: utf-8 -*-
 """
-Модуль для работы с Hyperliquid API через официальный SDK
+Модуль для работы с Hyperliquid API через официальный SDK.
+Клиент создаётся лениво при первом обращении к hl_api; SDK импортируется только в connect()
 """
 
+import os
+import json
 import time
-from hyperliquid.info import Info
-from hyperliquid.exchange import Exchange
-from hyperliquid.utils import constants
-from eth_account import Account
-from decimal import Decimal, ROUND_DOWN
+import threading
+from bisect import bisect_right
 
 from config import (
     HYPERLIQUID_API_URL,
     HYPERLIQUID_ACCOUNT_ADDRESS,
     HYPERLIQUID_PRIVATE_KEY,
     USE_TESTNET,
+    ASSET_META_CACHE_FILE,
+    ASSET_META_TTL_SECONDS,
+    USER_STREAM_ENABLED,
+    USER_STREAM_RESYNC_SECONDS,
+    PREFETCH_MAX_AGE,
+    MARKET_CONTEXT_PRICE_MAX_AGE,
 )
+from market_context import market_context
+from metrics import metrics, instrument
+from bot_logging import get_logger
+
+log = get_logger("hyperliquid_api")
+
+# Цена perp: не более 5 значащих цифр и не более (6 - szDecimals) знаков после запятой
+MAX_PRICE_SIG_FIGS = 5
+MAX_PERP_DECIMALS = 6
+
+# Степени 10 для определения порядка цены через bisect (вместо log10/floor)
+_POW10_EXPONENTS = list(range(-12, 13))
+_POW10 = [10.0 ** e for e in _POW10_EXPONENTS]
+
+# Повторная синхронная загрузка метаданных при неизвестной монете — не чаще
+META_RETRY_INTERVAL = 60
+
+
+def price_magnitude(price):
+    """floor(log10(price)) для положительной цены через bisect по таблице степеней 10."""
+    idx = bisect_right(_POW10, price) - 1
+    if idx < 0:
+        return _POW10_EXPONENTS[0]
+    return _POW10_EXPONENTS[idx]
 
 
 class HyperliquidAPI:
-    def __init__(self):
-        """Инициализация Hyperliquid API."""
-        self.info = None
-        self.exchange = None
+    def __init__(self, info=None, exchange=None, address=None, stream=None):
+        """
+        Клиент Hyperliquid без сетевых вызовов: SDK-объекты создаёт connect().
+        info/exchange можно передать готовыми (симулятор, тесты) — тогда они не создаются.
+        stream — UserStream: ордера и позиции из push-книги (иначе создаётся при USER_STREAM_ENABLED).
+        """
+        self.info = info
+        self.stream = stream
+        self._last_resync = 0.0
+        self.exchange = exchange
         self.account = None
-        self.address = HYPERLIQUID_ACCOUNT_ADDRESS
+        self.address = address if address is not None else HYPERLIQUID_ACCOUNT_ADDRESS
         self.asset_info = {}
+        self.rounding = {}  # coin → (sz_decimals, max_price_decimals)
         self._last_orders_fetch = 0
         self._orders_cache = []
+        self._connected = False
+        self._meta_lock = threading.Lock()
+        self._meta_thread = None
+        self._meta_attempt = 0.0
+        self._meta_fetched_at = 0.0
+        self._cached_meta = None  # Сырой meta() для SDK (Info/Exchange не запрашивают его сами)
+        self._warm = {}  # Предзагрузка (prefetch): ключ → (monotonic, ответ Info)
+        self._warm_generation = 0
+        self._warm_lock = threading.Lock()
 
-        if not self.address or not HYPERLIQUID_PRIVATE_KEY:
-            print("⚠️ Hyperliquid credentials не установлены")
-            return
+        # Метаданные с диска доступны сразу, даже без сети
+        self._load_asset_metadata_cache()
+
+    # ---------- Жизненный цикл ----------
+    def connect(self):
+        """Создание недостающих SDK-клиентов и фоновое обновление метаданных. Идемпотентно."""
+        if self._connected:
+            return self
+        self._connected = True
+
+        if self.info is None or self.exchange is None:
+            if not self.address or not HYPERLIQUID_PRIVATE_KEY:
+                log.warning("⚠️ Hyperliquid credentials не установлены")
+                return self
+
+            try:
+                from hyperliquid.info import Info
+                from hyperliquid.exchange import Exchange
+                from hyperliquid.utils import constants
+                from eth_account import Account
+
+                if self.info is None:
+                    self.info = Info(HYPERLIQUID_API_URL, skip_ws=True, meta=self._cached_meta)
 
+                if self.exchange is None:
+                    self.account = Account.from_key(HYPERLIQUID_PRIVATE_KEY)
+                    base_url = constants.TESTNET_API_URL if USE_TESTNET else constants.MAINNET_API_URL
+                    self.exchange = Exchange(
+                        wallet=self.account,
+                        base_url=base_url,
+                        meta=self._cached_meta,
+                        account_address=self.address
+                    )
+                
+                env = "Testnet" if USE_TESTNET else "Mainnet"
+                log.info(f"🌐 Hyperliquid: {env}")
+                log.info(f"📍 API URL: {HYPERLIQUID_API_URL}")
+                log.info("✅ SDK инициализирован")
+            
+            except Exception as e:
+                log.exception(f"❌ Ошибка инициализации Hyperliquid SDK: {e}")
+                return self
+
+        # Учёт запросов по endpoint (info.user_state, exchange.order, ...)
+        self.info = instrument(self.info, "info")
+        self.exchange = instrument(self.exchange, "exchange")
+
+        if self.stream is None and USER_STREAM_ENABLED and self.address:
+            from user_stream import UserStream
+            self.stream = UserStream(address=self.address)
+        if self.stream is not None:
+            self.stream.start()
+
+        self._refresh_asset_metadata_if_stale()
+        return self
+
+    def close(self):
+        """Остановка фоновой загрузки метаданных и WebSocket SDK, сброс клиентов."""
+        thread = self._meta_thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=5)
+
+        if self.stream is not None:
+            self.stream.stop()
+
+        ws_manager = getattr(self.info, "ws_manager", None)
+        if ws_manager is not None:
+            try:
+                self.info.disconnect_websocket()
+            except Exception:
+                pass
+
+        self.info = None
+        self.exchange = None
+        self.account = None
+        self._connected = False
+
+    # ---------- Метаданные активов ----------
+    def _set_asset_info(self, asset_info):
+        """Замена метаданных и таблиц округления (атомарно для читателей)."""
+        rounding = {}
+        for coin, info in asset_info.items():
+            sz_decimals = int(info["sz_decimals"])
+            rounding[coin] = (sz_decimals, max(0, MAX_PERP_DECIMALS - sz_decimals))
+        self.asset_info = asset_info
+        self.rounding = rounding
+
+    def _load_asset_metadata_cache(self):
+        """Загрузка метаданных из файла кеша (время загрузки с биржи — в _meta_fetched_at)."""
         try:
-            self.info = Info(HYPERLIQUID_API_URL, skip_ws=True)
-            self.account = Account.from_key(HYPERLIQUID_PRIVATE_KEY)
-            
-            base_url = constants.TESTNET_API_URL if USE_TESTNET else constants.MAINNET_API_URL
-            self.exchange = Exchange(
-                wallet=self.account,
-                base_url=base_url,
-                account_address=self.address
+            with open(ASSET_META_CACHE_FILE, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            self._set_asset_info(cached["assets"])
+            self._meta_fetched_at = float(cached.get("fetched_at", 0))
+            self._cached_meta = cached.get("meta")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f"⚠️ Кеш метаданных повреждён: {e}")
+
+    def _save_asset_metadata_cache(self, asset_info, meta):
+        self._meta_fetched_at = time.time()
+        self._cached_meta = {"universe": meta["universe"]}
+        tmp_path = ASSET_META_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "fetched_at": self._meta_fetched_at,
+                "assets": asset_info,
+                "meta": self._cached_meta,
+            }, f)
+        os.replace(tmp_path, ASSET_META_CACHE_FILE)
+
+    def _refresh_asset_metadata_if_stale(self):
+        """Фоновое обновление метаданных, если кеша нет или он старше ASSET_META_TTL_SECONDS."""
+        if self.asset_info and time.time() - self._meta_fetched_at < ASSET_META_TTL_SECONDS:
+            return
+        
+        with self._meta_lock:
+            if self._meta_thread is not None and self._meta_thread.is_alive():
+                return
+            self._meta_thread = threading.Thread(
+                target=self._load_asset_metadata, name="asset-meta-refresh", daemon=True
             )
-            
-            self._load_asset_metadata()
-            
-            env = "Testnet" if USE_TESTNET else "Mainnet"
-            print(f"🌐 Hyperliquid: {env}")
-            print(f"📍 API URL: {HYPERLIQUID_API_URL}")
-            print("✅ SDK инициализирован")
-            
-        except Exception as e:
-            print(f"❌ Ошибка инициализации Hyperliquid SDK: {e}")
-            import traceback
-            traceback.print_exc()
+            self._meta_thread.start()
 
     def _load_asset_metadata(self):
-        """Загрузка метаданных активов."""
+        """Загрузка метаданных активов с биржи и сохранение в кеш."""
         try:
             if not self.info:
                 return
             
+            self._meta_attempt = time.monotonic()
             meta = self.info.meta()
             if meta and "universe" in meta:
+                asset_info = {}
                 for asset in meta["universe"]:
                     coin = asset.get("name", "")
                     sz_decimals = asset.get("szDecimals", 8)
@@ -74,34 +220,60 @@ class HyperliquidAPI:
                     else:
                         max_leverage = int(max_lev_obj)
                     
-                    self.asset_info[coin] = {
+                    asset_info[coin] = {
                         "sz_decimals": sz_decimals,
                         "max_leverage": max_leverage,
                     }
+                
+                self._set_asset_info(asset_info)
+                self._save_asset_metadata_cache(asset_info, meta)
         except Exception as e:
-            print(f"⚠️ Ошибка загрузки метаданных: {e}")
+            log.warning(f"⚠️ Ошибка загрузки метаданных: {e}")
+
+    def ensure_asset(self, coin):
+        """
+        Есть ли метаданные монеты. Если нет — дожидаемся фонового обновления
+        или (не чаще META_RETRY_INTERVAL) загружаем синхронно.
+        """
+        if coin in self.rounding:
+            return True
+        
+        thread = self._meta_thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=10)
+        elif time.monotonic() - self._meta_attempt >= META_RETRY_INTERVAL:
+            self._load_asset_metadata()
+        
+        return coin in self.rounding
 
+    # ---------- Округление ----------
     def round_size(self, coin, size):
-        """Округление размера позиции."""
-        if coin not in self.asset_info:
+        """Округление размера позиции до szDecimals."""
+        rounding = self.rounding.get(coin)
+        if rounding is None:
             return round(size, 4)
+        return round(size, rounding[0])
+
+    def round_price(self, coin, price, max_sig_figs=MAX_PRICE_SIG_FIGS):
+        """
+        Округление цены по правилам актива: max_sig_figs значащих цифр,
+        но не более (6 - szDecimals) знаков после запятой. Целые цены допустимы всегда.
+        """
+        if price <= 0:
+            return 0.0
         
-        sz_decimals = self.asset_info[coin]["sz_decimals"]
-        return round(size, sz_decimals)
+        decimals = max_sig_figs - 1 - price_magnitude(price)
+        rounding = self.rounding.get(coin)
+        if rounding is not None and decimals > rounding[1]:
+            decimals = rounding[1]
+        return round(price, decimals) if decimals > 0 else float(round(price))
 
     def round_price_sig_figs(self, price, max_sig_figs=5):
         """Округление цены до максимального числа значащих цифр."""
         if price == 0:
             return 0.0
         
-        from math import log10, floor
-        
-        price_decimal = Decimal(str(price))
-        magnitude = floor(log10(abs(float(price))))
-        scale = max_sig_figs - 1 - magnitude
-        rounded = round(float(price_decimal), int(scale))
-        
-        return rounded
+        return round(price, max_sig_figs - 1 - price_magnitude(abs(price)))
 
     def get_balance(self):
         """Получение баланса."""
@@ -109,12 +281,12 @@ class HyperliquidAPI:
             if not self.info or not self.address:
                 return 0.0
             
-            user_state = self.info.user_state(self.address)
+            user_state = self._user_state()
             if user_state and "marginSummary" in user_state:
                 return float(user_state["marginSummary"]["accountValue"])
             return 0.0
         except Exception as e:
-            print(f"❌ Ошибка получения баланса: {e}")
+            log.error(f"❌ Ошибка получения баланса: {e}")
             return 0.0
 
     def get_available_balance(self):
@@ -123,7 +295,7 @@ class HyperliquidAPI:
             if not self.info or not self.address:
                 return 0.0
             
-            user_state = self.info.user_state(self.address)
+            user_state = self._user_state()
             if user_state and "marginSummary" in user_state:
                 margin_summary = user_state["marginSummary"]
                 # Available = accountValue - totalMarginUsed
@@ -133,12 +305,16 @@ class HyperliquidAPI:
                 return max(0.0, available)
             return 0.0
         except Exception as e:
-            print(f"❌ Ошибка получения доступного баланса: {e}")
+            log.error(f"❌ Ошибка получения доступного баланса: {e}")
             return 0.0
 
     def get_mid_price(self, coin):
-        """Получение средней цены."""
+        """Получение средней цены (из рыночного контекста, если он свежий)."""
         try:
+            mid = market_context.mid(coin, max_age=MARKET_CONTEXT_PRICE_MAX_AGE)
+            if mid:
+                return mid
+            
             if not self.info:
                 return None
             
@@ -147,54 +323,152 @@ class HyperliquidAPI:
                 return float(all_mids[coin])
             return None
         except Exception as e:
-            print(f"❌ Ошибка получения цены {coin}: {e}")
+            log.error(f"❌ Ошибка получения цены {coin}: {e}")
             return None
 
+    @staticmethod
+    def _parse_positions(user_state):
+        """assetPositions из user_state → список позиций бота."""
+        if not user_state or "assetPositions" not in user_state:
+            return []
+        
+        positions = []
+        for pos in user_state["assetPositions"]:
+            position_data = pos.get("position", {})
+            if not position_data:
+                continue
+            
+            coin = position_data.get("coin", "")
+            szi = float(position_data.get("szi", 0))
+            
+            if szi == 0:
+                continue
+            
+            lev_obj = position_data.get("leverage", {})
+            if isinstance(lev_obj, dict):
+                leverage = float(lev_obj.get("value", 1))
+            else:
+                leverage = float(lev_obj) if lev_obj else 1.0
+            
+            positions.append({
+                "symbol": coin,
+                "side": "long" if szi > 0 else "short",
+                "size": abs(szi),
+                "entry_price": float(position_data.get("entryPx", 0)),
+                "unrealized_pnl": float(position_data.get("unrealizedPnl", 0)),
+                "leverage": leverage,
+            })
+        
+        return positions
+
+    def _invalidate_state(self):
+        """После собственных действий с ордерами: следующее чтение — из REST (книга stream может отставать)."""
+        self._last_orders_fetch = 0
+        self._last_resync = 0.0
+        with self._warm_lock:
+            self._warm_generation += 1
+            self._warm.clear()
+
+    # ---------- Предзагрузка ----------
+    def prefetch(self, coins=()):
+        """
+        Прогрев ответов для горячего пути сделки (пока ждём AI): user_state, рыночный
+        контекст (цены, funding, OI), L2-стакан и метаданные вероятных монет. user_state
+        и стакан живут PREFETCH_MAX_AGE секунд и сбрасываются собственными действиями с ордерами.
+        """
+        if not self.info:
+            return
+        generation = self._warm_generation
+        if self.address:
+            self._warm_put("user_state", self.info.user_state(self.address), generation)
+        market_context.ingest(*self.info.meta_and_asset_ctxs())
+        for coin in coins:
+            self.ensure_asset(coin)
+            self._warm_put(("l2", coin), self.info.l2_snapshot(coin), generation)
+
+    def _warm_put(self, key, value, generation):
+        """Ответ, запрошенный до _invalidate_state (generation устарел), не сохраняется."""
+        with self._warm_lock:
+            if generation == self._warm_generation:
+                self._warm[key] = (time.monotonic(), value)
+
+    def _warm_fetch(self, key, fetch):
+        """Предзагруженный ответ не старше PREFETCH_MAX_AGE, иначе запрос fetch()."""
+        with self._warm_lock:
+            entry = self._warm.get(key)
+        if entry is not None and time.monotonic() - entry[0] < PREFETCH_MAX_AGE:
+            return entry[1]
+        return fetch()
+
+    def _user_state(self):
+        return self._warm_fetch("user_state", lambda: self.info.user_state(self.address))
+
+    def _account_state(self):
+        """
+        (user_state, open_orders): из книги user stream, если она свежая и сверка
+        с REST не просрочена; иначе REST (книга stream сбрасывается по ответу).
+        """
+        stream = self.stream
+        if stream is not None and time.time() - self._last_resync < USER_STREAM_RESYNC_SECONDS:
+            state = stream.get_state()
+            if state is not None:
+                return state
+        
+        user_state = self.info.user_state(self.address)
+        open_orders = self.info.open_orders(self.address) or []
+        if stream is not None:
+            stream.reset(user_state, open_orders, check=self._last_resync > 0)
+            self._last_resync = time.time()
+        return user_state, open_orders
+
     def get_open_positions(self):
         """Получение открытых позиций."""
         try:
             if not self.info or not self.address:
                 return []
             
-            user_state = self.info.user_state(self.address)
-            if not user_state or "assetPositions" not in user_state:
-                return []
-            
-            positions = []
-            for pos in user_state["assetPositions"]:
-                position_data = pos.get("position", {})
-                if not position_data:
-                    continue
-                
-                coin = position_data.get("coin", "")
-                szi = float(position_data.get("szi", 0))
-                
-                if szi == 0:
-                    continue
-                
-                lev_obj = position_data.get("leverage", {})
-                if isinstance(lev_obj, dict):
-                    leverage = float(lev_obj.get("value", 1))
-                else:
-                    leverage = float(lev_obj) if lev_obj else 1.0
-                
-                positions.append({
-                    "symbol": coin,
-                    "side": "long" if szi > 0 else "short",
-                    "size": abs(szi),
-                    "entry_price": float(position_data.get("entryPx", 0)),
-                    "unrealized_pnl": float(position_data.get("unrealizedPnl", 0)),
-                    "leverage": leverage,
-                })
-            
-            return positions
+            if self.stream is not None:
+                return self._parse_positions(self._account_state()[0])
+            return self._parse_positions(self._user_state())
         except Exception as e:
-            print(f"❌ Ошибка получения позиций: {e}")
+            log.error(f"❌ Ошибка получения позиций: {e}")
             return []
 
+    def get_user_fills(self, start_ms, end_ms=None):
+        """Исполнения аккаунта за период (сырые fills API, по возрастанию времени). None при ошибке."""
+        try:
+            if not self.info or not self.address:
+                return None
+            
+            fills = self.info.user_fills_by_time(self.address, int(start_ms), int(end_ms) if end_ms else None)
+            return sorted(fills or [], key=lambda f: (f.get("time", 0), f.get("tid", 0)))
+        except Exception as e:
+            log.error(f"❌ Ошибка получения fills: {e}")
+            return None
+
+    def get_realized_pnl(self, coin, start_ms, end_ms=None):
+        """Реализованный PnL по монете за период (closedPnl − комиссии из fills). None при ошибке."""
+        fills = self.get_user_fills(start_ms, end_ms)
+        if fills is None:
+            return None
+        
+        pnl = 0.0
+        for fill in fills:
+            if fill.get("coin") != coin:
+                continue
+            pnl += float(fill.get("closedPnl", 0)) - float(fill.get("fee", 0))
+        return pnl
+
     def get_open_orders(self, force_refresh=False):
-        """Получение открытых ордеров с кешированием."""
+        """Получение открытых ордеров с кешированием (из книги user stream, если включён)."""
         try:
+            if self.stream is not None and self.info and self.address:
+                user_state, open_orders = self._account_state()
+                pos_dict = {p["symbol"]: p for p in self._parse_positions(user_state)}
+                needs_mids = any(o.get("reduceOnly") for o in open_orders)
+                mids = self._fetch_mids() if needs_mids else {}
+                return self._parse_orders(open_orders, pos_dict, mids)
+            
             current_time = time.time()
             
             if not force_refresh and (current_time - self._last_orders_fetch) < 2.0:
@@ -203,7 +477,7 @@ class HyperliquidAPI:
             if not self.info or not self.address:
                 return []
             
-            time.sleep(1.0)
+            metrics.sleep(1.0, "open_orders")
             
             open_orders = self.info.open_orders(self.address)
             if not open_orders:
@@ -213,111 +487,171 @@ class HyperliquidAPI:
             
             positions = self.get_open_positions()
             pos_dict = {p["symbol"]: p for p in positions}
+            needs_mids = any(o.get("reduceOnly") for o in open_orders)
+            mids = self._fetch_mids() if needs_mids else {}
             
-            orders = []
-            for order in open_orders:
-                coin = order.get("coin", "")
-                oid = order.get("oid", 0)
-                side = order.get("side", "")
-                size = abs(float(order.get("sz", 0)))
-                limit_px = float(order.get("limitPx", 0))
-                is_reduce_only = order.get("reduceOnly", False)
-                
-                order_type_data = order.get("orderType", {})
-                is_trigger = False
-                tpsl = None
-                trigger_price = None
-                
-                if isinstance(order_type_data, dict):
-                    if "trigger" in order_type_data:
-                        is_trigger = True
-                        trigger_info = order_type_data["trigger"]
-                        if isinstance(trigger_info, dict):
-                            trigger_price = trigger_info.get("triggerPx")
-                            if trigger_price:
-                                trigger_price = float(trigger_price)
-                            tpsl = trigger_info.get("tpsl")
-                            if tpsl == "":
-                                tpsl = None
-                    elif "limit" in order_type_data:
-                        is_trigger = False
-                    elif "triggerPx" in order_type_data:
-                        is_trigger = True
-                        trigger_price = float(order_type_data.get("triggerPx", 0))
-                        tpsl = order_type_data.get("tpsl")
-                        if tpsl == "":
-                            tpsl = None
-                
-                if is_reduce_only and tpsl is None and coin in pos_dict:
-                    position = pos_dict[coin]
-                    pos_side = position["side"]
-                    pos_size = position["size"]
-                    current_price = self.get_mid_price(coin)
-                    
-                    if trigger_price and current_price:
-                        if pos_side == "long":
-                            tpsl = "tp" if trigger_price > current_price else "sl"
-                        else:
-                            tpsl = "tp" if trigger_price < current_price else "sl"
-                    elif size >= pos_size * 0.95:
-                        tpsl = "sl"
-                    else:
-                        tpsl = "tp"
-                
-                if not is_trigger and tpsl:
-                    is_trigger = True
-                    trigger_price = limit_px
-                
-                order_data = {
-                    "symbol": coin,
-                    "oid": oid,
-                    "side": side,
-                    "size": size,
-                    "limit_price": limit_px,
-                    "trigger_price": trigger_price if trigger_price else limit_px,
-                    "is_trigger": is_trigger or is_reduce_only,
-                    "tpsl": tpsl,
-                    "reduce_only": is_reduce_only,
-                }
-                
-                orders.append(order_data)
+            orders = self._parse_orders(open_orders, pos_dict, mids)
             
             self._orders_cache = orders
             self._last_orders_fetch = current_time
             return orders
         
         except Exception as e:
-            print(f"❌ Ошибка получения ордеров: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Ошибка получения ордеров: {e}")
             return []
 
+    def get_asset_contexts(self):
+        """(meta, asset_ctxs) всей вселенной perp одним запросом metaAndAssetCtxs. None при ошибке."""
+        try:
+            if not self.info:
+                return None
+            
+            meta, ctxs = self.info.meta_and_asset_ctxs()
+            return meta, ctxs
+        except Exception as e:
+            log.error(f"❌ Ошибка получения контекстов активов: {e}")
+            return None
+
+    def _fetch_mids(self):
+        """Все средние цены одним запросом (монета → float)."""
+        all_mids = self.info.all_mids() or {}
+        return {coin: float(px) for coin, px in all_mids.items()}
+
+    def get_snapshot(self):
+        """
+        Снимок аккаунта для сверки: по одному запросу user_state, open_orders и all_mids.
+        None при ошибке.
+        """
+        try:
+            if not self.info or not self.address:
+                return None
+            
+            user_state, open_orders = self._account_state()
+            mids = self._fetch_mids()
+            
+            positions = self._parse_positions(user_state)
+            pos_dict = {p["symbol"]: p for p in positions}
+            orders = self._parse_orders(open_orders, pos_dict, mids)
+            
+            self._orders_cache = orders
+            self._last_orders_fetch = time.time()
+            
+            margin_summary = (user_state or {}).get("marginSummary", {})
+            account_value = float(margin_summary.get("accountValue", 0))
+            margin_used = float(margin_summary.get("totalMarginUsed", 0))
+            
+            return {
+                "positions": positions,
+                "orders": orders,
+                "mids": mids,
+                "balance": account_value,
+                "available": max(0.0, account_value - margin_used),
+            }
+        except Exception as e:
+            log.error(f"❌ Ошибка получения снимка аккаунта: {e}")
+            return None
+
+    @staticmethod
+    def _parse_orders(open_orders, pos_dict, mids):
+        """
+        Ордера API → ордера бота с определением tpsl. pos_dict — позиции по монете,
+        mids — средние цены (для reduce-only без явного tpsl).
+        """
+        orders = []
+        for order in open_orders:
+            coin = order.get("coin", "")
+            oid = order.get("oid", 0)
+            side = order.get("side", "")
+            size = abs(float(order.get("sz", 0)))
+            limit_px = float(order.get("limitPx", 0))
+            is_reduce_only = order.get("reduceOnly", False)
+            
+            order_type_data = order.get("orderType", {})
+            is_trigger = False
+            tpsl = None
+            trigger_price = None
+            
+            if isinstance(order_type_data, dict):
+                if "trigger" in order_type_data:
+                    is_trigger = True
+                    trigger_info = order_type_data["trigger"]
+                    if isinstance(trigger_info, dict):
+                        trigger_price = trigger_info.get("triggerPx")
+                        if trigger_price:
+                            trigger_price = float(trigger_price)
+                        tpsl = trigger_info.get("tpsl")
+                        if tpsl == "":
+                            tpsl = None
+                elif "limit" in order_type_data:
+                    is_trigger = False
+                elif "triggerPx" in order_type_data:
+                    is_trigger = True
+                    trigger_price = float(order_type_data.get("triggerPx", 0))
+                    tpsl = order_type_data.get("tpsl")
+                    if tpsl == "":
+                        tpsl = None
+            
+            if is_reduce_only and tpsl is None and coin in pos_dict:
+                position = pos_dict[coin]
+                pos_side = position["side"]
+                pos_size = position["size"]
+                current_price = mids.get(coin)
+                
+                if trigger_price and current_price:
+                    if pos_side == "long":
+                        tpsl = "tp" if trigger_price > current_price else "sl"
+                    else:
+                        tpsl = "tp" if trigger_price < current_price else "sl"
+                elif size >= pos_size * 0.95:
+                    tpsl = "sl"
+                else:
+                    tpsl = "tp"
+            
+            if not is_trigger and tpsl:
+                is_trigger = True
+                trigger_price = limit_px
+            
+            order_data = {
+                "symbol": coin,
+                "oid": oid,
+                "side": side,
+                "size": size,
+                "limit_price": limit_px,
+                "trigger_price": trigger_price if trigger_price else limit_px,
+                "is_trigger": is_trigger or is_reduce_only,
+                "tpsl": tpsl,
+                "reduce_only": is_reduce_only,
+            }
+            
+            orders.append(order_data)
+        
+        return orders
+
     def place_order(self, coin, side, size, order_type="Market", limit_price=None):
         """Размещение ордера."""
         try:
             if not self.exchange:
-                print("❌ Exchange не инициализирован")
+                log.error("❌ Exchange не инициализирован")
                 return None
             
-            if coin not in self.asset_info:
-                print(f"❌ Информация о {coin} не найдена")
+            if not self.ensure_asset(coin):
+                log.error(f"❌ Информация о {coin} не найдена")
                 return None
             
-            sz_decimals = self.asset_info[coin]["sz_decimals"]
-            size = round(size, sz_decimals)
+            size = self.round_size(coin, size)
             
             is_buy = side.lower() == "buy"
             
             mid = self.get_mid_price(coin)
             if not mid:
-                print(f"❌ Не удалось получить цену {coin}")
+                log.error(f"❌ Не удалось получить цену {coin}")
                 return None
             
             if order_type == "Market":
                 best_bid, best_ask = None, None
                 try:
                     if self.info:
-                        ob = self.info.l2_snapshot(coin)
+                        ob = self._warm_fetch(("l2", coin), lambda: self.info.l2_snapshot(coin))
                         levels = ob.get("levels", [])
                         if levels and len(levels) >= 2:
                             if levels[0] and len(levels[0]) > 0:
@@ -332,9 +666,9 @@ class HyperliquidAPI:
                 else:
                     limit = best_bid * 0.998 if (best_bid and best_bid > 0) else mid * 0.998
                 
-                limit_final = self.round_price_sig_figs(limit, max_sig_figs=5)
+                limit_final = self.round_price(coin, limit)
                 
-                print(f"  🔍 {coin}: mid={mid:.4f}, target={limit:.4f} → final={limit_final:.4f}")
+                log.info(f"  🔍 {coin}: mid={mid:.4f}, target={limit:.4f} → final={limit_final:.4f}")
                 
                 result = self.exchange.order(
                     coin,
@@ -345,7 +679,7 @@ class HyperliquidAPI:
                 )
             
             elif order_type == "Limit" and limit_price:
-                limit_final = self.round_price_sig_figs(limit_price, max_sig_figs=5)
+                limit_final = self.round_price(coin, limit_price)
                 
                 result = self.exchange.order(
                     coin,
@@ -356,9 +690,11 @@ class HyperliquidAPI:
                 )
             
             else:
-                print("❌ Неправильный тип ордера")
+                log.error("❌ Неправильный тип ордера")
                 return None
             
+            self._invalidate_state()
+            
             if result:
                 if result.get("status") == "ok":
                     response = result.get("response", {})
@@ -370,7 +706,7 @@ class HyperliquidAPI:
                             
                             if "error" in status:
                                 error_msg = status.get("error", "")
-                                print(f"❌ Ошибка ордера: {error_msg}")
+                                log.error(f"❌ Ошибка ордера: {error_msg}")
                                 return None
                             
                             if "filled" in status:
@@ -379,25 +715,23 @@ class HyperliquidAPI:
                                 avg_px = float(filled_info.get("avgPx", 0))
                                 
                                 if total_sz > 0:
-                                    print(f"✅ Исполнено: {total_sz} @ ${avg_px:.2f}")
+                                    log.info(f"✅ Исполнено: {total_sz} @ ${avg_px:.2f}", extra={"oid": filled_info.get("oid")})
                                     return result
                                 else:
-                                    print(f"⚠️ Ордер не исполнен")
+                                    log.warning(f"⚠️ Ордер не исполнен")
                                     return None
                             else:
-                                print(f"✅ Ордер размещён")
+                                log.info(f"✅ Ордер размещён", extra={"oid": status.get("resting", {}).get("oid")})
                                 return result
                 else:
-                    print(f"❌ Статус: {result.get('status')}")
+                    log.error(f"❌ Статус: {result.get('status')}")
                     return None
             else:
-                print("❌ Нет ответа от API")
+                log.error("❌ Нет ответа от API")
                 return None
         
         except Exception as e:
-            print(f"❌ Ошибка ордера: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Ошибка ордера: {e}")
             return None
 
     def cancel_order(self, coin, oid):
@@ -407,12 +741,138 @@ class HyperliquidAPI:
                 return None
             
             result = self.exchange.cancel(coin, oid)
-            self._last_orders_fetch = 0
+            self._invalidate_state()
             return result
         except Exception as e:
-            print(f"❌ Ошибка отмены ордера: {e}")
+            log.error(f"❌ Ошибка отмены ордера: {e}")
             return None
 
+    # ---------- Триггерные ордера ----------
+    def adjust_sl_trigger(self, coin, trigger_price, is_long, entry_price, current_price):
+        """Округление и отодвигание SL от текущей цены. None — SL слишком близко."""
+        trigger_px = self.round_price(coin, trigger_price)
+        
+        if is_long:
+            if trigger_px >= current_price * 0.999:
+                trigger_px = min(trigger_px, entry_price * 0.995, current_price * 0.997)
+                trigger_px = self.round_price(coin, trigger_px)
+                if trigger_px >= current_price * 0.998:
+                    log.warning(f"⚠️ SL слишком близко: {trigger_px:.4f} >= {current_price:.4f}")
+                    return None
+        else:
+            if trigger_px <= current_price * 1.001:
+                trigger_px = max(trigger_px, entry_price * 1.005, current_price * 1.003)
+                trigger_px = self.round_price(coin, trigger_px)
+                if trigger_px <= current_price * 1.002:
+                    log.warning(f"⚠️ SL слишком близко: {trigger_px:.4f} <= {current_price:.4f}")
+                    return None
+        
+        return trigger_px
+
+    def adjust_tp_trigger(self, coin, trigger_price, is_long, entry_price, current_price):
+        """Округление и отодвигание TP от текущей цены. None — TP слишком близко."""
+        trigger_px = self.round_price(coin, trigger_price)
+        
+        if is_long:
+            if trigger_px <= current_price * 1.001:
+                trigger_px = max(current_price * 1.003, entry_price * 1.005)
+                trigger_px = self.round_price(coin, trigger_px)
+                if trigger_px <= current_price * 1.002:
+                    log.warning(f"⚠️ TP слишком близко: {trigger_px:.4f} <= {current_price:.4f}")
+                    return None
+        else:
+            if trigger_px >= current_price * 0.999:
+                trigger_px = min(current_price * 0.997, entry_price * 0.995)
+                trigger_px = self.round_price(coin, trigger_px)
+                if trigger_px >= current_price * 0.998:
+                    log.warning(f"⚠️ TP слишком близко: {trigger_px:.4f} >= {current_price:.4f}")
+                    return None
+        
+        return trigger_px
+
+    def trigger_order_request(self, coin, tpsl, is_long, size, trigger_px):
+        """Запрос reduce-only триггер-ордера (формат bulk_orders SDK)."""
+        return {
+            "coin": coin,
+            "is_buy": not is_long,
+            "sz": self.round_size(coin, size),
+            "limit_px": trigger_px,
+            "order_type": {
+                "trigger": {
+                    "triggerPx": trigger_px,
+                    "isMarket": True,
+                    "tpsl": tpsl
+                }
+            },
+            "reduce_only": True,
+        }
+
+    def bulk_place(self, order_requests):
+        """Размещение пачки ордеров одним действием. Возвращает список статусов (по запросу)."""
+        if not order_requests:
+            return []
+        try:
+            if not self.exchange:
+                return [{"error": "Exchange не инициализирован"}] * len(order_requests)
+            
+            result = self.exchange.bulk_orders(order_requests)
+            self._invalidate_state()
+            return self._statuses(result, len(order_requests))
+        except Exception as e:
+            log.error(f"❌ Ошибка пакетного размещения: {e}")
+            return [{"error": str(e)}] * len(order_requests)
+
+    def bulk_cancel(self, cancels):
+        """Отмена пачки ордеров [(coin, oid), ...] одним действием."""
+        if not cancels:
+            return []
+        try:
+            if not self.exchange:
+                return [{"error": "Exchange не инициализирован"}] * len(cancels)
+            
+            result = self.exchange.bulk_cancel([{"coin": coin, "oid": oid} for coin, oid in cancels])
+            self._invalidate_state()
+            return self._statuses(result, len(cancels))
+        except Exception as e:
+            log.error(f"❌ Ошибка пакетной отмены: {e}")
+            return [{"error": str(e)}] * len(cancels)
+
+    def bulk_modify(self, modifies):
+        """
+        Изменение ордеров [(oid, order_request), ...] одним действием. Если SDK не умеет
+        bulk_modify_orders_new — размещение новых и отмена старых пачками.
+        """
+        if not modifies:
+            return []
+        bulk_modify = getattr(self.exchange, "bulk_modify_orders_new", None)
+        if bulk_modify is None:
+            statuses = self.bulk_place([request for _, request in modifies])
+            placed = [
+                (request["coin"], oid)
+                for (oid, request), status in zip(modifies, statuses)
+                if "error" not in status
+            ]
+            self.bulk_cancel(placed)
+            return statuses
+        try:
+            result = bulk_modify([{"oid": oid, "order": request} for oid, request in modifies])
+            self._invalidate_state()
+            return self._statuses(result, len(modifies))
+        except Exception as e:
+            log.error(f"❌ Ошибка пакетного изменения: {e}")
+            return [{"error": str(e)}] * len(modifies)
+
+    @staticmethod
+    def _statuses(result, count):
+        """Статусы ответа Exchange по каждому запросу пачки."""
+        if not result or result.get("status") != "ok":
+            error = (result or {}).get("response", "нет ответа")
+            return [{"error": str(error)}] * count
+        data = result.get("response", {}).get("data", {}) if isinstance(result.get("response"), dict) else {}
+        statuses = data.get("statuses") or []
+        statuses = [s if isinstance(s, dict) else {"success": s} for s in statuses]
+        return statuses + [{"success": "ok"}] * (count - len(statuses))
+
     def set_sl_only(self, coin, trigger_price, size=None):
         """✅ ИСПРАВЛЕНО: Установка Stop Loss с явным размером."""
         try:
@@ -420,18 +880,18 @@ class HyperliquidAPI:
                 return None
             
             # ✅ КРИТИЧНО: Сбрасываем кеш перед проверкой
-            self._last_orders_fetch = 0
+            self._invalidate_state()
             
-            time.sleep(1.5)
+            metrics.sleep(1.5, "set_sl")
             orders = self.get_open_orders(force_refresh=True)
             existing_sl = [o for o in orders if o["symbol"] == coin and o.get("tpsl") == "sl"]
             
             if existing_sl:
                 for old_order in existing_sl:
                     self.cancel_order(coin, old_order["oid"])
-                time.sleep(0.2)
+                metrics.sleep(0.2, "set_sl")
             
-            time.sleep(1.0)
+            metrics.sleep(1.0, "set_sl")
             
             positions = self.get_open_positions()
             position = next((p for p in positions if p["symbol"] == coin), None)
@@ -448,53 +908,28 @@ class HyperliquidAPI:
             if not current_price:
                 return None
             
-            if coin not in self.asset_info:
+            if not self.ensure_asset(coin):
                 return None
             
-            sz_decimals = self.asset_info[coin]["sz_decimals"]
-            trigger_px = self.round_price_sig_figs(trigger_price, max_sig_figs=5)
-            
-            if is_long:
-                if trigger_px >= current_price * 0.999:
-                    trigger_px = min(trigger_px, entry_price * 0.995, current_price * 0.997)
-                    trigger_px = self.round_price_sig_figs(trigger_px, max_sig_figs=5)
-                    if trigger_px >= current_price * 0.998:
-                        print(f"⚠️ SL слишком близко: {trigger_px:.4f} >= {current_price:.4f}")
-                        return None
-            else:
-                if trigger_px <= current_price * 1.001:
-                    trigger_px = max(trigger_px, entry_price * 1.005, current_price * 1.003)
-                    trigger_px = self.round_price_sig_figs(trigger_px, max_sig_figs=5)
-                    if trigger_px <= current_price * 1.002:
-                        print(f"⚠️ SL слишком близко: {trigger_px:.4f} <= {current_price:.4f}")
-                        return None
-            
-            sl_size = round(position_size, sz_decimals)
-            
-            order_type = {
-                "trigger": {
-                    "triggerPx": trigger_px,
-                    "isMarket": True,
-                    "tpsl": "sl"
-                }
-            }
+            trigger_px = self.adjust_sl_trigger(coin, trigger_price, is_long, entry_price, current_price)
+            if trigger_px is None:
+                return None
             
+            request = self.trigger_order_request(coin, "sl", is_long, position_size, trigger_px)
             result = self.exchange.order(
                 coin,
-                not is_long,
-                sl_size,
-                trigger_px,
-                order_type,
+                request["is_buy"],
+                request["sz"],
+                request["limit_px"],
+                request["order_type"],
                 reduce_only=True
             )
             
-            self._last_orders_fetch = 0
+            self._invalidate_state()
             return result
         
         except Exception as e:
-            print(f"❌ Ошибка установки SL: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Ошибка установки SL: {e}")
             return None
 
     def set_tp_only(self, coin, trigger_price, size):
@@ -504,18 +939,18 @@ class HyperliquidAPI:
                 return None
             
             # ✅ КРИТИЧНО: Сбрасываем кеш перед проверкой
-            self._last_orders_fetch = 0
+            self._invalidate_state()
             
-            time.sleep(1.5)
+            metrics.sleep(1.5, "set_tp")
             orders = self.get_open_orders(force_refresh=True)
             existing_tp = [o for o in orders if o["symbol"] == coin and o.get("tpsl") == "tp"]
             
             if existing_tp:
                 for old_order in existing_tp:
                     self.cancel_order(coin, old_order["oid"])
-                time.sleep(0.2)
+                metrics.sleep(0.2, "set_tp")
             
-            time.sleep(1.0)
+            metrics.sleep(1.0, "set_tp")
             
             positions = self.get_open_positions()
             position = next((p for p in positions if p["symbol"] == coin), None)
@@ -530,53 +965,76 @@ class HyperliquidAPI:
             if not current_price:
                 return None
             
-            if coin not in self.asset_info:
+            if not self.ensure_asset(coin):
                 return None
             
-            sz_decimals = self.asset_info[coin]["sz_decimals"]
-            trigger_px = self.round_price_sig_figs(trigger_price, max_sig_figs=5)
-            tp_size = round(size, sz_decimals)
-            
-            if is_long:
-                if trigger_px <= current_price * 1.001:
-                    trigger_px = max(current_price * 1.003, entry_price * 1.005)
-                    trigger_px = self.round_price_sig_figs(trigger_px, max_sig_figs=5)
-                    if trigger_px <= current_price * 1.002:
-                        print(f"⚠️ TP слишком близко: {trigger_px:.4f} <= {current_price:.4f}")
-                        return None
-            else:
-                if trigger_px >= current_price * 0.999:
-                    trigger_px = min(current_price * 0.997, entry_price * 0.995)
-                    trigger_px = self.round_price_sig_figs(trigger_px, max_sig_figs=5)
-                    if trigger_px >= current_price * 0.998:
-                        print(f"⚠️ TP слишком близко: {trigger_px:.4f} >= {current_price:.4f}")
-                        return None
-            
-            order_type = {
-                "trigger": {
-                    "triggerPx": trigger_px,
-                    "isMarket": True,
-                    "tpsl": "tp"
-                }
-            }
+            trigger_px = self.adjust_tp_trigger(coin, trigger_price, is_long, entry_price, current_price)
+            if trigger_px is None:
+                return None
             
+            request = self.trigger_order_request(coin, "tp", is_long, size, trigger_px)
             result = self.exchange.order(
                 coin,
-                not is_long,
-                tp_size,
-                trigger_px,
-                order_type,
+                request["is_buy"],
+                request["sz"],
+                request["limit_px"],
+                request["order_type"],
                 reduce_only=True
             )
             
-            self._last_orders_fetch = 0
+            self._invalidate_state()
             return result
         
         except Exception as e:
-            print(f"❌ Ошибка установки TP: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception(f"❌ Ошибка установки TP: {e}")
             return None
 
 
-hl_api = HyperliquidAPI()
+# ---------- Общий клиент ----------
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_hl_api():
+    """Общий клиент: создаётся и подключается при первом вызове."""
+    global _instance
+    api = _instance
+    if api is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = HyperliquidAPI().connect()
+            api = _instance
+    return api
+
+
+def set_hl_api(api):
+    """Подмена общего клиента (симулятор, тесты). Возвращает предыдущий."""
+    global _instance
+    with _instance_lock:
+        previous, _instance = _instance, api
+    return previous
+
+
+def close_hl_api():
+    """Закрытие общего клиента; следующее обращение создаст новый."""
+    global _instance
+    with _instance_lock:
+        api, _instance = _instance, None
+    if api is not None:
+        api.close()
+
+
+class _HyperliquidAPIProxy:
+    """Ленивая ссылка на общий клиент: `from hyperliquid_api import hl_api` не трогает сеть."""
+
+    def __getattr__(self, name):
+        return getattr(get_hl_api(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_hl_api(), name, value)
+
+    def __repr__(self):
+        return f"<hl_api → {_instance!r}>"
+
+
+hl_api = _HyperliquidAPIProxy()
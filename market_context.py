@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Рыночный контекст всей вселенной perp из одного запроса metaAndAssetCtxs: цены (mark,
+mid, oracle), 24h объём, open interest, funding и premium в массивах numpy с индексом
+по монете. Загружается раз за цикл свечей (и во время вызова AI); цены, размер позиции,
+промпт и скрининг читают его без отдельных запросов.
+"""
+
+import time
+import threading
+
+import numpy as np
+
+# Поля контекста → ключ ответа Info (значения — строки или None)
+CONTEXT_FIELDS = {
+    "mark": "markPx",
+    "mid": "midPx",
+    "oracle": "oraclePx",
+    "prev_day": "prevDayPx",
+    "volume": "dayNtlVlm",
+    "open_interest": "openInterest",
+    "funding": "funding",
+    "premium": "premium",
+}
+
+
+def _floats(ctxs, key):
+    """Поле контекстов → float64; отсутствующие значения (midPx у неликвидных) → nan."""
+    return np.array([c.get(key) if c.get(key) is not None else np.nan for c in ctxs], dtype=np.float64)
+
+
+def parse_asset_contexts(meta, ctxs):
+    """
+    Ответ metaAndAssetCtxs → таблица: "coins", "index" (монета → строка) и массивы полей
+    CONTEXT_FIELDS, выровненные по universe. open_interest — в долларах (монеты × mark).
+    """
+    universe = meta.get("universe", [])
+    n = min(len(universe), len(ctxs))
+    universe, ctxs = universe[:n], ctxs[:n]
+    coins = [asset.get("name", "") for asset in universe]
+
+    table = {field: _floats(ctxs, key) for field, key in CONTEXT_FIELDS.items()}
+    table["open_interest"] = table["open_interest"] * table["mark"]
+    table["delisted"] = np.array([bool(asset.get("isDelisted")) for asset in universe], dtype=bool)
+    table["coins"] = coins
+    table["index"] = {coin: i for i, coin in enumerate(coins)}
+    return table
+
+
+class MarketContext:
+    def __init__(self):
+        """Таблица заменяется целиком при загрузке: читатели не видят её частично обновлённой."""
+        self._lock = threading.Lock()
+        self._table = None
+        self._fetched_at = None  # monotonic
+        self.stats = {"ingests": 0, "errors": 0, "hits": 0, "misses": 0}
+
+    def ingest(self, meta, ctxs):
+        table = parse_asset_contexts(meta, ctxs)
+        with self._lock:
+            self._table = table
+            self._fetched_at = time.monotonic()
+        self.stats["ingests"] += 1
+        return table
+
+    def refresh(self, api=None):
+        """Один запрос metaAndAssetCtxs. False при ошибке API (таблица остаётся прежней)."""
+        if api is None:
+            from hyperliquid_api import hl_api
+            api = hl_api
+        response = api.get_asset_contexts()
+        if response is None:
+            self.stats["errors"] += 1
+            return False
+        self.ingest(*response)
+        return True
+
+    def age(self):
+        """Секунд с последней загрузки (inf, если загрузок не было)."""
+        fetched_at = self._fetched_at
+        return float("inf") if fetched_at is None else time.monotonic() - fetched_at
+
+    def table(self, max_age=None):
+        """Текущая таблица (не старше max_age секунд) или None."""
+        with self._lock:
+            table, fetched_at = self._table, self._fetched_at
+        if table is None or (max_age is not None and time.monotonic() - fetched_at > max_age):
+            return None
+        return table
+
+    def get(self, coin, max_age=None):
+        """Контекст монеты {поле: float или None} или None, если монеты нет или таблица устарела."""
+        table = self.table(max_age)
+        i = table["index"].get(coin) if table is not None else None
+        if i is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        context = {}
+        for field in CONTEXT_FIELDS:
+            value = float(table[field][i])
+            context[field] = value if np.isfinite(value) else None
+        return context
+
+    def mid(self, coin, max_age=None):
+        """Mid price (mark, если стакана нет) или None."""
+        context = self.get(coin, max_age)
+        if context is None:
+            return None
+        return context["mid"] or context["mark"]
+
+
+market_context = MarketContext()
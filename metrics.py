@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики горячего пути: время фаз цикла (свечи, индикаторы, промпт, AI, ордер, SL/TP, БД),
+счётчики и гистограммы задержек запросов по endpoint, ошибки API и время в паузах.
+Отдаются в формате Prometheus (HTTP /metrics) и сводной строкой раз в METRICS_SUMMARY_INTERVAL.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import ENABLE_METRICS, METRICS_BUCKETS
+from bot_logging import log_context
+
+# Фазы в порядке сводной строки
+PHASES = ("fetch", "indicators", "prompt", "ai", "order", "sltp", "db")
+
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по верхним границам корзин."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self, enabled=ENABLE_METRICS):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) → value
+        self._histograms = {}  # (name, labels) → Histogram
+
+    # ---------- Запись ----------
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def phase(self, name):
+        """Время фазы цикла → cycle_phase_seconds{phase}; фаза попадает в контекст логов."""
+        started = time.perf_counter()
+        try:
+            with log_context(phase=name):
+                yield
+        finally:
+            self.observe("cycle_phase_seconds", time.perf_counter() - started, phase=name)
+
+    @contextmanager
+    def request(self, endpoint):
+        """Запрос к внешнему API: счётчик, задержка и ошибки (исключения) по endpoint."""
+        started = time.perf_counter()
+        self.inc("api_requests_total", endpoint=endpoint)
+        try:
+            yield
+        except Exception:
+            self.inc("api_errors_total", endpoint=endpoint)
+            raise
+        finally:
+            self.observe("api_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+    def sleep(self, seconds, reason):
+        """time.sleep с учётом времени в паузах → sleep_seconds_total{reason}."""
+        if seconds <= 0:
+            return
+        time.sleep(seconds)
+        self.inc("sleep_seconds_total", seconds, reason=reason)
+
+    # ---------- Чтение ----------
+    def counter(self, name, **labels):
+        """Сумма счётчика по всем меткам, совпадающим с labels."""
+        with self._lock:
+            return sum(
+                value for (n, key_labels), value in self._counters.items()
+                if n == name and all(item in key_labels for item in labels.items())
+            )
+
+    def histogram(self, name, **labels):
+        """Гистограммы name с подходящими метками, объединённые в одну."""
+        merged = Histogram()
+        with self._lock:
+            for (n, key_labels), histogram in self._histograms.items():
+                if n != name or not all(item in key_labels for item in labels.items()):
+                    continue
+                if histogram.buckets != merged.buckets:
+                    continue
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.sum += histogram.sum
+                merged.count += histogram.count
+        return merged
+
+    def render(self):
+        """Текстовый формат Prometheus."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Сводная строка: среднее и p95 фаз, запросы API, доля ошибок, время в паузах."""
+        parts = []
+        for phase in PHASES:
+            histogram = self.histogram("cycle_phase_seconds", phase=phase)
+            if histogram.count:
+                parts.append(f"{phase} {histogram.sum / histogram.count:.2f}/{histogram.quantile(0.95):g}с")
+        requests = self.counter("api_requests_total")
+        errors = self.counter("api_errors_total")
+        error_rate = errors / requests * 100 if requests else 0.0
+        parts.append(f"API {requests:g} запросов, ошибок {error_rate:.1f}%")
+        parts.append(f"паузы {self.counter('sleep_seconds_total'):.0f}с")
+        return "📈 Метрики (среднее/p95): " + " | ".join(parts)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Instrumented:
+    """Прокси SDK-клиента (Info/Exchange): каждый вызов метода считается как запрос к endpoint."""
+
+    def __init__(self, target, prefix, registry):
+        self._target = target
+        self._prefix = prefix
+        self._registry = registry
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        endpoint = f"{self._prefix}.{name}"
+        registry = self._registry
+
+        def call(*args, **kwargs):
+            with registry.request(endpoint):
+                result = attr(*args, **kwargs)
+            # Exchange сообщает об отказе статусом, а не исключением
+            if isinstance(result, dict) and result.get("status") == "err":
+                registry.inc("api_errors_total", endpoint=endpoint)
+            return result
+
+        return call
+
+
+def instrument(client, prefix, registry=None):
+    """Обёртка клиента для учёта запросов (без метрик или повторно — как есть)."""
+    registry = registry or metrics
+    if client is None or not registry.enabled or isinstance(client, _Instrumented):
+        return client
+    return _Instrumented(client, prefix, registry)
+
+
+# ---------- HTTP ----------
+def start_metrics_server(host, port, registry=None):
+    """/metrics в формате Prometheus в фоновом потоке; возвращает сервер."""
+    registry = registry or metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+metrics = Metrics()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный OpenRouter-совместимый mock-сервер (/chat/completions)
+для нагрузочных тестов и бенчмарков AI без сети и затрат
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MALFORMED_KINDS = ("no_fields", "invalid_json", "no_choices", "http_500", "http_429")
+
+
+class MockBehavior:
+    """Поведение mock-сервера: распределение задержки, ошибки, воспроизведение ответов."""
+
+    def __init__(self, latency="fixed", latency_ms=300.0, latency_sigma=0.5,
+                 malformed_rate=0.0, malformed_kinds=MALFORMED_KINDS,
+                 replay_file=None, hold_rate=0.5, seed=None):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.malformed_rate = malformed_rate
+        self.malformed_kinds = tuple(malformed_kinds)
+        self.hold_rate = hold_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.replay = self._load_replay(replay_file) if replay_file else []
+        self._replay_pos = 0
+        self.stats = {"requests": 0, "streamed": 0, "malformed": 0, "replayed": 0}
+
+    @staticmethod
+    def _load_replay(path):
+        """Загрузка записанных ответов (JSONL из AI_RECORD_RESPONSES_FILE или полные ответы API)."""
+        responses = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "content" in record:
+                    responses.append(record)
+                elif record.get("choices"):
+                    responses.append({"content": record["choices"][0]["message"]["content"]})
+        return responses
+
+    def sample_latency(self):
+        """Задержка ответа в секундах."""
+        with self.lock:
+            if self.latency == "uniform":
+                ms = self.rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency == "lognormal":
+                ms = self.rng.lognormvariate(0, self.latency_sigma) * self.latency_ms
+            elif self.latency == "exponential":
+                ms = self.rng.expovariate(1.0 / self.latency_ms) if self.latency_ms > 0 else 0
+            else:
+                ms = self.latency_ms
+        return max(0.0, ms) / 1000.0
+
+    def pick_malformed(self):
+        """Тип некорректного ответа или None."""
+        with self.lock:
+            if self.malformed_rate > 0 and self.rng.random() < self.malformed_rate:
+                self.stats["malformed"] += 1
+                return self.rng.choice(self.malformed_kinds)
+        return None
+
+    def next_content(self, payload):
+        """Текст ответа модели: следующий записанный или синтетический."""
+        with self.lock:
+            if self.replay:
+                record = self.replay[self._replay_pos % len(self.replay)]
+                self._replay_pos += 1
+                self.stats["replayed"] += 1
+                return record["content"], record.get("latency")
+            return self._synthetic_content(payload), None
+
+    def _synthetic_content(self, payload):
+        messages = payload.get("messages", [])
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+        symbols = re.findall(r"^(\w+USDT):", user, flags=re.MULTILINE)
+
+        action = "hold" if (not symbols or self.rng.random() < self.hold_rate) else self.rng.choice(("buy", "sell"))
+
+        if "Score:" in system:
+            score = self.rng.randint(0, 100) if action != "hold" else self.rng.randint(0, 40)
+            return f"Action: {action}\nScore: {score}\nReason: Mock-сигнал"
+
+        if action != "hold":
+            action = f"{action}_{self.rng.choice(symbols)}"
+        return f"Action: {action}\nReason: Mock-сигнал"
+
+
+def estimate_mock_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def make_handler(behavior):
+    class MockOpenRouterHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": {"message": "Invalid JSON"}})
+                return
+
+            with behavior.lock:
+                behavior.stats["requests"] += 1
+
+            content, recorded_latency = behavior.next_content(payload)
+            latency = recorded_latency if recorded_latency is not None else behavior.sample_latency()
+            malformed = behavior.pick_malformed()
+
+            if malformed == "http_500":
+                time.sleep(latency)
+                self._send_json(500, {"error": {"message": "Mock internal error"}})
+                return
+            if malformed == "http_429":
+                self._send_json(429, {"error": {"message": "Mock rate limit"}})
+                return
+            if malformed == "no_fields":
+                content = "Не могу дать рекомендацию."
+
+            prompt_text = "".join(m.get("content", "") for m in payload.get("messages", []))
+            usage = {
+                "prompt_tokens": estimate_mock_tokens(prompt_text),
+                "completion_tokens": estimate_mock_tokens(content),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            usage["cost"] = 0.0
+
+            if payload.get("stream"):
+                self._stream(content, latency, usage, malformed)
+                return
+
+            time.sleep(latency)
+
+            if malformed == "invalid_json":
+                self._send_json(200, b'{"choices": [{"message": {"content": ')
+                return
+            if malformed == "no_choices":
+                self._send_json(200, {"id": "mock", "object": "chat.completion", "choices": []})
+                return
+
+            self._send_json(200, {
+                "id": f"mock-{int(time.time() * 1000)}",
+                "object": "chat.completion",
+                "model": payload.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        def _stream(self, content, latency, usage, malformed):
+            """SSE-ответ: первый чанк после задержки, затем по слову."""
+            with behavior.lock:
+                behavior.stats["streamed"] += 1
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            time.sleep(latency)
+
+            if malformed in ("invalid_json", "no_choices"):
+                self.wfile.write(b"data: {\"choices\": [\n\n")
+                self.wfile.flush()
+                return
+
+            pieces = re.findall(r"\S+\s*", content)
+            for i, piece in enumerate(pieces):
+                chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                if i == len(pieces) - 1:
+                    chunk["usage"] = usage
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return MockOpenRouterHandler
+
+
+def start_mock_server(behavior=None, host="127.0.0.1", port=0):
+    """Запуск mock-сервера в фоновом потоке. Возвращает (server, base_url)."""
+    behavior = behavior or MockBehavior()
+    server = ThreadingHTTPServer((host, port), make_handler(behavior))
+    server.daemon_threads = True
+    server.behavior = behavior
+
+    thread = threading.Thread(target=server.serve_forever, name="mock-openrouter", daemon=True)
+    thread.start()
+
+    base_url = f"http://{host}:{server.server_address[1]}/api/v1"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenRouter /chat/completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal", "exponential"), default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--hold-rate", type=float, default=0.5)
+    parser.add_argument("--replay", default=None, help="JSONL с записанными ответами")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    behavior = MockBehavior(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        malformed_rate=args.malformed_rate,
+        replay_file=args.replay,
+        hold_rate=args.hold_rate,
+        seed=args.seed,
+    )
+    server, base_url = start_mock_server(behavior, args.host, args.port)
+
+    print(f"🧪 Mock OpenRouter: {base_url}")
+    print(f"   OPENROUTER_BASE_URL={base_url}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Остановка. Статистика: {behavior.stats}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный WebSocket-заменитель Hyperliquid /ws для user_stream.py: подписки
+(webData2, orderUpdates, userFills), ping/pong и рассылка событий из тестов
+или симулятора. Только стандартная библиотека (RFC 6455, текстовые кадры).
+"""
+
+import json
+import base64
+import socket
+import struct
+import hashlib
+import argparse
+import threading
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Соединение закрыто")
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """Один кадр клиента → (opcode, payload). Клиентские кадры всегда маскированы."""
+    b1, b2 = _recv_exact(sock, 2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b2 & 0x80 else None
+    payload = _recv_exact(sock, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    """Кадр сервера (без маски, FIN=1)."""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+class _Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.subscriptions = {}  # channel → user
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        data = encode_frame(json.dumps(message).encode("utf-8"))
+        with self.lock:
+            self.sock.sendall(data)
+
+
+class UserStreamServer:
+    def __init__(self, host="127.0.0.1", port=0, snapshot_provider=None):
+        """
+        snapshot_provider(user) → данные webData2 ({"clearinghouseState", "openOrders"}),
+        отправляются сразу после подписки на webData2.
+        """
+        self.host = host
+        self.port = port
+        self.snapshot_provider = snapshot_provider
+        self._sock = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"connections": 0, "subscriptions": 0, "published": 0, "pings": 0}
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/ws"
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        self._sock.listen(16)
+        self._thread = threading.Thread(target=self._accept_loop, name="mock-user-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.disconnect_all()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def disconnect_all(self):
+        """Разрыв всех соединений (проверка переподключения клиента)."""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+                client.sock.close()
+            except OSError:
+                pass
+
+    def publish(self, channel, data, user=None):
+        """Рассылка сообщения канала подписчикам (с фильтром по адресу, если задан)."""
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            if channel not in client.subscriptions:
+                continue
+            if user is not None and client.subscriptions[channel] not in (None, user):
+                continue
+            try:
+                client.send({"channel": channel, "data": data})
+                self.stats["published"] += 1
+            except OSError:
+                pass
+
+    def _accept_loop(self):
+        while self._sock is not None:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        conn.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        return True
+
+    def _serve(self, conn):
+        try:
+            if not self._handshake(conn):
+                conn.close()
+                return
+        except OSError:
+            return
+
+        client = _Client(conn)
+        with self._lock:
+            self._clients.append(client)
+        self.stats["connections"] += 1
+
+        try:
+            while True:
+                opcode, payload = read_frame(conn)
+                if opcode == OP_CLOSE:
+                    with client.lock:
+                        conn.sendall(encode_frame(b"", OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    with client.lock:
+                        conn.sendall(encode_frame(payload, OP_PONG))
+                    continue
+                if opcode == OP_TEXT:
+                    self._handle(client, json.loads(payload.decode("utf-8")))
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                if client in self._clients:
+                    self._clients.remove(client)
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _handle(self, client, msg):
+        method = msg.get("method")
+        if method == "ping":
+            self.stats["pings"] += 1
+            client.send({"channel": "pong"})
+            return
+        if method != "subscribe":
+            return
+
+        subscription = msg.get("subscription", {})
+        channel = subscription.get("type")
+        user = subscription.get("user")
+        client.subscriptions[channel] = user
+        self.stats["subscriptions"] += 1
+        client.send({"channel": "subscriptionResponse", "data": msg})
+
+        if channel == "webData2" and self.snapshot_provider is not None:
+            client.send({"channel": "webData2", "data": self.snapshot_provider(user)})
+        elif channel == "userFills":
+            client.send({"channel": "userFills", "data": {"isSnapshot": True, "user": user, "fills": []}})
+
+
+def start_user_stream_server(host="127.0.0.1", port=0, snapshot_provider=None):
+    """Запуск в фоне; возвращает (server, url)."""
+    server = UserStreamServer(host, port, snapshot_provider).start()
+    return server, server.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный WebSocket-заменитель Hyperliquid user events")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    empty = {"clearinghouseState": {"assetPositions": [], "marginSummary": {}}, "openOrders": []}
+    server, url = start_user_stream_server(args.host, args.port, lambda user: empty)
+    print(f"🔌 Mock user stream: {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Сверка бота с биржей за один проход: один снимок аккаунта (позиции, ордера, цены),
+загрузка новых fills (fills.py) и одно чтение открытых позиций из БД → план действий
+(modify/place/cancel ордеров, записи в БД, закрытия), который исполняется пачками.
+Срабатывания TP/SL определяются по fills, а не по изменению размера позиции.
+"""
+
+from collections import defaultdict
+
+from config import (
+    ATR_MULTIPLIER,
+    TAKE_PROFIT_1_PERCENT,
+    TAKE_PROFIT_1_SIZE_PERCENT,
+    TAKE_PROFIT_2_PERCENT,
+    TAKE_PROFIT_2_SIZE_PERCENT,
+)
+from storage import db, now_ms
+from hyperliquid_api import hl_api
+from analytics import realized_pnl, record_closed_position, backfill_profit
+from fills import ingest_fills, tag_order, tag_orders, status_oid
+from bot_logging import get_logger
+
+log = get_logger("reconciliation")
+
+_DB_COLUMNS = (
+    "id", "symbol", "side", "quantity", "entry_price", "original_quantity",
+    "tp1_hit", "tp2_hit", "tp2_count", "atr", "last_known_size", "opened_at",
+)
+
+
+# ---------- Расчёт SL ----------
+def calculate_stop_loss(entry_price, side, atr):
+    """Расчёт цены Stop Loss"""
+    if side == "buy":
+        return entry_price - (atr * ATR_MULTIPLIER)
+    else:
+        return entry_price + (atr * ATR_MULTIPLIER)
+
+
+class ReconciliationPlan:
+    def __init__(self):
+        """Действия сверки; исполняются execute_plan() в порядке modify → place → cancel → БД."""
+        self.modifies = []   # (oid, order_request)
+        self.places = []     # order_request
+        self.cancels = []    # (coin, oid)
+        self.db_writes = []  # (sql, params)
+        self.closures = []   # {"id", "symbol", "coin", "close_reason", "opened_at"}
+        self.notes = []      # сообщения для лога
+
+    def order_actions(self):
+        return len(self.modifies) + len(self.places) + len(self.cancels)
+
+    def is_empty(self):
+        return not (self.order_actions() or self.db_writes or self.closures)
+
+
+# ---------- Снимок ----------
+def take_snapshot(api=None):
+    """
+    Снимок биржи с индексами: positions_by_coin, orders_by_key[(coin, tpsl)],
+    triggers_by_coin[coin]. None, если биржа недоступна.
+    """
+    snapshot = (api or hl_api).get_snapshot()
+    if snapshot is None:
+        return None
+
+    orders_by_key = defaultdict(list)
+    triggers_by_coin = defaultdict(list)
+    for order in snapshot["orders"]:
+        coin = order["symbol"]
+        if order.get("tpsl"):
+            orders_by_key[(coin, order["tpsl"])].append(order)
+        if order.get("is_trigger"):
+            triggers_by_coin[coin].append(order)
+
+    snapshot["positions_by_coin"] = {p["symbol"]: p for p in snapshot["positions"]}
+    snapshot["orders_by_key"] = orders_by_key
+    snapshot["triggers_by_coin"] = triggers_by_coin
+    return snapshot
+
+
+def load_db_state(storage=db):
+    """Открытые позиции БД одним запросом: список словарей по колонкам _DB_COLUMNS."""
+    rows = storage.fetchall(
+        f"SELECT {', '.join(_DB_COLUMNS)} FROM positions WHERE status='open'"
+    )
+    return [dict(zip(_DB_COLUMNS, row)) for row in rows]
+
+
+# ---------- Планирование ----------
+def plan_reconciliation(snapshot, db_rows, api=None, fired=None):
+    """
+    План сверки: строки БД для новых позиций, восстановление SL/TP (и перестановка
+    после TP по fills — fired), закрытие позиций, исчезнувших с биржи без закрывающих
+    fills, и отмена осиротевших триггеров. fired=None — fills не загружены, закрытия
+    откладываются до следующей сверки.
+    """
+    api = api or hl_api
+    plan = ReconciliationPlan()
+    positions_by_coin = snapshot["positions_by_coin"]
+    rows_by_key = {(row["symbol"], row["side"]): row for row in db_rows}
+
+    for coin, position in positions_by_coin.items():
+        tp_fired = bool(fired) and "tp" in fired.get(coin, ())
+        row = rows_by_key.get((coin + "USDT", _side_db(position)))
+        _plan_position(plan, api, snapshot, coin, position, row, tp_fired)
+
+    if fired is not None:
+        for row in db_rows:
+            coin = row["symbol"].replace("USDT", "")
+            if coin not in positions_by_coin:
+                _plan_closure(plan, coin, row)
+
+    for coin, triggers in snapshot["triggers_by_coin"].items():
+        if coin not in positions_by_coin:
+            plan.cancels.extend((coin, o["oid"]) for o in triggers)
+
+    return plan
+
+
+def _side_db(position):
+    return "buy" if position["side"] == "long" else "sell"
+
+
+def _plan_position(plan, api, snapshot, coin, position, row, tp_fired=False):
+    sym_db = coin + "USDT"
+    direction = position["side"]
+    side_db = _side_db(position)
+    current_size = position["size"]
+    entry_price = position["entry_price"]
+    current_value = current_size * entry_price
+
+    if row is None:
+        plan.db_writes.append((
+            """
+            INSERT INTO positions (
+                symbol, side, quantity, entry_price, position_value,
+                atr, stop_loss, stop_loss_percent, original_quantity, last_known_size, opened_at
+            ) VALUES (?, ?, ?, ?, ?, 0, 0, 0, ?, ?, ?)
+            """,
+            (sym_db, side_db, current_size, entry_price, current_value, current_size, current_size, now_ms()),
+        ))
+        row = {
+            "id": None, "quantity": current_size, "entry_price": entry_price,
+            "original_quantity": current_size, "tp1_hit": 0, "tp2_hit": 0, "tp2_count": 0,
+            "atr": 0, "last_known_size": current_size,
+        }
+        plan.notes.append(f"📥 {coin}: позиция добавлена в БД")
+
+    pos_id = row["id"]
+    orig_qty = row["original_quantity"] or 0
+    tp1_hit = row["tp1_hit"]
+    tp2_count = row["tp2_count"] or 0
+    atr = row["atr"]
+
+    def write(sql, params):
+        if pos_id is not None:
+            plan.db_writes.append((sql, params + (pos_id,)))
+
+    # Entry Price и размер из биржи (только при изменении)
+    if abs(entry_price - (row["entry_price"] or 0)) > 0.01 or abs(current_size - (row["quantity"] or 0)) > 1e-12:
+        write(
+            "UPDATE positions SET entry_price=?, quantity=?, position_value=? WHERE id=?",
+            (entry_price, current_size, current_value),
+        )
+
+    # ✅ КРИТИЧНО: При доборе обновляем original_quantity
+    if current_size > orig_qty * 1.05:
+        if pos_id is not None:
+            plan.notes.append(f"📊 {coin}: Обнаружен добор, обновляем original_quantity: {orig_qty:.4f} → {current_size:.4f}")
+        write("UPDATE positions SET original_quantity=? WHERE id=?", (current_size,))
+        orig_qty = current_size
+
+    orders_by_key = snapshot["orders_by_key"]
+    sl_orders = [o for o in orders_by_key.get((coin, "sl"), ()) if o.get("reduce_only")]
+    tp_orders = [o for o in orders_by_key.get((coin, "tp"), ()) if o.get("reduce_only")]
+
+    needs_sl_update = (
+        len(sl_orders) != 1
+        or abs(sl_orders[0]["size"] - current_size) > current_size * 0.02
+    )
+    needs_tp_update = len(tp_orders) != 1
+
+    # TP исполнился (по fills): новый TP, после TP1 — SL на безубыток
+    if tp_fired:
+        needs_tp_update = True
+        needs_sl_update = True
+
+    if not (needs_sl_update or needs_tp_update):
+        return
+
+    current_price = snapshot["mids"].get(coin)
+    if not current_price or not api.ensure_asset(coin):
+        plan.notes.append(f"⚠️ {coin}: нет цены или метаданных, SL/TP не обновлены")
+        return
+
+    is_long = direction == "long"
+
+    if needs_sl_update:
+        if tp1_hit:
+            # После TP1 — SL на безубыток
+            sl_price = entry_price
+        elif atr and atr > 0:
+            sl_price = calculate_stop_loss(entry_price, side_db, atr)
+        else:
+            # Если ATR нет — фиксированный процент
+            sl_price = entry_price * 0.985 if is_long else entry_price * 1.015
+
+        if not sl_orders:
+            plan.notes.append(f"⚠️ {coin}: Отсутствует SL! Восстанавливаем...")
+        trigger_px = api.adjust_sl_trigger(coin, sl_price, is_long, entry_price, current_price)
+        if trigger_px is not None:
+            request = api.trigger_order_request(coin, "sl", is_long, current_size, trigger_px)
+            _replace_orders(plan, coin, orders_by_key.get((coin, "sl"), ()), request)
+
+    if needs_tp_update:
+        request = None
+        if not tp1_hit:
+            # TP1: часть от original_quantity
+            tp_offset = TAKE_PROFIT_1_PERCENT
+            tp_size = orig_qty * (TAKE_PROFIT_1_SIZE_PERCENT / 100)
+        else:
+            # TP2: часть от текущего размера, прогрессивная цена
+            tp_offset = TAKE_PROFIT_1_PERCENT + TAKE_PROFIT_2_PERCENT * (tp2_count + 1)
+            tp_size = current_size * (TAKE_PROFIT_2_SIZE_PERCENT / 100)
+            if orig_qty <= 0 or (current_size / orig_qty) * 100 <= 1.0 or tp_size < 0.0001:
+                tp_size = 0
+
+        if tp_size > 0:
+            tp_price = entry_price * (1 + tp_offset / 100) if is_long else entry_price * (1 - tp_offset / 100)
+            trigger_px = api.adjust_tp_trigger(coin, tp_price, is_long, entry_price, current_price)
+            if trigger_px is not None:
+                request = api.trigger_order_request(coin, "tp", is_long, tp_size, trigger_px)
+        if request is not None:
+            _replace_orders(plan, coin, orders_by_key.get((coin, "tp"), ()), request)
+
+
+def _replace_orders(plan, coin, existing, request):
+    """Один существующий ордер изменяется на месте, лишние отменяются, иначе — новый."""
+    if existing:
+        plan.modifies.append((existing[0]["oid"], request))
+        plan.cancels.extend((coin, o["oid"]) for o in existing[1:])
+    else:
+        plan.places.append(request)
+
+
+def _plan_closure(plan, coin, row):
+    """Позиции нет на бирже, а закрывающих fills не было: закрытие вне бота."""
+    plan.notes.append(f"⚪ {row['symbol']}: позиция закрыта вне бота")
+    plan.closures.append({
+        "id": row["id"],
+        "symbol": row["symbol"],
+        "coin": coin,
+        "close_reason": "manual",
+        "opened_at": row["opened_at"],
+    })
+
+
+# ---------- Исполнение ----------
+def execute_plan(plan, snapshot=None, api=None, storage=db):
+    """
+    Исполнение плана: пачками modify → place → cancel (новая защита ставится до
+    снятия старой), затем все записи БД, события и закрытия одним unit of work.
+    Возвращает количество успешных действий с ордерами.
+    """
+    api = api or hl_api
+    for note in plan.notes:
+        log.warning(note) if note.startswith("⚠️") else log.info(note)
+
+    succeeded = 0
+    tags = []
+    for requests, statuses in (
+        ([request for _, request in plan.modifies], api.bulk_modify(plan.modifies)),
+        (plan.places, api.bulk_place(plan.places)),
+        ([None] * len(plan.cancels), api.bulk_cancel(plan.cancels)),
+    ):
+        for request, status in zip(requests, statuses):
+            if "error" in status:
+                log.error(f"❌ Ордер сверки отклонён: {status['error']}")
+                continue
+            succeeded += 1
+            if request is not None:
+                tags.append((request["coin"], request["order_type"]["trigger"]["tpsl"], status_oid(status)))
+
+    # PnL закрытых позиций запрашивается до транзакции
+    closures = []
+    for closure in plan.closures:
+        closed_at = now_ms()
+        profit = realized_pnl(closure["coin"], closure["opened_at"], closed_at, api=api)
+        if profit is None:
+            log.warning(f"⚠️ {closure['symbol']}: PnL не получен, будет запрошен при следующей сверке")
+        closures.append((closure, closed_at, profit))
+
+    if plan.db_writes or closures or tags:
+        with storage.unit_of_work():
+            for sql, params in plan.db_writes:
+                storage.write(sql, params)
+            for coin, kind, oid in tags:
+                tag_order(coin, kind, oid, storage=storage)
+            for closure, closed_at, profit in closures:
+                storage.write(
+                    "UPDATE positions SET status='closed', closed_at=?, close_reason=?, profit=? WHERE id=?",
+                    (closed_at, closure["close_reason"], profit, closure["id"]),
+                )
+                record_closed_position(closure["id"], storage=storage)
+
+    if snapshot is not None and plan.order_actions():
+        # Ордера в снимке устарели: для отображения берём актуальные
+        snapshot["orders"] = api.get_open_orders(force_refresh=True)
+
+    return succeeded
+
+
+def reconcile(api=None, storage=db):
+    """Полная сверка: снимок → план → исполнение. Возвращает снимок (или None)."""
+    api = api or hl_api
+    snapshot = take_snapshot(api)
+    if snapshot is None:
+        return None
+
+    try:
+        tag_orders(snapshot["orders"], storage)
+        fired = ingest_fills(api, storage)
+        plan = plan_reconciliation(snapshot, load_db_state(storage), api, fired)
+        if not plan.is_empty():
+            updated = execute_plan(plan, snapshot, api, storage)
+            if updated:
+                log.info(f"✅ Сверка позиций: выполнено действий с ордерами {updated}")
+        backfill_profit(api, storage)
+    except Exception as e:
+        log.exception(f"❌ Ошибка сверки позиций: {e}")
+
+    return snapshot
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Ретеншн trade_events: перенос старых событий в архив (таблица или JSONL),
+дневные агрегаты и incremental vacuum, чтобы горячая таблица оставалась маленькой
+"""
+
+import json
+import time
+import argparse
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from config import (
+    ENABLE_TRADE_EVENTS_RETENTION,
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_GRACE_MINUTES,
+    RETENTION_ARCHIVE_MODE,
+    RETENTION_ARCHIVE_FILE,
+    RETENTION_DAILY_AGGREGATES,
+    RETENTION_BATCH_SIZE,
+    RETENTION_VACUUM_PAGES,
+)
+from storage import db, now_ms as current_ms
+from event_index import MAX_COOLDOWN_SECONDS
+from bot_logging import get_logger
+
+log = get_logger("retention")
+
+ARCHIVE_MODES = ("table", "file", "none")
+
+_last_run = None
+
+
+def retention_cutoff_ms(now_ms=None, grace_minutes=RETENTION_GRACE_MINUTES):
+    """Граница горячей таблицы: самое длинное окно cooldown + запас."""
+    now_ms = now_ms if now_ms is not None else current_ms()
+    return now_ms - (MAX_COOLDOWN_SECONDS + grace_minutes * 60) * 1000
+
+
+def _utc_day(event_time_ms):
+    return datetime.fromtimestamp(event_time_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _daily_aggregates(rows):
+    """(day, symbol, event_type, side) → [count, first_time, last_time]."""
+    daily = defaultdict(lambda: [0, None, None])
+    for _, symbol, event_type, side, event_time, _ in rows:
+        agg = daily[(_utc_day(event_time), symbol, event_type, side)]
+        agg[0] += 1
+        agg[1] = event_time if agg[1] is None else min(agg[1], event_time)
+        agg[2] = event_time if agg[2] is None else max(agg[2], event_time)
+    return daily
+
+
+def _append_archive_file(path, rows, archived_at):
+    """Дозапись пачки в JSONL до удаления из БД (при сбое возможен повтор, но не потеря)."""
+    with open(path, "a", encoding="utf-8") as f:
+        for event_id, symbol, event_type, side, event_time, details in rows:
+            f.write(json.dumps({
+                "id": event_id,
+                "symbol": symbol,
+                "event_type": event_type,
+                "side": side,
+                "event_time": event_time,
+                "details": details,
+                "archived_at": archived_at,
+            }, ensure_ascii=False) + "\n")
+        f.flush()
+
+
+def _archive_batch(storage, rows, archive_mode, archive_file, aggregate):
+    archived_at = current_ms()
+    if archive_mode == "file":
+        _append_archive_file(archive_file, rows, archived_at)
+
+    with storage.transaction():
+        if archive_mode == "table":
+            storage.executemany(
+                """
+                INSERT OR REPLACE INTO trade_events_archive
+                (id, symbol, event_type, side, event_time, details, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [row + (archived_at,) for row in rows],
+            )
+
+        if aggregate:
+            storage.executemany(
+                """
+                INSERT INTO trade_events_daily
+                (day, symbol, event_type, side, event_count, first_time, last_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(day, symbol, event_type, side) DO UPDATE SET
+                    event_count = event_count + excluded.event_count,
+                    first_time = min(first_time, excluded.first_time),
+                    last_time = max(last_time, excluded.last_time)
+                """,
+                [key + tuple(agg) for key, agg in _daily_aggregates(rows).items()],
+            )
+
+        storage.executemany(
+            "DELETE FROM trade_events WHERE id=?",
+            [(row[0],) for row in rows],
+        )
+
+
+def run_retention(storage=db, now_ms=None, archive_mode=RETENTION_ARCHIVE_MODE,
+                  archive_file=RETENTION_ARCHIVE_FILE, aggregate=RETENTION_DAILY_AGGREGATES,
+                  batch_size=RETENTION_BATCH_SIZE, vacuum_pages=RETENTION_VACUUM_PAGES):
+    """
+    Один проход ретеншна. Пачками (по индексу event_time) переносит события
+    старше retention_cutoff_ms() в архив и агрегаты, затем incremental vacuum.
+    """
+    if archive_mode not in ARCHIVE_MODES:
+        raise ValueError(f"Неизвестный RETENTION_ARCHIVE_MODE: {archive_mode}")
+
+    started = time.perf_counter()
+    cutoff_ms = retention_cutoff_ms(now_ms)
+    moved = 0
+
+    while True:
+        rows = storage.fetchall(
+            """
+            SELECT id, symbol, event_type, side, event_time, details FROM trade_events
+            WHERE event_time < ?
+            ORDER BY event_time
+            LIMIT ?
+            """,
+            (cutoff_ms, batch_size),
+        )
+        if not rows:
+            break
+        _archive_batch(storage, rows, archive_mode, archive_file, aggregate)
+        moved += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    free_pages = storage.incremental_vacuum(vacuum_pages) if vacuum_pages else None
+    hot_rows = storage.fetchone("SELECT COUNT(*) FROM trade_events")[0]
+
+    return {
+        "moved": moved,
+        "hot_rows": hot_rows,
+        "free_pages": free_pages,
+        "cutoff_ms": cutoff_ms,
+        "elapsed": time.perf_counter() - started,
+    }
+
+
+def maybe_run_retention(storage=db):
+    """Запуск ретеншна не чаще RETENTION_INTERVAL_SECONDS (из основного цикла)."""
+    global _last_run
+    if not ENABLE_TRADE_EVENTS_RETENTION:
+        return None
+
+    now = time.monotonic()
+    if _last_run is not None and now - _last_run < RETENTION_INTERVAL_SECONDS:
+        return None
+    _last_run = now
+
+    try:
+        stats = run_retention(storage)
+    except Exception as e:
+        log.error(f"❌ Ошибка ретеншна trade_events: {e}")
+        return None
+
+    if stats["moved"]:
+        log.info(
+            f"🗄️ Ретеншн: перенесено {stats['moved']} событий ({RETENTION_ARCHIVE_MODE}), "
+            f"в горячей таблице {stats['hot_rows']} | {stats['elapsed'] * 1000:.0f} мс"
+        )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ретеншн trade_events")
+    parser.add_argument("--mode", choices=ARCHIVE_MODES, default=RETENTION_ARCHIVE_MODE)
+    parser.add_argument("--file", default=RETENTION_ARCHIVE_FILE)
+    parser.add_argument("--no-aggregate", action="store_true")
+    parser.add_argument("--vacuum-pages", type=int, default=RETENTION_VACUUM_PAGES)
+    args = parser.parse_args()
+
+    db.init_schema()
+    stats = run_retention(
+        db,
+        archive_mode=args.mode,
+        archive_file=args.file,
+        aggregate=not args.no_aggregate,
+        vacuum_pages=args.vacuum_pages,
+    )
+    db.close()
+
+    print(f"🗄️ Перенесено: {stats['moved']} | осталось в trade_events: {stats['hot_rows']}")
+    print(f"🧹 Свободных страниц после vacuum: {stats['free_pages']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Расписание по закрытиям свечей: запуск через заданное смещение после границы бара
+(UTC, как у свечей Hyperliquid). Цель считается по настенному времени заново перед
+каждым ожиданием, поэтому время обработки и уход monotonic не накапливаются.
+Отклонение фактического запуска от цели (jitter) копится в окне для статистики.
+"""
+
+import time
+from collections import deque
+
+from config import SCHEDULE_JITTER_WINDOW
+
+TIMEFRAME_SECONDS = {
+    "1m": 60,
+    "3m": 180,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "1h": 3600,
+    "2h": 7200,
+    "4h": 14400,
+    "8h": 28800,
+    "12h": 43200,
+    "1d": 86400,
+}
+
+
+class CandleCloseSchedule:
+    def __init__(self, offsets, jitter_window=SCHEDULE_JITTER_WINDOW):
+        """
+        offsets — {timeframe: секунд после закрытия}; запуск после ближайшего закрытия
+        любого из таймфреймов. Смещение даёт бирже время закрыть бар.
+        """
+        unknown = [tf for tf in offsets if tf not in TIMEFRAME_SECONDS]
+        if unknown:
+            raise ValueError(f"Неизвестные таймфреймы расписания: {unknown}")
+        if not offsets:
+            raise ValueError("Пустое расписание")
+        self.offsets = {tf: float(offset) for tf, offset in offsets.items()}
+
+        self.target = None       # Настенное время следующего запуска (секунды)
+        self.boundary = None     # Граница бара, к которой относится target
+        self.timeframe = None
+        self._jitter = deque(maxlen=jitter_window)
+        self.stats = {"fires": 0, "missed": 0, "last_jitter_ms": 0.0, "max_jitter_ms": 0.0}
+
+    def next_fire(self, now=None):
+        """(время запуска, граница бара, таймфрейм) ближайшего запуска строго после now."""
+        now = time.time() if now is None else now
+        best = None
+        for tf, offset in self.offsets.items():
+            period = TIMEFRAME_SECONDS[tf]
+            boundary = (int((now - offset) // period) + 1) * period
+            # Из совпадающих границ — старший таймфрейм (закрытие 1h важнее 3m)
+            key = (boundary + offset, -period)
+            if best is None or key < best[0]:
+                best = (key, boundary, tf)
+        (fire, _), boundary, tf = best
+        return fire, boundary, tf
+
+    def arm(self, now=None):
+        """Назначение следующего запуска; пропущенные за время обработки закрытия учитываются."""
+        now = time.time() if now is None else now
+        after = now
+        if self.target is not None:
+            # Не раньше текущей цели: запуск чуть до неё не должен повторить ту же границу
+            after = max(now, self.target)
+            fire, _, _ = self.next_fire(self.target)
+            while fire <= now:
+                self.stats["missed"] += 1
+                fire, _, _ = self.next_fire(fire)
+        self.target, self.boundary, self.timeframe = self.next_fire(after)
+
+    def seconds_until_due(self):
+        return self.target - time.time()
+
+    def record_fire(self, now=None):
+        """Отклонение фактического запуска от цели (мс)."""
+        now = time.time() if now is None else now
+        jitter_ms = (now - self.target) * 1000
+        self._jitter.append(jitter_ms)
+        self.stats["fires"] += 1
+        self.stats["last_jitter_ms"] = jitter_ms
+        self.stats["max_jitter_ms"] = max(self.stats["max_jitter_ms"], jitter_ms)
+        return jitter_ms
+
+    def jitter_stats(self):
+        """Среднее, p95 и максимум jitter по окну последних запусков (мс)."""
+        if not self._jitter:
+            return {"count": 0, "mean_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        values = sorted(self._jitter)
+        return {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p95_ms": values[min(len(values) - 1, int(0.95 * len(values)))],
+            "max_ms": values[-1],
+        }
+
+    def last_close_ms(self, now=None):
+        """Последняя закрытая граница бара среди таймфреймов расписания (epoch ms)."""
+        now = time.time() if now is None else now
+        return int(max((now // TIMEFRAME_SECONDS[tf]) * TIMEFRAME_SECONDS[tf] for tf in self.offsets) * 1000)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Скрининг всей вселенной perp по таблице market_context (один запрос metaAndAssetCtxs):
+mark price, 24h объём, open interest и funding фильтруются и ранжируются векторно.
+Дальше (свечи, AI) идут только top K монет.
+"""
+
+import numpy as np
+
+from config import (
+    SCAN_TOP_K,
+    SCAN_MIN_DAY_VOLUME,
+    SCAN_MIN_OPEN_INTEREST,
+    SCAN_WEIGHTS,
+    SCAN_EXCLUDE,
+)
+from market_context import market_context
+
+
+def _zscore(values, mask):
+    """z-score по подходящим монетам; при нулевом разбросе — нули."""
+    picked = values[mask]
+    std = picked.std() if picked.size else 0.0
+    if not std or not np.isfinite(std):
+        return np.zeros_like(values)
+    return (values - picked.mean()) / std
+
+
+def screen(table, top_k=SCAN_TOP_K, min_volume=SCAN_MIN_DAY_VOLUME,
+           min_open_interest=SCAN_MIN_OPEN_INTEREST, weights=SCAN_WEIGHTS, exclude=SCAN_EXCLUDE):
+    """
+    Ранжирование: взвешенная сумма z-score ликвидности (log объёма и OI), движения
+    за сутки (|log(mark/prevDay)|) и |funding|. Возвращает [(coin, score), ...] top K.
+    """
+    coins = table["coins"]
+    if not coins:
+        return []
+    mark, prev_day = table["mark"], table["prev_day"]
+    volume, open_interest, funding = table["volume"], table["open_interest"], table["funding"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        move = np.abs(np.log(mark / prev_day))
+    eligible = (
+        ~table["delisted"]
+        & np.isfinite(mark) & (mark > 0)
+        & np.isfinite(move)
+        & (np.nan_to_num(volume) >= min_volume)
+        & (np.nan_to_num(open_interest) >= min_open_interest)
+    )
+    if exclude:
+        eligible &= ~np.isin(np.array(coins, dtype=object), list(exclude))
+    if not eligible.any():
+        return []
+
+    score = (
+        weights.get("volume", 0.0) * _zscore(np.log1p(np.nan_to_num(volume)), eligible)
+        + weights.get("open_interest", 0.0) * _zscore(np.log1p(np.nan_to_num(open_interest)), eligible)
+        + weights.get("move", 0.0) * _zscore(np.nan_to_num(move), eligible)
+        + weights.get("funding", 0.0) * _zscore(np.abs(np.nan_to_num(funding)), eligible)
+    )
+    score = np.where(eligible, score, -np.inf)
+
+    k = min(top_k, int(eligible.sum()))
+    top = np.argpartition(-score, k - 1)[:k]
+    top = top[np.argsort(-score[top])]
+    return [(coins[i], float(score[i])) for i in top]
+
+
+def scan_universe(context=market_context, top_k=SCAN_TOP_K, max_age=None):
+    """
+    Символы (COINUSDT) top K по скринингу таблицы контекста; таблица загружается,
+    если её нет или она старше max_age. None при ошибке API.
+    """
+    table = context.table(max_age)
+    if table is None:
+        if not context.refresh():
+            return None
+        table = context.table()
+    ranked = screen(table, top_k=top_k)
+    return [coin + "USDT" for coin, _ in ranked]
@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+"""
+Слой хранения позиций и событий: одно долгоживущее SQLite-соединение в режиме WAL
+и фоновый поток-писатель, чтобы торговый поток не ждал диск
+"""
+
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import (
+    DB_PATH,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+    DB_STATEMENT_CACHE,
+    DB_ASYNC_WRITES,
+    DB_WRITE_QUEUE_SIZE,
+    DB_WRITE_BATCH_SIZE,
+)
+from metrics import metrics
+from bot_logging import get_logger
+
+log = get_logger("storage")
+
+
+# Фикс Python 3.12 sqlite3 datetime deprecation
+def register_datetime_adapter():
+    def adapt_datetime(dt):
+        return dt.isoformat()
+    sqlite3.register_adapter(datetime, adapt_datetime)
+
+register_datetime_adapter()
+
+
+SCHEMA_VERSION = 4
+
+# Время в БД — целые epoch миллисекунды (UTC)
+NOW_MS_SQL = "(CAST(strftime('%s', 'now') AS INTEGER) * 1000)"
+
+# Маркер остановки потока-писателя
+_STOP = object()
+
+POSITIONS_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    side TEXT,
+    quantity REAL,
+    entry_price REAL,
+    position_value REAL,
+    atr REAL,
+    stop_loss REAL,
+    stop_loss_percent REAL,
+    original_quantity REAL,
+    tp1_hit INTEGER DEFAULT 0,
+    tp2_hit INTEGER DEFAULT 0,
+    tp2_count INTEGER DEFAULT 0,
+    last_known_size REAL DEFAULT 0,
+    status TEXT DEFAULT 'open',
+    profit REAL,  -- NULL, пока реализованный PnL не известен
+    opened_at INTEGER DEFAULT """ + NOW_MS_SQL + """,
+    closed_at INTEGER,
+    close_reason TEXT
+)
+"""
+
+POSITION_COLUMNS = (
+    "id", "symbol", "side", "quantity", "entry_price", "position_value", "atr",
+    "stop_loss", "stop_loss_percent", "original_quantity", "tp1_hit", "tp2_hit",
+    "tp2_count", "last_known_size", "status", "profit", "opened_at", "closed_at",
+    "close_reason",
+)
+
+TRADE_EVENTS_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    side TEXT NOT NULL,
+    event_time INTEGER NOT NULL DEFAULT """ + NOW_MS_SQL + """,
+    details TEXT
+)
+"""
+
+
+TRADE_EVENTS_ARCHIVE_DDL = """
+CREATE TABLE IF NOT EXISTS trade_events_archive (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    side TEXT NOT NULL,
+    event_time INTEGER NOT NULL,
+    details TEXT,
+    archived_at INTEGER NOT NULL
+)
+"""
+
+# Дневные счётчики событий (день — UTC 'YYYY-MM-DD')
+TRADE_EVENTS_DAILY_DDL = """
+CREATE TABLE IF NOT EXISTS trade_events_daily (
+    day TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    side TEXT NOT NULL,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    first_time INTEGER,
+    last_time INTEGER,
+    PRIMARY KEY (day, symbol, event_type, side)
+) WITHOUT ROWID
+"""
+
+# Агрегаты закрытых позиций, поддерживаются инкрементально при закрытии (analytics.py)
+POSITION_STATS_DDL = """
+CREATE TABLE IF NOT EXISTS position_stats (
+    symbol TEXT NOT NULL,
+    side TEXT NOT NULL,
+    close_reason TEXT NOT NULL,
+    trades INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    total_pnl REAL NOT NULL DEFAULT 0,
+    gross_profit REAL NOT NULL DEFAULT 0,
+    gross_loss REAL NOT NULL DEFAULT 0,
+    best_pnl REAL,
+    worst_pnl REAL,
+    total_hold_ms INTEGER NOT NULL DEFAULT 0,
+    last_closed_at INTEGER,
+    PRIMARY KEY (symbol, side, close_reason)
+) WITHOUT ROWID
+"""
+
+# Исполнения (user fills) биржи; tid — идентификатор сделки Hyperliquid (fills.py)
+FILLS_DDL = """
+CREATE TABLE IF NOT EXISTS fills (
+    tid INTEGER PRIMARY KEY,
+    oid INTEGER,
+    coin TEXT NOT NULL,
+    side TEXT NOT NULL,
+    px REAL NOT NULL,
+    sz REAL NOT NULL,
+    start_position REAL NOT NULL,
+    closed_pnl REAL NOT NULL DEFAULT 0,
+    fee REAL NOT NULL DEFAULT 0,
+    time INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    position_id INTEGER
+)
+"""
+
+# Назначение наших ордеров (entry/tp/sl/flip) по oid для атрибуции fills
+ORDER_TAGS_DDL = """
+CREATE TABLE IF NOT EXISTS order_tags (
+    oid INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+)
+"""
+
+# Курсоры инкрементальной загрузки (name → epoch мс)
+SYNC_CURSORS_DDL = """
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# Добавление закрытых позиций (отобранных условием {where}) в position_stats.
+# Позиции с profit NULL (PnL ещё не получен с биржи) пропускаются до analytics.backfill_profit()
+POSITION_STATS_ACCUMULATE_SQL = """
+INSERT INTO position_stats (
+    symbol, side, close_reason, trades, wins, losses, total_pnl, gross_profit,
+    gross_loss, best_pnl, worst_pnl, total_hold_ms, last_closed_at
+)
+SELECT
+    symbol, COALESCE(side, ''), COALESCE(close_reason, 'unknown'), COUNT(*),
+    SUM(profit > 0), SUM(profit < 0), SUM(profit), SUM(MAX(profit, 0)),
+    SUM(MIN(profit, 0)), MAX(profit), MIN(profit),
+    SUM(MAX(COALESCE(closed_at - opened_at, 0), 0)), MAX(closed_at)
+FROM positions
+WHERE status = 'closed' AND profit IS NOT NULL AND {where}
+GROUP BY symbol, COALESCE(side, ''), COALESCE(close_reason, 'unknown')
+ON CONFLICT(symbol, side, close_reason) DO UPDATE SET
+    trades = trades + excluded.trades,
+    wins = wins + excluded.wins,
+    losses = losses + excluded.losses,
+    total_pnl = total_pnl + excluded.total_pnl,
+    gross_profit = gross_profit + excluded.gross_profit,
+    gross_loss = gross_loss + excluded.gross_loss,
+    best_pnl = max(COALESCE(best_pnl, excluded.best_pnl), excluded.best_pnl),
+    worst_pnl = min(COALESCE(worst_pnl, excluded.worst_pnl), excluded.worst_pnl),
+    total_hold_ms = total_hold_ms + excluded.total_hold_ms,
+    last_closed_at = max(COALESCE(last_closed_at, 0), excluded.last_closed_at)
+"""
+
+
+def _text_to_ms(column):
+    """SQL-выражение: текстовый UTC TIMESTAMP (или уже число) → epoch мс."""
+    return (
+        f"CASE WHEN typeof({column}) IN ('integer', 'real') THEN CAST({column} AS INTEGER) "
+        f"ELSE CAST(strftime('%s', {column}) AS INTEGER) * 1000 END"
+    )
+
+
+def now_ms():
+    """Текущее время в epoch миллисекундах."""
+    return int(time.time() * 1000)
+
+
+class UnitOfWork:
+    """Накопитель изменений позиций и событий за один проход; применяется одной транзакцией."""
+
+    def __init__(self):
+        self.ops = []
+        self.on_commit = []
+
+    def add(self, sql, params=()):
+        self.ops.append((sql, params))
+
+    def __len__(self):
+        return len(self.ops)
+
+
+class Storage:
+    def __init__(self, path=DB_PATH, async_writes=DB_ASYNC_WRITES):
+        """Хранилище с ленивым открытием соединения и (опционально) фоновой записью."""
+        self.path = path
+        self.async_writes = async_writes
+        self.write_errors = 0
+        self._conn = None
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        self._tx_owner = None
+        self._local = threading.local()
+        self._queue = None
+        self._writer = None
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+
+    # ---------- Соединение ----------
+    def connect(self):
+        """Открытие соединения и настройка PRAGMA (один раз)."""
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+
+            conn = sqlite3.connect(
+                self.path,
+                isolation_level=None,  # Автокоммит, транзакции — явно через transaction()
+                check_same_thread=False,
+                cached_statements=DB_STATEMENT_CACHE,
+                timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            )
+            # Действует только для новой БД; существующая переводится в ensure_incremental_vacuum()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+            conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+            conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}")
+
+            self._conn = conn
+            return conn
+
+    def close(self):
+        """Дозапись очереди, остановка писателя и закрытие соединения (с checkpoint WAL)."""
+        self._stop_writer()
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute("PRAGMA optimize")
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+            self._conn.close()
+            self._conn = None
+
+    # ---------- Выполнение ----------
+    def execute(self, sql, params=()):
+        """Выполнение выражения. Вне transaction() — автокоммит."""
+        with self._lock:
+            return self.connect().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with self._lock:
+            return self.connect().executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        self._read_barrier()
+        with self._lock:
+            return self.connect().execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        self._read_barrier()
+        with self._lock:
+            return self.connect().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Атомарная транзакция; вложенные вызовы присоединяются к внешней. Перед началом
+        дожидается очереди писателя: записи, принятые раньше, применяются раньше транзакции.
+        """
+        self._read_barrier()
+        with self._lock:
+            conn = self.connect()
+            if self._tx_depth == 0:
+                conn.execute("BEGIN IMMEDIATE")
+                self._tx_owner = threading.get_ident()
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._tx_owner = None
+                    conn.execute("ROLLBACK")
+                raise
+            else:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._tx_owner = None
+                    conn.execute("COMMIT")
+
+    # ---------- Unit of work ----------
+    @property
+    def current_uow(self):
+        return getattr(self._local, "uow", None)
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Сбор изменений через write() и атомарный коммит при выходе.
+        При исключении ничего не применяется. Вложенные вызовы присоединяются к внешнему.
+        """
+        outer = self.current_uow
+        if outer is not None:
+            yield outer
+            return
+
+        uow = UnitOfWork()
+        self._local.uow = uow
+        try:
+            yield uow
+        finally:
+            self._local.uow = None
+
+        self.apply(uow)
+
+    @property
+    def in_transaction(self):
+        """Текущий поток владеет открытой transaction()."""
+        return self._tx_owner == threading.get_ident()
+
+    def apply(self, uow):
+        """
+        Применение накопленных изменений одной транзакцией. При фоновой записи
+        пачка ставится в очередь, а колбэки вызываются сразу (read-your-writes
+        для in-memory индексов). Внутри transaction() — сразу, в её составе.
+        """
+        if uow.ops:
+            if self.async_writes and not self.in_transaction:
+                self.submit(uow.ops)
+            else:
+                self._apply_ops(uow.ops)
+        for callback in uow.on_commit:
+            callback()
+
+    def write(self, sql, params=()):
+        """
+        Изменение: в активный unit of work, в открытую transaction() текущего потока,
+        в очередь писателя или сразу (автокоммит).
+        """
+        uow = self.current_uow
+        if uow is not None:
+            uow.add(sql, params)
+        elif self.async_writes and not self.in_transaction:
+            self.submit([(sql, params)])
+        else:
+            self.execute(sql, params)
+
+    def after_commit(self, callback):
+        """Вызов после применения (или постановки в очередь) активного unit of work, либо сразу."""
+        uow = self.current_uow
+        if uow is not None:
+            uow.on_commit.append(callback)
+        else:
+            callback()
+
+    # ---------- Фоновая запись ----------
+    def submit(self, ops):
+        """Постановка пачки изменений в очередь (ждёт только при переполнении очереди)."""
+        if not ops:
+            return
+        self._start_writer()
+        with self._pending_cond:
+            self._pending += 1
+        self._queue.put(list(ops))
+
+    def flush(self, timeout=None):
+        """Ожидание записи всех изменений из очереди. False — не успели за timeout."""
+        if self._writer is None or threading.current_thread() is self._writer:
+            return True
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: self._pending == 0, timeout)
+
+    @property
+    def pending_writes(self):
+        return self._pending
+
+    def _read_barrier(self):
+        """Чтение видит все принятые записи: ждём очередь (кроме писателя и владельца транзакции)."""
+        if not self._pending:
+            return
+        if self.in_transaction or threading.current_thread() is self._writer:
+            return
+        self.flush()
+
+    def _start_writer(self):
+        with self._pending_cond:
+            if self._writer is not None:
+                return
+            self._queue = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+            self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _stop_writer(self):
+        writer = self._writer
+        if writer is None:
+            return
+        self._queue.put(_STOP)
+        writer.join()
+        with self._pending_cond:
+            self._writer = None
+            self._queue = None
+
+    def _writer_loop(self):
+        stop = False
+        while not stop:
+            batch = self._queue.get()
+            if batch is _STOP:
+                break
+            batches = [batch]
+            ops_count = len(batch)
+
+            # Добираем из очереди всё доступное до DB_WRITE_BATCH_SIZE изменений
+            while ops_count < DB_WRITE_BATCH_SIZE:
+                try:
+                    batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is _STOP:
+                    stop = True
+                    break
+                batches.append(batch)
+                ops_count += len(batch)
+
+            self._write_batches(batches)
+            with self._pending_cond:
+                self._pending -= len(batches)
+                self._pending_cond.notify_all()
+
+    def _write_batches(self, batches):
+        try:
+            self._apply_ops([op for ops in batches for op in ops])
+        except Exception:
+            # Повтор по одной пачке: сбойная отбрасывается, остальные сохраняются
+            for ops in batches:
+                try:
+                    self._apply_ops(ops)
+                except Exception as e:
+                    self.write_errors += 1
+                    log.error(f"❌ Фоновая запись в БД: {e} (отброшено изменений: {len(ops)})")
+
+    def _apply_ops(self, ops):
+        with metrics.phase("db"), self.transaction():
+            for sql, params in ops:
+                self.execute(sql, params)
+
+    # ---------- Схема ----------
+    def init_schema(self):
+        """Создание таблиц, индексов и миграция существующей БД до SCHEMA_VERSION."""
+        with self.transaction():
+            # Таблица позиций
+            self.execute(POSITIONS_DDL.format(table="positions"))
+
+            # Таблица событий для TP/SL и противоположных сигналов
+            self.execute(TRADE_EVENTS_DDL.format(table="trade_events"))
+
+            version = self.fetchone("PRAGMA user_version")[0]
+            if version < 1:
+                self._migrate_add_position_columns()
+            if version < 2:
+                self._migrate_epoch_ms()
+
+            # Индексы под формы запросов (symbol, event_type, side, time)
+            self.execute("DROP INDEX IF EXISTS idx_trade_events_symbol_time")
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trade_events_sym_type_side_time
+            ON trade_events(symbol, event_type, side, event_time)
+            """)
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trade_events_sym_type_time
+            ON trade_events(symbol, event_type, event_time)
+            """)
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trade_events_time
+            ON trade_events(event_time)
+            """)
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_positions_status_symbol_side
+            ON positions(status, symbol, side)
+            """)
+
+            # Архив и дневные агрегаты для retention.py
+            self.execute(TRADE_EVENTS_ARCHIVE_DDL)
+            self.execute(TRADE_EVENTS_DAILY_DDL)
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_trade_events_archive_sym_time
+            ON trade_events_archive(symbol, event_time)
+            """)
+
+            # Исполнения, назначение ордеров и курсоры для fills.py
+            self.execute(FILLS_DDL)
+            self.execute(ORDER_TAGS_DDL)
+            self.execute(SYNC_CURSORS_DDL)
+
+            # Агрегаты для analytics.py; при первом создании — наполнение из истории.
+            # До v3 profit не заполнялся (DEFAULT 0.0): без fills позиции PnL неизвестен —
+            # NULL, такие позиции дополнит analytics.backfill_profit()
+            self.execute(POSITION_STATS_DDL)
+            if version < 3:
+                self.execute("""
+                UPDATE positions SET profit = NULL
+                WHERE status = 'closed' AND profit = 0
+                  AND NOT EXISTS (SELECT 1 FROM fills f WHERE f.position_id = positions.id)
+                """)
+                self.execute("DELETE FROM position_stats")
+                self.execute(POSITION_STATS_ACCUMULATE_SQL.format(where="1"))
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fills_coin_time
+            ON fills(coin, time)
+            """)
+            self.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fills_oid
+            ON fills(oid)
+            """)
+
+            self.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+        self.ensure_incremental_vacuum()
+
+    def ensure_incremental_vacuum(self):
+        """Перевод БД в auto_vacuum=INCREMENTAL (однократный VACUUM для старых БД)."""
+        with self._lock:
+            conn = self.connect()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+
+    def incremental_vacuum(self, pages):
+        """Возврат до pages свободных страниц файлу. Возвращает число свободных страниц после."""
+        with self._lock:
+            conn = self.connect()
+            if self._tx_depth:
+                return None
+            # executescript шагает выражение до конца: execute() освобождает лишь одну страницу
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def _migrate_add_position_columns(self):
+        """v1: добавление недостающих колонок positions (старые БД)."""
+        cols = self.fetchall("PRAGMA table_info(positions)")
+        col_names = [c[1] for c in cols]
+
+        new_columns = [
+            ("atr", "REAL"),
+            ("stop_loss", "REAL"),
+            ("stop_loss_percent", "REAL"),
+            ("original_quantity", "REAL"),
+            ("tp1_hit", "INTEGER DEFAULT 0"),
+            ("tp2_hit", "INTEGER DEFAULT 0"),
+            ("tp2_count", "INTEGER DEFAULT 0"),
+            ("last_known_size", "REAL DEFAULT 0"),
+            ("closed_at", "INTEGER"),
+            ("close_reason", "TEXT"),
+        ]
+
+        for col_name, col_type in new_columns:
+            if col_name not in col_names:
+                try:
+                    self.execute(f"ALTER TABLE positions ADD COLUMN {col_name} {col_type}")
+                except sqlite3.Error:
+                    pass
+
+    def _migrate_epoch_ms(self):
+        """v2: текстовые TIMESTAMP (UTC) → целые epoch миллисекунды с пересборкой таблиц."""
+        event_types = {c[1]: c[2] for c in self.fetchall("PRAGMA table_info(trade_events)")}
+        if event_types.get("event_time", "").upper() != "INTEGER":
+            self.execute(TRADE_EVENTS_DDL.format(table="trade_events_v2"))
+            self.execute(f"""
+            INSERT INTO trade_events_v2 (id, symbol, event_type, side, event_time, details)
+            SELECT id, symbol, event_type, side, {_text_to_ms("event_time")}, details
+            FROM trade_events
+            """)
+            self.execute("DROP TABLE trade_events")
+            self.execute("ALTER TABLE trade_events_v2 RENAME TO trade_events")
+
+        position_types = {c[1]: c[2] for c in self.fetchall("PRAGMA table_info(positions)")}
+        if position_types.get("opened_at", "").upper() != "INTEGER":
+            columns = [c for c in POSITION_COLUMNS if c in position_types]
+            select = ", ".join(
+                _text_to_ms(c) if c in ("opened_at", "closed_at") else c
+                for c in columns
+            )
+            self.execute(POSITIONS_DDL.format(table="positions_v2"))
+            self.execute(
+                f"INSERT INTO positions_v2 ({', '.join(columns)}) SELECT {select} FROM positions"
+            )
+            self.execute("DROP TABLE positions")
+            self.execute("ALTER TABLE positions_v2 RENAME TO positions")
+
+    # ---------- События ----------
+    def insert_trade_event(self, symbol, event_type, side, details="", event_time=None):
+        """Запись события; event_time — epoch мс (по умолчанию сейчас)."""
+        self.write(
+            "INSERT INTO trade_events (symbol, event_type, side, details, event_time) VALUES (?, ?, ?, ?, ?)",
+            (symbol, event_type, side, details, event_time if event_time is not None else now_ms()),
+        )
+
+    def delete_trade_events(self, symbol, event_type):
+        self.write(
+            "DELETE FROM trade_events WHERE symbol=? AND event_type=?",
+            (symbol, event_type),
+        )
+
+
+db = Storage()
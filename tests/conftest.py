@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Storage  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Схема бота во временной БД с фоновой записью (как DB_ASYNC_WRITES = True)."""
+    db = Storage(str(tmp_path / "test.db"), async_writes=True)
+    db.init_schema()
+    yield db
+    db.close()
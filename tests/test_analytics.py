@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import analytics
+from storage import Storage
+
+
+class PnlApi:
+    def __init__(self, pnl):
+        self.pnl = pnl
+        self.calls = 0
+
+    def get_realized_pnl(self, coin, start_ms, end_ms=None):
+        self.calls += 1
+        return self.pnl
+
+
+def _close(storage, symbol, profit):
+    with storage.unit_of_work():
+        storage.write(
+            "INSERT INTO positions (symbol, side, status, opened_at, closed_at, close_reason, profit) "
+            "VALUES (?, 'buy', 'closed', 1000, 2000, 'manual', ?)",
+            (symbol, profit),
+        )
+        pos_id = storage.fetchone("SELECT MAX(id) FROM positions")[0]
+        analytics.record_closed_position(pos_id, storage=storage)
+
+
+def test_unknown_profit_is_not_aggregated_until_backfilled(storage):
+    _close(storage, "BTCUSDT", None)
+    assert storage.fetchall("SELECT * FROM position_stats") == []
+
+    assert analytics.backfill_profit(PnlApi(None), storage) == 0
+    assert storage.fetchall("SELECT * FROM position_stats") == []
+
+    assert analytics.backfill_profit(PnlApi(-3.5), storage) == 1
+    assert storage.fetchall("SELECT trades, losses, total_pnl FROM position_stats") == [(1, 1, -3.5)]
+
+    # Повторный проход ничего не добавляет
+    assert analytics.backfill_profit(PnlApi(-3.5), storage) == 0
+    assert storage.fetchall("SELECT trades FROM position_stats") == [(1,)]
+
+
+def test_backfill_stops_on_api_error(storage):
+    for symbol in ("BTCUSDT", "ETHUSDT", "SOLUSDT"):
+        _close(storage, symbol, None)
+    api = PnlApi(None)
+    analytics.backfill_profit(api, storage)
+    assert api.calls == 1
+
+
+def test_legacy_closed_positions_migrate_with_unknown_profit(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE positions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT NOT NULL, side TEXT,
+            quantity REAL, entry_price REAL, position_value REAL, atr REAL, stop_loss REAL,
+            stop_loss_percent REAL, original_quantity REAL, tp1_hit INTEGER DEFAULT 0,
+            tp2_hit INTEGER DEFAULT 0, tp2_count INTEGER DEFAULT 0, last_known_size REAL DEFAULT 0,
+            status TEXT DEFAULT 'open', profit REAL DEFAULT 0.0,
+            opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, closed_at TIMESTAMP,
+            last_tp_hit_at TIMESTAMP, sl_triggered INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute(
+        "INSERT INTO positions (symbol, side, status, opened_at, closed_at) "
+        "VALUES ('ETHUSDT', 'sell', 'closed', '2026-01-01 10:00:00', '2026-01-01 12:00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+    db = Storage(path, async_writes=False)
+    try:
+        db.init_schema()
+        assert db.fetchall("SELECT profit FROM positions") == [(None,)]
+        assert db.fetchall("SELECT * FROM position_stats") == []
+    finally:
+        db.close()
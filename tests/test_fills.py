@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import fills
+
+
+def _order(oid, tpsl, symbol="BTCUSDT"):
+    return {"oid": oid, "symbol": symbol, "tpsl": tpsl}
+
+
+def test_tag_orders_writes_only_new_oids(storage, monkeypatch):
+    orders = [_order(1, "sl"), _order(2, "tp"), {"oid": 3, "symbol": "BTCUSDT", "tpsl": None}]
+    fills.tag_orders(orders, storage)
+    assert storage.fetchall("SELECT oid, kind FROM order_tags ORDER BY oid") == [(1, "sl"), (2, "tp")]
+
+    submitted = []
+    monkeypatch.setattr(storage, "submit", lambda ops: submitted.append(ops))
+    fills.tag_orders(orders, storage)
+    assert submitted == []
+
+    fills.tag_orders(orders + [_order(4, "tp")], storage)
+    assert [[params[0] for _, params in ops] for ops in submitted] == [[4]]
+
+
+class FillsApi:
+    """Заменитель hl_api.get_user_fills: fills с time >= start_ms, запоминает запросы."""
+
+    def __init__(self, raw_fills):
+        self.raw_fills = raw_fills
+        self.requests = []
+
+    def get_user_fills(self, start_ms, end_ms=None):
+        self.requests.append(start_ms)
+        return [f for f in self.raw_fills if f["time"] >= start_ms]
+
+
+def _fill(tid, oid, side, sz, start, time, closed_pnl=0.0, fee=0.0, coin="BTC"):
+    return {
+        "tid": tid, "oid": oid, "coin": coin, "side": side, "px": "100", "sz": str(sz),
+        "startPosition": str(start), "closedPnl": str(closed_pnl), "fee": str(fee), "time": time,
+    }
+
+
+def _open_long(storage, opened_at):
+    storage.execute(
+        "INSERT INTO positions (symbol, side, quantity, original_quantity, status, opened_at) "
+        "VALUES ('BTCUSDT', 'buy', 1.0, 1.0, 'open', ?)",
+        (opened_at,),
+    )
+    return storage.fetchone("SELECT MAX(id) FROM positions")[0]
+
+
+def _position(storage, pos_id):
+    return storage.fetchone(
+        "SELECT status, close_reason, tp1_hit, tp2_hit, tp2_count, last_known_size, profit "
+        "FROM positions WHERE id=?",
+        (pos_id,),
+    )
+
+
+def test_fills_attributed_by_oid_tp1_tp2_sl(storage):
+    t0 = fills.now_ms()
+    pos_id = _open_long(storage, t0 - 1000)
+    fills.tag_order("BTC", "entry", 9, storage=storage)
+    fills.tag_order("BTC", "tp", 10, storage=storage)
+    fills.tag_order("BTC", "tp", 11, storage=storage)
+    fills.tag_order("BTC", "sl", 12, storage=storage)
+
+    api = FillsApi([
+        _fill(1, 9, "B", 1.0, 0.0, t0, fee=0.1),
+        # TP1 исполнен двумя частями одного ордера — одно срабатывание
+        _fill(2, 10, "A", 0.2, 1.0, t0 + 10, closed_pnl=2.0, fee=0.1),
+        _fill(3, 10, "A", 0.1, 0.8, t0 + 20, closed_pnl=1.0, fee=0.1),
+    ])
+    applied = fills.ingest_fills(api, storage)
+    assert applied == {"BTC": {"entry", "tp"}}
+    status, reason, tp1, tp2, tp2_count, size, _ = _position(storage, pos_id)
+    assert (status, tp1, tp2, tp2_count) == ("open", 1, 0, 0)
+    assert size == pytest.approx(0.7)
+    assert fills.get_cursor(storage) == t0 + 20
+
+    api.raw_fills += [
+        _fill(4, 11, "A", 0.2, 0.7, t0 + 30, closed_pnl=2.0, fee=0.1),
+        _fill(5, 12, "A", 0.5, 0.5, t0 + 40, closed_pnl=-1.0, fee=0.1),
+    ]
+    applied = fills.ingest_fills(api, storage)
+    assert applied == {"BTC": {"tp", "sl"}}
+    # Запрос с курсора (с перекрытием), уже загруженные tid не применяются повторно
+    assert api.requests[-1] == t0 + 20 - fills.FILLS_CURSOR_OVERLAP_MS
+    assert fills.get_cursor(storage) == t0 + 40
+
+    status, reason, tp1, tp2, tp2_count, size, profit = _position(storage, pos_id)
+    assert (status, reason, tp1, tp2, tp2_count, size) == ("closed", "sl", 1, 1, 1, 0)
+    assert profit == pytest.approx(2.0 + 1.0 + 2.0 - 1.0 - 0.5)
+    assert storage.fetchone("SELECT COUNT(*) FROM fills")[0] == 5
+    assert storage.fetchall("SELECT close_reason, trades FROM position_stats") == [("sl", 1)]
+
+    assert fills.ingest_fills(api, storage) == {}
+    assert fills.get_cursor(storage) == t0 + 40
+
+
+def test_fill_of_untagged_order_closes_as_manual(storage):
+    t0 = fills.now_ms()
+    pos_id = _open_long(storage, t0 - 1000)
+    api = FillsApi([_fill(1, 77, "A", 1.0, 1.0, t0, closed_pnl=5.0)])
+    assert fills.ingest_fills(api, storage) == {"BTC": {"manual"}}
+    status, reason, *_ = _position(storage, pos_id)
+    assert (status, reason) == ("closed", "manual")
+
+
+def test_ingest_fills_api_error_keeps_cursor(storage):
+    class DownApi:
+        def get_user_fills(self, start_ms, end_ms=None):
+            return None
+
+    assert fills.ingest_fills(DownApi(), storage) is None
+    assert fills.get_cursor(storage) is None
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+
+def _symbols(storage):
+    return [row[0] for row in storage.fetchall("SELECT symbol FROM positions ORDER BY id")]
+
+
+def test_write_outside_transaction_is_visible_to_reads(storage):
+    storage.write("INSERT INTO positions (symbol, side) VALUES (?, ?)", ("BTCUSDT", "long"))
+    assert _symbols(storage) == ["BTCUSDT"]
+    assert storage.pending_writes == 0
+
+
+def test_unit_of_work_read_your_writes_from_other_thread(storage):
+    with storage.unit_of_work():
+        storage.write("INSERT INTO positions (symbol, side) VALUES (?, ?)", ("ETHUSDT", "short"))
+        storage.write("UPDATE positions SET quantity=? WHERE symbol=?", (2.0, "ETHUSDT"))
+
+    seen = []
+    reader = threading.Thread(
+        target=lambda: seen.extend(storage.fetchall("SELECT symbol, quantity FROM positions"))
+    )
+    reader.start()
+    reader.join()
+    assert seen == [("ETHUSDT", 2.0)]
+
+
+def test_unit_of_work_discarded_on_error(storage):
+    with pytest.raises(RuntimeError):
+        with storage.unit_of_work():
+            storage.write("INSERT INTO positions (symbol) VALUES (?)", ("BTCUSDT",))
+            raise RuntimeError
+    assert _symbols(storage) == []
+
+
+def test_write_inside_transaction_joins_it(storage):
+    with storage.transaction():
+        storage.write("INSERT INTO positions (symbol) VALUES (?)", ("BTCUSDT",))
+        with storage.unit_of_work():
+            storage.write("INSERT INTO positions (symbol) VALUES (?)", ("ETHUSDT",))
+        # Владелец транзакции видит свои записи, очередь писателя не используется
+        assert _symbols(storage) == ["BTCUSDT", "ETHUSDT"]
+        assert storage.pending_writes == 0
+    assert _symbols(storage) == ["BTCUSDT", "ETHUSDT"]
+
+
+def test_write_inside_transaction_rolled_back(storage):
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            storage.write("INSERT INTO positions (symbol) VALUES (?)", ("BTCUSDT",))
+            raise RuntimeError
+    assert _symbols(storage) == []
+
+
+def test_queued_writes_applied_before_transaction(storage):
+    storage.write("INSERT INTO positions (symbol) VALUES (?)", ("BTCUSDT",))
+    with storage.transaction():
+        storage.write("UPDATE positions SET quantity=? WHERE symbol=?", (1.5, "BTCUSDT"))
+    assert storage.fetchall("SELECT symbol, quantity FROM positions") == [("BTCUSDT", 1.5)]
+
+
+def test_after_commit_runs_once_unit_of_work_is_applied(storage):
+    calls = []
+    with storage.unit_of_work():
+        storage.write("INSERT INTO positions (symbol) VALUES (?)", ("BTCUSDT",))
+        storage.after_commit(lambda: calls.append("done"))
+        assert calls == []
+    assert calls == ["done"]
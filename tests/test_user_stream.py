@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from user_stream import SUBSCRIPTIONS, UserStream
+
+
+class FakeWs:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def _position(coin, szi, entry_px="100"):
+    return {"type": "oneWay", "position": {"coin": coin, "szi": str(szi), "entryPx": entry_px}}
+
+
+def _user_state(*positions):
+    return {"assetPositions": list(positions), "marginSummary": {"accountValue": "1000"}}
+
+
+def _limit_order(oid, coin="BTC", sz="1.0"):
+    return {"oid": oid, "coin": coin, "side": "B", "sz": sz, "limitPx": "100",
+            "orderType": "Limit", "tif": "Gtc", "isTrigger": False}
+
+
+def _tp_order(oid, coin="BTC", sz="0.3"):
+    return {"oid": oid, "coin": coin, "side": "A", "sz": sz, "limitPx": "110",
+            "orderType": "Take Profit Market", "isTrigger": True, "triggerPx": "110",
+            "reduceOnly": True}
+
+
+@pytest.fixture
+def stream():
+    stream = UserStream(url="ws://unused", address="0xabc", ping_seconds=3600)
+    ws = FakeWs()
+    stream._ws = ws
+    stream._on_open(ws)
+    yield stream
+    stream.stop()
+
+
+def _send(stream, channel, data):
+    stream._on_message(stream._ws, json.dumps({"channel": channel, "data": data}))
+
+
+def _snapshot(stream, user_state, orders):
+    _send(stream, "webData2", {"clearinghouseState": user_state, "openOrders": orders})
+
+
+def _oids(stream):
+    return sorted(o["oid"] for o in stream.get_state()[1])
+
+
+def test_subscribes_on_open(stream):
+    assert [m["subscription"]["type"] for m in stream._ws.sent] == list(SUBSCRIPTIONS)
+    assert all(m["subscription"]["user"] == "0xabc" for m in stream._ws.sent)
+    # До первого снимка книга не свежая
+    assert stream.get_state() is None
+
+
+def test_snapshot_replaces_book(stream):
+    _snapshot(stream, _user_state(_position("BTC", 1.0)), [_limit_order(1), _tp_order(2)])
+    user_state, orders = stream.get_state()
+    assert _oids(stream) == [1, 2]
+    tp = next(o for o in orders if o["oid"] == 2)
+    assert tp["orderType"] == {"trigger": {"triggerPx": "110", "isMarket": True, "tpsl": "tp"}}
+
+    _snapshot(stream, _user_state(_position("ETH", -2.0)), [_limit_order(3, coin="ETH")])
+    user_state, orders = stream.get_state()
+    assert _oids(stream) == [3]
+    assert [p["position"]["coin"] for p in user_state["assetPositions"]] == ["ETH"]
+
+
+def test_order_updates_for_known_oids(stream):
+    _snapshot(stream, _user_state(), [_limit_order(1), _limit_order(2)])
+    _send(stream, "orderUpdates", [
+        {"order": {"oid": 1, "sz": "0.4"}, "status": "open"},
+        {"order": {"oid": 2, "sz": "0"}, "status": "filled"},
+        # Терминальный статус неизвестного ордера — не пропуск
+        {"order": {"oid": 99, "sz": "0"}, "status": "canceled"},
+    ])
+    assert stream.is_fresh()
+    orders = stream.get_state()[1]
+    assert [(o["oid"], o["sz"]) for o in orders] == [(1, "0.4")]
+    assert stream.stats["gaps"] == 0
+
+
+def test_unknown_oid_marks_book_stale_until_snapshot(stream):
+    _snapshot(stream, _user_state(), [_limit_order(1)])
+    _send(stream, "orderUpdates", [{"order": {"oid": 5, "coin": "BTC", "sz": "1.0"}, "status": "open"}])
+    assert stream.stats["gaps"] == 1
+    assert not stream.is_fresh()
+    assert stream.get_state() is None
+
+    _snapshot(stream, _user_state(), [_limit_order(1), _tp_order(5)])
+    assert stream.is_fresh()
+    assert _oids(stream) == [1, 5]
+
+
+def test_fills_update_position_size(stream):
+    _snapshot(stream, _user_state(_position("BTC", 1.0)), [])
+    _send(stream, "userFills", {"isSnapshot": False, "fills": [
+        {"coin": "BTC", "side": "A", "sz": "0.3", "px": "105", "startPosition": "1.0"},
+    ]})
+    user_state = stream.get_state()[0]
+    assert float(user_state["assetPositions"][0]["position"]["szi"]) == pytest.approx(0.7)
+
+    # Fill по позиции, которой нет в книге, — пропуск до следующего снимка
+    _send(stream, "userFills", {"isSnapshot": False, "fills": [
+        {"coin": "ETH", "side": "B", "sz": "1.0", "px": "10", "startPosition": "0"},
+    ]})
+    assert stream.get_state() is None
+    assert stream.stats["gaps"] == 1
+
+
+def test_reset_counts_drift(stream):
+    _snapshot(stream, _user_state(_position("BTC", 1.0)), [_limit_order(1)])
+    stream.reset(_user_state(_position("BTC", 1.0)), [_limit_order(1)])
+    assert stream.stats["drift"] == 0
+    stream.reset(_user_state(_position("BTC", 0.5)), [_limit_order(1), _limit_order(2)])
+    assert stream.stats["drift"] == 1
+    assert _oids(stream) == [1, 2]
@@ -3,131 +3,46 @@
 Торговый бот для Hyperliquid с полным контролем SL/TP
 """
 
-import time
-import sqlite3
-from datetime import datetime, timedelta
-import traceback
+from datetime import datetime
 
 from config import *
-from utils import get_market_data, analyze_with_ai, calculate_atr
-from hyperliquid_api import hl_api
-
-
-# Фикс Python 3.12 sqlite3 datetime deprecation
-def register_datetime_adapter():
-    def adapt_datetime(dt):
-        return dt.isoformat()
-    sqlite3.register_adapter(datetime, adapt_datetime)
-
-register_datetime_adapter()
+from utils import (
+    get_market_data, analyze_with_ai, calculate_atr, prescreen_market_data, commit_prescreen_baseline,
+    AI_ERROR_DECISION,
+)
+from hyperliquid_api import hl_api, close_hl_api
+from storage import db, now_ms
+from event_index import event_index, log_trade_event
+from retention import maybe_run_retention
+from analytics import realized_pnl, record_closed_position
+from reconciliation import reconcile, calculate_stop_loss
+from fills import ingest_fills, tag_order, result_oid
+from bot_tasks import SharedState, PeriodicTask, TaskRunner, Prefetcher
+from scheduler import CandleCloseSchedule
+from screener import scan_universe
+from market_context import market_context
+from metrics import metrics, start_metrics_server
+from bot_logging import get_logger, log_context, setup_logging, stop_logging
+
+log = get_logger("trading_bot")
 
 
 # ---------- База данных ----------
 def init_db():
-    with sqlite3.connect("positions.db") as conn:
-        cur = conn.cursor()
-        
-        # Таблица позиций
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS positions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT NOT NULL,
-            side TEXT,
-            quantity REAL,
-            entry_price REAL,
-            position_value REAL,
-            atr REAL,
-            stop_loss REAL,
-            stop_loss_percent REAL,
-            original_quantity REAL,
-            tp1_hit INTEGER DEFAULT 0,
-            tp2_hit INTEGER DEFAULT 0,
-            tp2_count INTEGER DEFAULT 0,
-            last_known_size REAL DEFAULT 0,
-            status TEXT DEFAULT 'open',
-            profit REAL DEFAULT 0.0,
-            opened_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            closed_at TIMESTAMP,
-            close_reason TEXT
-        )
-        """)
-        
-        # Таблица событий для TP/SL и противоположных сигналов
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS trade_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT NOT NULL,
-            event_type TEXT NOT NULL,
-            side TEXT NOT NULL,
-            event_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            details TEXT
-        )
-        """)
-        
-        # Индекс для быстрых выборок
-        cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_trade_events_symbol_time
-        ON trade_events(symbol, event_time DESC)
-        """)
-        
-        # Проверка и добавление недостающих колонок
-        cur.execute("PRAGMA table_info(positions)")
-        cols = cur.fetchall()
-        col_names = [c[1] for c in cols]
-        
-        new_columns = [
-            ("atr", "REAL"),
-            ("stop_loss", "REAL"),
-            ("stop_loss_percent", "REAL"),
-            ("original_quantity", "REAL"),
-            ("tp1_hit", "INTEGER DEFAULT 0"),
-            ("tp2_hit", "INTEGER DEFAULT 0"),
-            ("tp2_count", "INTEGER DEFAULT 0"),
-            ("last_known_size", "REAL DEFAULT 0"),
-            ("closed_at", "TIMESTAMP"),
-            ("close_reason", "TEXT"),
-        ]
-        
-        for col_name, col_type in new_columns:
-            if col_name not in col_names:
-                try:
-                    cur.execute(f"ALTER TABLE positions ADD COLUMN {col_name} {col_type}")
-                except Exception:
-                    pass
-        
-        conn.commit()
-
-
-# ---------- Логирование событий ----------
-def log_trade_event(symbol, event_type, side, details=""):
-    """Логирование торговых событий (TP/SL/opposite_signal)"""
-    with sqlite3.connect("positions.db") as conn:
-        conn.execute(
-            "INSERT INTO trade_events (symbol, event_type, side, details) VALUES (?, ?, ?, ?)",
-            (symbol, event_type, side, details),
-        )
-        conn.commit()
+    db.init_schema()
+    loaded = event_index.load(db)
+    log.info(f"🗂️ Индекс событий: загружено {loaded}")
 
 
 # ---------- Проверка противоположных сигналов ----------
 def count_opposite_signals(symbol, desired_direction):
     """
-    Подсчёт противоположных сигналов за последние 30 минут.
+    Подсчёт противоположных сигналов за последние OPPOSITE_SIGNAL_WINDOW_MINUTES минут.
     Возвращает количество сигналов.
     """
-    cutoff_time = datetime.now() - timedelta(minutes=30)
-    
-    with sqlite3.connect("positions.db") as conn:
-        count = conn.execute(
-            """
-            SELECT COUNT(*) FROM trade_events
-            WHERE symbol = ? AND event_type = 'opposite_signal' AND side = ?
-            AND event_time > datetime(?)
-            """,
-            (symbol, desired_direction, cutoff_time.isoformat()),
-        ).fetchone()[0]
-    
-    return count
+    return event_index.count(
+        symbol, "opposite_signal", desired_direction, OPPOSITE_SIGNAL_WINDOW_MINUTES * 60
+    )
 
 
 # ---------- Cooldown логика ----------
@@ -136,25 +51,11 @@ def can_add_to_position(symbol):
     if not ENABLE_NO_ADD_AFTER_TP:
         return True, ""
     
-    cutoff_time = datetime.now() - timedelta(minutes=NO_ADD_AFTER_TP_MINUTES)
+    recent_tp = event_index.latest(symbol, "tp", window_seconds=NO_ADD_AFTER_TP_MINUTES * 60)
     
-    with sqlite3.connect("positions.db") as conn:
-        recent_tp = conn.execute(
-            """
-            SELECT event_time, side, details FROM trade_events
-            WHERE symbol = ? AND event_type = 'tp'
-            AND event_time > datetime(?)
-            ORDER BY event_time DESC LIMIT 1
-            """,
-            (symbol, cutoff_time.isoformat()),
-        ).fetchone()
-        
-        if recent_tp:
-            event_time = datetime.fromisoformat(recent_tp[0])
-            remaining_minutes = NO_ADD_AFTER_TP_MINUTES - int(
-                (datetime.now() - event_time).total_seconds() / 60
-            )
-            return False, f"⏰ Добор запрещён {remaining_minutes} мин после TP"
+    if recent_tp:
+        remaining_minutes = NO_ADD_AFTER_TP_MINUTES - int((now_ms() - recent_tp) / 60000)
+        return False, f"⏰ Добор запрещён {remaining_minutes} мин после TP"
     
     return True, ""
 
@@ -165,25 +66,11 @@ def can_open_position_direction(symbol, side):
         return True, ""
     
     direction = "long" if side == "buy" else "short"
-    cutoff_time = datetime.now() - timedelta(minutes=NO_REOPEN_AFTER_SL_MINUTES)
+    recent_sl = event_index.latest(symbol, "sl", direction, NO_REOPEN_AFTER_SL_MINUTES * 60)
     
-    with sqlite3.connect("positions.db") as conn:
-        recent_sl = conn.execute(
-            """
-            SELECT event_time, side, details FROM trade_events
-            WHERE symbol = ? AND event_type = 'sl' AND side = ?
-            AND event_time > datetime(?)
-            ORDER BY event_time DESC LIMIT 1
-            """,
-            (symbol, direction, cutoff_time.isoformat()),
-        ).fetchone()
-        
-        if recent_sl:
-            event_time = datetime.fromisoformat(recent_sl[0])
-            remaining_minutes = NO_REOPEN_AFTER_SL_MINUTES - int(
-                (datetime.now() - event_time).total_seconds() / 60
-            )
-            return False, f"⏰ {direction.upper()} запрещён {remaining_minutes} мин после SL"
+    if recent_sl:
+        remaining_minutes = NO_REOPEN_AFTER_SL_MINUTES - int((now_ms() - recent_sl) / 60000)
+        return False, f"⏰ {direction.upper()} запрещён {remaining_minutes} мин после SL"
     
     return True, ""
 
@@ -218,155 +105,6 @@ def has_opposite_position(symbol, side):
     return False, None, 0
 
 
-# ---------- Синхронизация с биржей ----------
-def sync_positions_with_exchange():
-    """✅ ИСПРАВЛЕНО: Синхронизация позиций с логированием SL"""
-    if TEST_MODE:
-        return
-    
-    ex_positions = hl_api.get_open_positions()
-    ex_orders = hl_api.get_open_orders()
-    
-    ex_pos_dict = {p["symbol"]: p for p in ex_positions}
-    open_syms = set(ex_pos_dict.keys())
-    
-    with sqlite3.connect("positions.db") as conn:
-        cur = conn.cursor()
-        
-        local_positions = cur.execute(
-            "SELECT id, symbol, side, quantity, last_known_size FROM positions WHERE status='open'"
-        ).fetchall()
-        
-        # Проверяем закрытые позиции и логируем SL/TP
-        for pos_id, sym_db, side, qty, last_size in local_positions:
-            hl_sym = sym_db.replace("USDT", "")
-            
-            if hl_sym not in ex_pos_dict:
-                direction = "long" if side == "buy" else "short"
-                
-                # Определяем причину закрытия
-                pos_data = cur.execute(
-                    "SELECT original_quantity, tp1_hit FROM positions WHERE id=?",
-                    (pos_id,),
-                ).fetchone()
-                
-                was_tp1_hit = pos_data[1] if pos_data else 0
-                
-                # Проверяем недавние TP события
-                recent_tp = conn.execute(
-                    """
-                    SELECT event_time FROM trade_events
-                    WHERE symbol = ? AND event_type = 'tp' AND side = ?
-                    ORDER BY event_time DESC LIMIT 1
-                    """,
-                    (sym_db, direction),
-                ).fetchone()
-                
-                sl_triggers = [o for o in ex_orders if o["symbol"] == hl_sym and o.get("tpsl") == "sl"]
-                
-                close_reason = None
-                
-                if recent_tp:
-                    tp_time = datetime.fromisoformat(recent_tp[0])
-                    if (datetime.now() - tp_time).total_seconds() < 300:  # 5 минут
-                        if sl_triggers:
-                            close_reason = "sl"
-                            log_trade_event(sym_db, "sl", direction, "Position closed by SL")
-                            print(f"🔴 {sym_db}: SL сработал для {direction}")
-                        else:
-                            close_reason = "tp"
-                            print(f"🟢 {sym_db}: Позиция закрыта по TP для {direction}")
-                    elif sl_triggers:
-                        close_reason = "sl"
-                        log_trade_event(sym_db, "sl", direction, "Position closed by SL")
-                        print(f"🔴 {sym_db}: SL сработал для {direction}")
-                    else:
-                        close_reason = "manual"
-                elif sl_triggers:
-                    close_reason = "sl"
-                    log_trade_event(sym_db, "sl", direction, "Position closed by SL")
-                    print(f"🔴 {sym_db}: SL сработал для {direction}")
-                elif was_tp1_hit:
-                    close_reason = "tp"
-                    print(f"🟢 {sym_db}: Позиция закрыта по TP для {direction}")
-                else:
-                    close_reason = "manual"
-                
-                # ✅ КРИТИЧНО: Если закрыта по SL - логируем событие
-                if close_reason == "sl":
-                    # Проверяем, не было ли уже логирования
-                    existing_sl = conn.execute(
-                        """
-                        SELECT id FROM trade_events
-                        WHERE symbol = ? AND event_type = 'sl' AND side = ?
-                        AND event_time > datetime('now', '-5 minutes')
-                        """,
-                        (sym_db, direction),
-                    ).fetchone()
-                    
-                    if not existing_sl:
-                        log_trade_event(sym_db, "sl", direction, f"Position closed by SL")
-                        print(f"📝 Логирование SL события для {sym_db} {direction}")
-                
-                cur.execute(
-                    "UPDATE positions SET status='closed', closed_at=datetime('now'), close_reason=? WHERE id=?",
-                    (close_reason, pos_id),
-                )
-        
-        # Добавляем/обновляем актуальные позиции
-        for hl_sym, p in ex_pos_dict.items():
-            sym_db = hl_sym + "USDT"
-            side_db = "buy" if p["side"] == "long" else "sell"
-            current_value = p["size"] * p["entry_price"]
-            
-            existing = cur.execute(
-                "SELECT id FROM positions WHERE symbol=? AND side=? AND status='open'",
-                (sym_db, side_db),
-            ).fetchone()
-            
-            if not existing:
-                cur.execute(
-                    """
-                    INSERT INTO positions (
-                        symbol, side, quantity, entry_price, position_value,
-                        atr, stop_loss, stop_loss_percent, original_quantity, last_known_size
-                    ) VALUES (?, ?, ?, ?, ?, 0, 0, 0, ?, ?)
-                    """,
-                    (
-                        sym_db,
-                        side_db,
-                        p["size"],
-                        p["entry_price"],
-                        current_value,
-                        p["size"],
-                        p["size"],
-                    ),
-                )
-            else:
-                cur.execute(
-                    """
-                    UPDATE positions
-                    SET position_value=?, quantity=?, entry_price=?, last_known_size=?
-                    WHERE id=?
-                    """,
-                    (
-                        current_value,
-                        p["size"],
-                        p["entry_price"],
-                        p["size"],
-                        existing[0],
-                    ),
-                )
-        
-        # Удаляем триггер-ордера по закрытым позициям
-        for o in ex_orders:
-            coin = o["symbol"]
-            if coin not in open_syms and o.get("is_trigger"):
-                hl_api.cancel_order(coin, o["oid"])
-        
-        conn.commit()
-
-
 # ---------- Расчёт размера позиции ----------
 def calculate_position_size(symbol, data_dict):
     """✅ ИСПРАВЛЕНО: Расчёт размера позиции с учётом доступного баланса"""
@@ -378,7 +116,7 @@ def calculate_position_size(symbol, data_dict):
         available = hl_api.get_available_balance()
     
     if balance <= 0 or available <= 0:
-        print(f"⚠️ Недостаточно средств: баланс ${balance:.2f}, доступно ${available:.2f}")
+        log.warning(f"⚠️ Недостаточно средств: баланс ${balance:.2f}, доступно ${available:.2f}")
         return 0, 0
     
     # Используем 1H для ATR
@@ -403,11 +141,20 @@ def calculate_position_size(symbol, data_dict):
         max_position_value = balance * (MAX_TOTAL_POSITION_PERCENT / 100)
         
         if existing_value >= max_position_value:
-            print(f"⚠️ {symbol}: Достигнут лимит позиции ({MAX_TOTAL_POSITION_PERCENT}%)")
+            log.warning(f"⚠️ {symbol}: Достигнут лимит позиции ({MAX_TOTAL_POSITION_PERCENT}%)")
             return 0, 0
     
     # ✅ КРИТИЧНО: Используем доступный баланс вместо полного
     position_value = min(available, balance) * (POSITION_SIZE_PERCENT / 100)
+    
+    # Ликвидность: позиция не больше MAX_POSITION_OI_PERCENT open interest
+    ctx = market_context.get(coin, max_age=MARKET_CONTEXT_MAX_AGE) if ENABLE_MARKET_CONTEXT else None
+    if ctx and ctx["open_interest"] and MAX_POSITION_OI_PERCENT > 0:
+        oi_limit = ctx["open_interest"] * MAX_POSITION_OI_PERCENT / 100
+        if position_value > oi_limit:
+            log.warning(f"⚠️ {symbol}: размер ограничен {MAX_POSITION_OI_PERCENT}% OI (${oi_limit:.2f})")
+            position_value = oi_limit
+    
     quantity = position_value / mid_price
     
     # Округление
@@ -419,15 +166,6 @@ def calculate_position_size(symbol, data_dict):
     return quantity, atr
 
 
-# ---------- Расчёт SL ----------
-def calculate_stop_loss(entry_price, side, atr):
-    """Расчёт цены Stop Loss"""
-    if side == "buy":
-        return entry_price - (atr * ATR_MULTIPLIER)
-    else:
-        return entry_price + (atr * ATR_MULTIPLIER)
-
-
 # ---------- Размещение ордера ----------
 def place_order(symbol, side, quantity, atr):
     """✅ ИСПРАВЛЕНО: Размещение ордера с автоматическим переворотом после 2 сигналов"""
@@ -442,53 +180,58 @@ def place_order(symbol, side, quantity, atr):
             opposite_direction = "LONG" if opposite_side == "long" else "SHORT"
             new_direction = "SHORT" if opposite_side == "long" else "LONG"
             
-            # Подсчитываем противоположные сигналы за последние 30 минут
+            # Подсчитываем противоположные сигналы за окно OPPOSITE_SIGNAL_WINDOW_MINUTES
             signal_count = count_opposite_signals(symbol, desired_direction)
             
             # Логируем текущий сигнал
             log_trade_event(symbol, "opposite_signal", desired_direction, f"Signal #{signal_count + 1}")
             
-            print(f"⚠️ {symbol}: Позиция {opposite_direction} открыта ({opposite_size:.4f})")
-            print(f"   🔄 Противоположный сигнал #{signal_count + 1}/2 для переворота в {new_direction}")
+            log.warning(f"⚠️ {symbol}: Позиция {opposite_direction} открыта ({opposite_size:.4f})")
+            log.info(f"   🔄 Противоположный сигнал #{signal_count + 1}/2 для переворота в {new_direction}")
             
             if signal_count + 1 < 2:
-                print(f"   ⏰ Ожидание ещё {2 - (signal_count + 1)} сигнала(ов) в течение 30 минут")
+                log.info(f"   ⏰ Ожидание ещё {2 - (signal_count + 1)} сигнала(ов) в течение {OPPOSITE_SIGNAL_WINDOW_MINUTES} минут")
                 return
             
             # ✅ ПЕРЕВОРОТ: 2 сигнала получены
-            print(f"   ✅ 2 сигнала получены! Закрываем {opposite_direction} и открываем {new_direction}")
+            log.info(f"   ✅ 2 сигнала получены! Закрываем {opposite_direction} и открываем {new_direction}")
             
             # Закрываем противоположную позицию
             close_side = "sell" if opposite_side == "long" else "buy"
             result = hl_api.place_order(coin, close_side, opposite_size, "Market")
             
             if result and result.get("status") == "ok":
-                print(f"✅ Позиция {opposite_direction} закрыта")
-                time.sleep(2)
+                log.info(f"✅ Позиция {opposite_direction} закрыта")
+                tag_order(coin, "flip", result_oid(result))
+                metrics.sleep(2, "flip_close")
                 
-                # Закрываем в БД
-                with sqlite3.connect("positions.db") as conn:
-                    conn.execute(
-                        "UPDATE positions SET status='closed', closed_at=datetime('now'), close_reason='flip' WHERE symbol=? AND status='open'",
-                        (symbol,)
-                    )
-                    conn.commit()
-                
-                # Удаляем старые сигналы переворота
-                with sqlite3.connect("positions.db") as conn:
-                    conn.execute(
-                        "DELETE FROM trade_events WHERE symbol=? AND event_type='opposite_signal'",
-                        (symbol,)
-                    )
-                    conn.commit()
+                # Закрытие по fills (причина flip); если fills ещё не видны —
+                # закрываем оставшиеся записи напрямую. Старые сигналы переворота удаляем
+                ingest_fills()
+                open_rows = db.fetchall(
+                    "SELECT id, opened_at FROM positions WHERE symbol=? AND status='open'",
+                    (symbol,),
+                )
+                with db.unit_of_work():
+                    closed_at = now_ms()
+                    for pos_id, opened_at in open_rows:
+                        # None → NULL: PnL дозапрашивается при сверке (analytics.backfill_profit)
+                        profit = realized_pnl(coin, opened_at, closed_at)
+                        db.write(
+                            "UPDATE positions SET status='closed', closed_at=?, close_reason='flip', profit=? WHERE id=?",
+                            (closed_at, profit, pos_id),
+                        )
+                        record_closed_position(pos_id)
+                    db.delete_trade_events(symbol, "opposite_signal")
+                    db.after_commit(lambda: event_index.remove(symbol, "opposite_signal"))
             else:
-                print(f"❌ Не удалось закрыть {opposite_direction}, переворот отменён")
+                log.error(f"❌ Не удалось закрыть {opposite_direction}, переворот отменён")
                 return
         
         # ✅ КРИТИЧНО: Проверка cooldown после SL
         can_open, msg = can_open_position_direction(symbol, side)
         if not can_open:
-            print(f"🚫 {symbol}: {msg}")
+            log.info(f"🚫 {symbol}: {msg}")
             return
         
         # Проверка возможности добора (только для той же стороны)
@@ -498,83 +241,78 @@ def place_order(symbol, side, quantity, atr):
         if existing:
             can_add, msg = can_add_to_position(symbol)
             if not can_add:
-                print(f"🚫 {symbol}: {msg}")
+                log.info(f"🚫 {symbol}: {msg}")
                 return
         
-        print(f"\n📤 {side.upper()} {quantity:.6f} {coin}")
+        log.info(f"\n📤 {side.upper()} {quantity:.6f} {coin}")
         
         if TEST_MODE:
-            print(f"✅ [TEST] Ордер симулирован")
+            log.info(f"✅ [TEST] Ордер симулирован")
             return
         
         # Размещение ордера
         result = hl_api.place_order(coin, side, quantity, "Market")
         
         if not result or result.get("status") != "ok":
-            print(f"❌ Ордер не исполнен")
+            log.error(f"❌ Ордер не исполнен")
             return
         
+        tag_order(coin, "entry", result_oid(result))
+        
         # Ждём появления позиции
-        time.sleep(2)
+        metrics.sleep(2, "entry_fill")
         
         positions = hl_api.get_open_positions()
         position = next((p for p in positions if p["symbol"] == coin), None)
         
         if not position:
-            print(f"❌ Позиция не найдена после ордера")
+            log.error(f"❌ Позиция не найдена после ордера")
             return
         
         entry_price = position["entry_price"]
         current_size = position["size"]
         
-        # Обновление БД
-        with sqlite3.connect("positions.db") as conn:
-            cur = conn.cursor()
-            
-            existing_db = cur.execute(
-                "SELECT id, original_quantity FROM positions WHERE symbol=? AND side=? AND status='open'",
-                (symbol, side),
-            ).fetchone()
-            
-            if existing_db:
-                # Добор к существующей
-                pos_id, orig_qty = existing_db
-                new_orig_qty = orig_qty + quantity
-                
-                cur.execute(
-                    """
-                    UPDATE positions
-                    SET quantity=?, entry_price=?, atr=?, original_quantity=?, last_known_size=?, position_value=?
-                    WHERE id=?
-                    """,
-                    (current_size, entry_price, atr, new_orig_qty, current_size, current_size * entry_price, pos_id),
+        # Обновление БД без чтения: добор к открытой записи или новая позиция
+        # (запись уходит в фоновый писатель, ордера не ждут диск)
+        with db.unit_of_work():
+            db.write(
+                """
+                UPDATE positions
+                SET quantity=?, entry_price=?, atr=?, original_quantity=original_quantity+?,
+                    last_known_size=?, position_value=?
+                WHERE symbol=? AND side=? AND status='open'
+                """,
+                (current_size, entry_price, atr, quantity, current_size, current_size * entry_price, symbol, side),
+            )
+            db.write(
+                """
+                INSERT INTO positions (
+                    symbol, side, quantity, entry_price, position_value, atr,
+                    original_quantity, last_known_size, opened_at
                 )
-                
-                print(f"📊 {symbol}: Добор к позиции, новый размер: {current_size:.4f}")
-            else:
-                # Новая позиция
-                cur.execute(
-                    """
-                    INSERT INTO positions (
-                        symbol, side, quantity, entry_price, position_value, atr,
-                        original_quantity, last_known_size
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (symbol, side, current_size, entry_price, current_size * entry_price, atr, current_size, current_size),
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM positions WHERE symbol=? AND side=? AND status='open'
                 )
-            
-            conn.commit()
+                """,
+                (symbol, side, current_size, entry_price, current_size * entry_price, atr,
+                 current_size, current_size, now_ms(), symbol, side),
+            )
+        
+        if existing:
+            log.info(f"📊 {symbol}: Добор к позиции, новый размер: {current_size:.4f}")
         
         # Установка SL с явным размером
         sl_price = calculate_stop_loss(entry_price, side, atr)
         result_sl = hl_api.set_sl_only(coin, sl_price, current_size)  # ✅ ДОБАВЛЕН current_size
         
         if result_sl and result_sl.get("status") == "ok":
-            print(f"✅ SL установлен по ATR @ ${sl_price:.2f}")
+            tag_order(coin, "sl", result_oid(result_sl))
+            log.info(f"✅ SL установлен по ATR @ ${sl_price:.2f}")
         else:
-            print(f"⚠️ SL не установлен")
+            log.warning(f"⚠️ SL не установлен")
         
-        time.sleep(0.3)
+        metrics.sleep(0.3, "sltp_place")
         
         # Установка TP1
         if side == "buy":
@@ -587,13 +325,13 @@ def place_order(symbol, side, quantity, atr):
         result_tp = hl_api.set_tp_only(coin, tp1_price, tp1_size)
         
         if result_tp and result_tp.get("status") == "ok":
-            print(f"✅ TP1 установлен @ ${tp1_price:.2f} ({TAKE_PROFIT_1_SIZE_PERCENT}%)")
+            tag_order(coin, "tp", result_oid(result_tp))
+            log.info(f"✅ TP1 установлен @ ${tp1_price:.2f} ({TAKE_PROFIT_1_SIZE_PERCENT}%)")
         else:
-            print(f"⚠️ TP1 не установлен")
+            log.warning(f"⚠️ TP1 не установлен")
     
     except Exception as e:
-        print(f"❌ Ошибка размещения ордера: {e}")
-        traceback.print_exc()
+        log.exception(f"❌ Ошибка размещения ордера: {e}")
 
 
 # ---------- Получение баланса ----------
@@ -613,282 +351,57 @@ def get_available_balance():
         return hl_api.get_available_balance()
 
 
-# ---------- Проверка критичных ордеров ----------
-def ensure_critical_orders():
-    """✅ НОВОЕ: Проверка и восстановление критичных SL/TP ордеров"""
-    if TEST_MODE:
-        return
-    
-    try:
-        ex_positions = hl_api.get_open_positions()
-        if not ex_positions:
-            return
-        
-        time.sleep(1.0)
-        ex_orders = hl_api.get_open_orders(force_refresh=True)
-        
-        with sqlite3.connect("positions.db") as conn:
-            cur = conn.cursor()
-            
-            for position in ex_positions:
-                sym = position["symbol"]
-                sym_db = sym + "USDT"
-                side = position["side"]
-                side_db = "buy" if side == "long" else "sell"
-                current_size = position["size"]
-                entry_price = position["entry_price"]
-                
-                # Проверяем наличие SL
-                coin_orders = [o for o in ex_orders if o["symbol"] == sym and o.get("reduce_only")]
-                sl_orders = [o for o in coin_orders if o.get("tpsl") == "sl"]
-                
-                if not sl_orders:
-                    print(f"⚠️ {sym}: Отсутствует SL! Восстанавливаем...")
-                    
-                    # Получаем данные из БД
-                    pos_data = cur.execute(
-                        "SELECT atr, tp1_hit FROM positions WHERE symbol=? AND side=? AND status='open'",
-                        (sym_db, side_db),
-                    ).fetchone()
-                    
-                    if pos_data:
-                        atr, tp1_hit = pos_data
-                        
-                        if tp1_hit:
-                            # После TP1 - SL на безубыток
-                            sl_price = entry_price
-                        else:
-                            # Начальный SL по ATR
-                            if atr and atr > 0:
-                                sl_price = calculate_stop_loss(entry_price, side_db, atr)
-                            else:
-                                # Если ATR нет - используем фиксированный процент
-                                if side_db == "buy":
-                                    sl_price = entry_price * 0.985  # -1.5%
-                                else:
-                                    sl_price = entry_price * 1.015  # +1.5%
-                        
-                        result = hl_api.set_sl_only(sym, sl_price, current_size)
-                        
-                        if result and result.get("status") == "ok":
-                            print(f"✅ {sym}: SL восстановлен @ ${sl_price:.2f}")
-                        else:
-                            print(f"❌ {sym}: Не удалось восстановить SL")
-                        
-                        time.sleep(1.0)
-    
-    except Exception as e:
-        print(f"❌ Ошибка проверки критичных ордеров: {e}")
-        traceback.print_exc()
-
-
-# ---------- Управление позициями ----------
-def check_positions():
-    """✅ ИСПРАВЛЕНО: Проверка с правильным определением TP при доборе"""
+# ---------- Сверка с биржей ----------
+def reconcile_positions():
+    """
+    Сверка позиций и SL/TP с биржей за один проход (снимок → план → пачки ордеров).
+    Возвращает снимок аккаунта для отображения или None.
+    """
     if TEST_MODE:
-        return
+        return None
     
     try:
-        ex_positions = hl_api.get_open_positions()
-        
-        if not ex_positions:
-            return
-        
-        time.sleep(2.0)
-        ex_orders = hl_api.get_open_orders(force_refresh=True)
-        
-        with sqlite3.connect("positions.db") as conn:
-            cur = conn.cursor()
-            updated_count = 0
-            
-            for position in ex_positions:
-                sym = position["symbol"]
-                sym_db = sym + "USDT"
-                side = position["side"]
-                direction = "long" if side == "long" else "short"
-                side_db = "buy" if side == "long" else "sell"
-                current_size = position["size"]
-                entry_price = position["entry_price"]
-                
-                pos_data = cur.execute(
-                    """
-                    SELECT id, original_quantity, tp1_hit, tp2_hit, tp2_count, atr, last_known_size, entry_price
-                    FROM positions
-                    WHERE symbol=? AND side=? AND status='open'
-                    """,
-                    (sym_db, side_db),
-                ).fetchone()
-                
-                if not pos_data:
-                    continue
-                
-                pos_id, orig_qty, tp1_hit, tp2_hit, tp2_count, atr, snapshot_size, db_entry_price = pos_data
-                
-                # Обновляем Entry Price из биржи
-                if abs(entry_price - db_entry_price) > 0.01:
-                    cur.execute(
-                        "UPDATE positions SET entry_price=? WHERE id=?",
-                        (entry_price, pos_id)
-                    )
-                    conn.commit()
-                
-                # ✅ КРИТИЧНО: При доборе обновляем original_quantity
-                if current_size > orig_qty * 1.05:  # Увеличение более чем на 5%
-                    print(f"📊 {sym}: Обнаружен добор, обновляем original_quantity: {orig_qty:.4f} → {current_size:.4f}")
-                    cur.execute(
-                        "UPDATE positions SET original_quantity=?, last_known_size=? WHERE id=?",
-                        (current_size, current_size, pos_id)
-                    )
-                    conn.commit()
-                    orig_qty = current_size
-                    snapshot_size = current_size
-                
-                coin_orders = [o for o in ex_orders if o["symbol"] == sym and o.get("reduce_only")]
-                sl_orders = [o for o in coin_orders if o.get("tpsl") == "sl"]
-                tp_orders = [o for o in coin_orders if o.get("tpsl") == "tp"]
-                
-                needs_sl_update = False
-                needs_tp_update = False
-                
-                # Проверка SL
-                if not sl_orders:
-                    needs_sl_update = True
-                else:
-                    if len(sl_orders) > 1:
-                        needs_sl_update = True
-                    else:
-                        sl_order = sl_orders[0]
-                        sl_size = sl_order["size"]
-                        
-                        if abs(sl_size - current_size) > current_size * 0.02:
-                            needs_sl_update = True
-                
-                # Проверка TP
-                if not tp_orders:
-                    needs_tp_update = True
-                else:
-                    if len(tp_orders) > 1:
-                        needs_tp_update = True
-                
-                # ✅ ИСПРАВЛЕНИЕ: Обнаружение срабатывания TP только при УМЕНЬШЕНИИ размера
-                if orig_qty > 0 and snapshot_size > 0:
-                    remaining_pct = (current_size / orig_qty) * 100
-                    
-                    # TP1 сработал: размер уменьшился И не было TP1 ранее
-                    if not tp1_hit and current_size < snapshot_size * 0.98:  # Уменьшение более чем на 2%
-                        if remaining_pct < 75:  # И осталось меньше 75%
-                            log_trade_event(sym_db, "tp", direction, f"TP1 triggered")
-                            cur.execute("UPDATE positions SET tp1_hit=1, last_known_size=? WHERE id=?", (current_size, pos_id))
-                            conn.commit()
-                            tp1_hit = 1
-                            needs_tp_update = True
-                            needs_sl_update = True
-                            print(f"✅ {sym}: TP1 сработал ({remaining_pct:.1f}% осталось)")
-                            snapshot_size = current_size
-                    
-                    # TP2 сработал: размер уменьшился после TP1
-                    elif tp1_hit and not tp2_hit and current_size < snapshot_size * 0.98:
-                        log_trade_event(sym_db, "tp", direction, f"TP2 triggered")
-                        cur.execute("UPDATE positions SET tp2_hit=1, tp2_count=tp2_count+1, last_known_size=? WHERE id=?", (current_size, pos_id))
-                        conn.commit()
-                        tp2_hit = 1
-                        tp2_count += 1
-                        needs_tp_update = True
-                        print(f"✅ {sym}: TP2 сработал ({remaining_pct:.1f}% осталось)")
-                        snapshot_size = current_size
-                    
-                    # TP2 (множественные): размер уменьшился после предыдущего TP2
-                    elif tp1_hit and tp2_hit and current_size < snapshot_size * 0.98:
-                        log_trade_event(sym_db, "tp", direction, f"TP2 triggered again")
-                        cur.execute("UPDATE positions SET tp2_count=tp2_count+1, last_known_size=? WHERE id=?", (current_size, pos_id))
-                        conn.commit()
-                        tp2_count += 1
-                        needs_tp_update = True
-                        print(f"✅ {sym}: TP2 #{tp2_count + 1} сработал ({remaining_pct:.1f}% осталось)")
-                        snapshot_size = current_size
-                
-                # Обновляем snapshot при значительном изменении (но не считаем это TP)
-                if abs(current_size - snapshot_size) > current_size * 0.05 and current_size >= snapshot_size:
-                    cur.execute("UPDATE positions SET last_known_size=? WHERE id=?", (current_size, pos_id))
-                    conn.commit()
-                
-                # Создание новых ордеров
-                if needs_sl_update:
-                    if tp1_hit:
-                        result = hl_api.set_sl_only(sym, entry_price, current_size)  # ✅ ДОБАВЛЕН current_size
-                        if result and result.get("status") == "ok":
-                            updated_count += 1
-                    else:
-                        if atr and atr > 0:
-                            sl_price = calculate_stop_loss(entry_price, side_db, atr)
-                            result = hl_api.set_sl_only(sym, sl_price, current_size)  # ✅ ДОБАВЛЕН current_size
-                            if result and result.get("status") == "ok":
-                                updated_count += 1
-                    
-                    time.sleep(1.0)
-                
-                if needs_tp_update:
-                    if not tp1_hit:
-                        # TP1: 30% от original_quantity
-                        tp1_price = entry_price * (1 + TAKE_PROFIT_1_PERCENT / 100) if direction == "long" else entry_price * (1 - TAKE_PROFIT_1_PERCENT / 100)
-                        tp1_size = orig_qty * (TAKE_PROFIT_1_SIZE_PERCENT / 100)
-                        
-                        result = hl_api.set_tp_only(sym, tp1_price, tp1_size)
-                        if result and result.get("status") == "ok":
-                            updated_count += 1
-                    
-                    else:
-                        # TP2: 20% от текущего размера, прогрессивная цена
-                        remaining_pct = (current_size / orig_qty) * 100
-                        
-                        if remaining_pct > 1.0:
-                            tp2_number = tp2_count + 1
-                            tp_offset = TAKE_PROFIT_1_PERCENT + (TAKE_PROFIT_2_PERCENT * tp2_number)
-                            
-                            tp2_price = entry_price * (1 + tp_offset / 100) if direction == "long" else entry_price * (1 - tp_offset / 100)
-                            tp2_size = current_size * (TAKE_PROFIT_2_SIZE_PERCENT / 100)
-                            
-                            if tp2_size >= 0.0001:
-                                result = hl_api.set_tp_only(sym, tp2_price, tp2_size)
-                                if result and result.get("status") == "ok":
-                                    updated_count += 1
-                    
-                    time.sleep(1.0)
-            
-            if updated_count > 0:
-                print(f"✅ Управление позициями: обновлено {updated_count}")
-    
+        with metrics.phase("sltp"):
+            return reconcile()
     except Exception as e:
-        print(f"❌ Ошибка управления позициями: {e}")
-        traceback.print_exc()
+        log.exception(f"❌ Ошибка сверки позиций: {e}")
+        return None
 
 
 # ---------- Отображение позиций ----------
-def display_positions_summary():
-    """Отображение сводки по открытым позициям"""
+def display_positions_summary(snapshot=None):
+    """Отображение сводки по открытым позициям (из снимка сверки, если передан)"""
     try:
         if TEST_MODE:
             now = datetime.now().strftime("%H:%M:%S %d.%m.%Y")
-            print("\n" + "=" * 60)
-            print(f"📊 ТЕСТОВЫЙ РЕЖИМ - позиции не отображаются на {now}")
-            print("=" * 60)
+            log.info("\n" + "=" * 60)
+            log.info(f"📊 ТЕСТОВЫЙ РЕЖИМ - позиции не отображаются на {now}")
+            log.info("=" * 60)
             return
         
-        ex_positions = hl_api.get_open_positions()
-        ex_orders = hl_api.get_open_orders()
+        if snapshot is None:
+            snapshot = hl_api.get_snapshot()
+            if snapshot is None:
+                return
+        
+        ex_positions = snapshot["positions"]
+        mids = snapshot["mids"]
+        orders_by_coin = {}
+        for o in snapshot["orders"]:
+            orders_by_coin.setdefault(o["symbol"], []).append(o)
         
         # Получаем текущую дату и время
         now = datetime.now().strftime("%H:%M:%S %d.%m.%Y")
         
         if not ex_positions:
-            print("\n" + "=" * 60)
-            print(f"📊 НЕТ ОТКРЫТЫХ ПОЗИЦИЙ на {now}")
-            print("=" * 60)
+            log.info("\n" + "=" * 60)
+            log.info(f"📊 НЕТ ОТКРЫТЫХ ПОЗИЦИЙ на {now}")
+            log.info("=" * 60)
             return
         
-        print("\n" + "=" * 60)
-        print(f"📊 ОТКРЫТЫЕ ПОЗИЦИИ на {now}")
-        print("=" * 60)
+        log.info("\n" + "=" * 60)
+        log.info(f"📊 ОТКРЫТЫЕ ПОЗИЦИИ на {now}")
+        log.info("=" * 60)
         
         for pos in ex_positions:
             sym = pos["symbol"]
@@ -898,7 +411,7 @@ def display_positions_summary():
             pnl = pos["unrealized_pnl"]
             leverage = pos["leverage"]
             
-            current_price = hl_api.get_mid_price(sym)
+            current_price = mids.get(sym)
             if not current_price:
                 continue
             
@@ -906,11 +419,11 @@ def display_positions_summary():
             pnl_pct = (pnl / (size * entry)) * 100 if entry > 0 else 0
             pnl_sign = "+" if pnl >= 0 else ""
             
-            print(f"\n{sym} {side}: {size:.4f} @ ${entry:.2f} | ${position_value:.2f} | P&L {pnl_sign}{pnl_pct:.2f}% (${pnl_sign}{pnl:.2f})")
-            print(f"  Текущая цена: ${current_price:.2f} | Плечо: {leverage:.0f}x")
+            log.info(f"\n{sym} {side}: {size:.4f} @ ${entry:.2f} | ${position_value:.2f} | P&L {pnl_sign}{pnl_pct:.2f}% (${pnl_sign}{pnl:.2f})")
+            log.info(f"  Текущая цена: ${current_price:.2f} | Плечо: {leverage:.0f}x")
             
             # Отображение ордеров
-            coin_orders = [o for o in ex_orders if o["symbol"] == sym]
+            coin_orders = orders_by_coin.get(sym, [])
             tp_orders = [o for o in coin_orders if o.get("tpsl") == "tp"]
             sl_orders = [o for o in coin_orders if o.get("tpsl") == "sl"]
             
@@ -919,121 +432,233 @@ def display_positions_summary():
                     tp_price = tp.get("trigger_price", tp.get("limit_price", 0))
                     tp_size = tp["size"]
                     tp_pct = (tp_size / size) * 100 if size > 0 else 0
-                    print(f"  └─ TP: ${tp_price:.2f} ({tp_pct:.0f}%, объём {tp_size:.4f})")
+                    log.info(f"  └─ TP: ${tp_price:.2f} ({tp_pct:.0f}%, объём {tp_size:.4f})")
             
             if sl_orders:
                 for sl in sl_orders:
                     sl_price = sl.get("trigger_price", sl.get("limit_price", 0))
                     sl_size = sl["size"]
                     sl_pct = (sl_size / size) * 100 if size > 0 else 0
-                    print(f"  └─ SL: ${sl_price:.2f} ({sl_pct:.0f}%, объём {sl_size:.4f})")
+                    log.info(f"  └─ SL: ${sl_price:.2f} ({sl_pct:.0f}%, объём {sl_size:.4f})")
             else:
-                print(f"  ⚠️ ВНИМАНИЕ: SL ОТСУТСТВУЕТ!")
+                log.warning(f"  ⚠️ ВНИМАНИЕ: SL ОТСУТСТВУЕТ!")
         
-        print("=" * 60)
+        log.info("=" * 60)
     
     except Exception as e:
-        print(f"❌ Ошибка отображения позиций: {e}")
-        traceback.print_exc()
+        log.exception(f"❌ Ошибка отображения позиций: {e}")
+
+
+# ---------- Задачи ----------
+# Расписания по закрытиям свечей (None — фиксированный интервал)
+decision_schedule = CandleCloseSchedule(DECISION_CANDLE_OFFSETS) if ALIGN_TO_CANDLE_CLOSE else None
+market_data_schedule = CandleCloseSchedule(MARKET_DATA_CANDLE_OFFSETS) if ALIGN_TO_CANDLE_CLOSE else None
+
+
+def select_symbols():
+    """Символы цикла: top K скрининга вселенной (SCAN_UNIVERSE) или SYMBOLS."""
+    if SCAN_UNIVERSE:
+        symbols = scan_universe(max_age=MARKET_DATA_INTERVAL)
+        if symbols:
+            return symbols
+        log.warning("⚠️ Скрининг не дал символов — используется SYMBOLS")
+    return SYMBOLS[:MAX_SYMBOLS]
+
+
+def fetch_market_data(state):
+    """Свечи по выбранным символам в общее состояние (с моментом начала загрузки)."""
+    fetched_at = now_ms()
+    with metrics.phase("fetch"):
+        # Рыночный контекст всей вселенной — один запрос на цикл (цены, funding, OI, скрининг)
+        if (ENABLE_MARKET_CONTEXT or SCAN_UNIVERSE) and not TEST_MODE:
+            market_context.refresh()
+        data = get_market_data(select_symbols())
+    
+    valid = {
+        s: d
+        for s, d in data.items()
+        if all(d.get(tf) for tf in ["1d", "1h", "1m"])
+    }
+    
+    if valid:
+        state.set_market_data(valid, fetched_at)
+    else:
+        log.warning("⚠️ Нет полных свечей ни по одному символу")
+    return valid or None
+
+
+def refresh_market_data(state):
+    """Задача market-data: свечи по SYMBOLS и ретеншн trade_events."""
+    fetch_market_data(state)
+    
+    # Перенос старых trade_events в архив (не чаще RETENTION_INTERVAL_SECONDS)
+    maybe_run_retention()
+
+
+def risk_cycle(state):
+    """Задача risk: сверка позиций и SL/TP, не дожидаясь AI."""
+    with state.trading_lock:
+        snapshot = reconcile_positions()
+    state.set_snapshot(snapshot)
+
+
+def likely_targets(symbols, scores=None, limit=PREFETCH_TARGETS):
+    """Монеты вероятной сделки: наибольшее изменение сигналов (без scores — по порядку)."""
+    if scores:
+        symbols = sorted(symbols, key=lambda s: scores.get(s, 0.0), reverse=True)
+    return [s.replace("USDT", "") for s in list(symbols)[:limit]]
+
+
+def decision_cycle(state):
+    """Задача decision: решение AI по последним свечам и открытие позиции."""
+    if not TEST_MODE:
+        # Баланс из снимка задачи risk (без запроса), если он свежий
+        snapshot = state.get_snapshot(max_age=RISK_LOOP_INTERVAL * 2)
+        if snapshot is not None:
+            bal, available = snapshot["balance"], snapshot["available"]
+        else:
+            bal = get_balance()
+            available = get_available_balance()
+        log.info(f"\n💰 Баланс: ${bal:.2f} | Доступно: ${available:.2f}")
+    
+    # По расписанию решение использует только свечи, загруженные после закрытия бара
+    since_ms = None
+    if decision_schedule is not None:
+        since_ms = decision_schedule.last_close_ms()
+        if decision_schedule.stats["fires"]:
+            jitter = decision_schedule.jitter_stats()
+            log.info(f"🕯️ Закрытие {decision_schedule.timeframe}: запуск {decision_schedule.stats['last_jitter_ms']:+.0f} мс "
+                  f"(p95 {jitter['p95_ms']:.0f} мс, пропущено {decision_schedule.stats['missed']})")
+    
+    valid = state.get_market_data(max_age=MARKET_DATA_MAX_AGE, since_ms=since_ms)
+    if not valid:
+        valid = fetch_market_data(state)
+    if not valid:
+        log.info("⏳ Нет свежих свечей — решение пропущено")
+        return
+    
+    # Пре-скрининг: AI вызывается только при изменении сигналов
+    call_ai, scores, reason, snapshots = True, None, "", None
+    if ENABLE_AI_PRESCREEN:
+        with metrics.phase("indicators"):
+            call_ai, scores, reason, snapshots = prescreen_market_data(valid)
+        log.info(f"\n🔎 Пре-скрининг: {reason}")
+    
+    if call_ai:
+        # Пока ждём AI, в фоне прогреваются баланс, цены, стакан и метаданные вероятной монеты
+        targets = likely_targets(valid, scores)
+        with Prefetcher(lambda: hl_api.prefetch(targets), PREFETCH_REFRESH_SECONDS,
+                        enabled=ENABLE_PREFETCH and not TEST_MODE), metrics.phase("ai"):
+            decision, reason = analyze_with_ai(valid)
+        # Базовые снимки — только после валидного ответа: при сбое изменение сигналов оценивается снова
+        if snapshots is not None and decision != AI_ERROR_DECISION:
+            commit_prescreen_baseline(snapshots)
+    else:
+        decision = "hold"
+    
+    log.info(f"\n🎯 {decision} | {reason}")
+    
+    # Обработка решения AI: ордера и сверка SL/TP новой позиции без участия задачи risk
+    if decision.startswith("buy_") or decision.startswith("sell_"):
+        act, sym = decision.split("_", 1)
+        
+        if sym in valid:
+            with state.trading_lock, log_context(symbol=sym):
+                with metrics.phase("order"):
+                    qty, atr = calculate_position_size(sym, valid)
+                    
+                    if qty > 0 and atr > 0:
+                        place_order(sym, act, qty, atr)
+                
+                if qty > 0 and atr > 0:
+                    state.set_snapshot(reconcile_positions())
+    
+    display_positions_summary(state.get_snapshot())
+
+
+def print_metrics_summary(state):
+    """Задача metrics: сводная строка фаз цикла и запросов API."""
+    if metrics.counter("api_requests_total") or metrics.histogram("cycle_phase_seconds").count:
+        log.info(f"\n{metrics.summary()}")
 
 
-# ---------- main ----------
 def main():
+    setup_logging()
     init_db()
     
-    print("=" * 60)
-    print("🤖 ТОРГОВЫЙ БОТ Hyperliquid")
-    print("=" * 60)
+    log.info("=" * 60)
+    log.info("🤖 ТОРГОВЫЙ БОТ Hyperliquid")
+    log.info("=" * 60)
     
     if TEST_MODE:
-        print("⚠️ ТЕСТОВЫЙ РЕЖИМ")
-        print(f"💰 Баланс: ${TEST_BALANCE:.2f} | Доступно: ${TEST_BALANCE:.2f}")
+        log.warning("⚠️ ТЕСТОВЫЙ РЕЖИМ")
+        log.info(f"💰 Баланс: ${TEST_BALANCE:.2f} | Доступно: ${TEST_BALANCE:.2f}")
     else:
-        print("🔴 РЕАЛЬНЫЙ РЕЖИМ")
+        log.info("🔴 РЕАЛЬНЫЙ РЕЖИМ")
         bal = get_balance()
         available = get_available_balance()
-        print(f"💰 Баланс: ${bal:.2f} | Доступно: ${available:.2f}")
+        log.info(f"💰 Баланс: ${bal:.2f} | Доступно: ${available:.2f}")
         
         if bal <= 0:
-            print("❌ Недостаточно средств")
+            log.error("❌ Недостаточно средств")
             return
         
-        sync_positions_with_exchange()
+        reconcile_positions()
     
-    print("=" * 60)
-    print(f"📊 TP1: +{TAKE_PROFIT_1_PERCENT}% ({TAKE_PROFIT_1_SIZE_PERCENT}% позиции)")
-    print(f"📊 TP2: +{TAKE_PROFIT_2_PERCENT}% ({TAKE_PROFIT_2_SIZE_PERCENT}% остатка)")
-    print(f"📊 После TP1: SL → безубыток (Entry Price)")
-    print(f"📊 После TP2: новый TP2 на остаток (прогрессия +{TAKE_PROFIT_2_PERCENT}%)")
-    print(f"📊 Начальный SL: ATR×{ATR_MULTIPLIER}")
+    log.info("=" * 60)
+    log.info(f"📊 TP1: +{TAKE_PROFIT_1_PERCENT}% ({TAKE_PROFIT_1_SIZE_PERCENT}% позиции)")
+    log.info(f"📊 TP2: +{TAKE_PROFIT_2_PERCENT}% ({TAKE_PROFIT_2_SIZE_PERCENT}% остатка)")
+    log.info(f"📊 После TP1: SL → безубыток (Entry Price)")
+    log.info(f"📊 После TP2: новый TP2 на остаток (прогрессия +{TAKE_PROFIT_2_PERCENT}%)")
+    log.info(f"📊 Начальный SL: ATR×{ATR_MULTIPLIER}")
     
     if ENABLE_NO_ADD_AFTER_TP:
-        print(f"🚫 Запрет добора после TP: {NO_ADD_AFTER_TP_MINUTES} мин")
+        log.info(f"🚫 Запрет добора после TP: {NO_ADD_AFTER_TP_MINUTES} мин")
     
     if ENABLE_NO_REOPEN_AFTER_SL:
-        print(f"🚫 Запрет переоткрытия после SL: {NO_REOPEN_AFTER_SL_MINUTES} мин")
+        log.info(f"🚫 Запрет переоткрытия после SL: {NO_REOPEN_AFTER_SL_MINUTES} мин")
     
-    print(f"🔄 Автопереворот: после 2 сигналов в течение 30 мин")
-    print(f"🛡️ Автовосстановление SL: включено")
+    log.info(f"🔄 Автопереворот: после 2 сигналов в течение {OPPOSITE_SIGNAL_WINDOW_MINUTES} мин")
+    log.info(f"🛡️ Автовосстановление SL: включено")
     
-    print("=" * 60)
+    if ALIGN_TO_CANDLE_CLOSE:
+        log.info(f"⏱️ Сверка SL/TP: каждые {RISK_LOOP_INTERVAL} с | свечи: {MARKET_DATA_CANDLE_OFFSETS} | "
+              f"AI: {DECISION_CANDLE_OFFSETS} (с после закрытия)")
+    else:
+        log.info(f"⏱️ Сверка SL/TP: каждые {RISK_LOOP_INTERVAL} с | свечи: {MARKET_DATA_INTERVAL} с | AI: {INTERVAL} с")
     
-    while True:
+    log.info("=" * 60)
+    
+    if ENABLE_METRICS and METRICS_PORT:
         try:
-            # ✅ Проверка баланса в каждом цикле
-            if not TEST_MODE:
-                bal = get_balance()
-                available = get_available_balance()
-                print(f"\n💰 Баланс: ${bal:.2f} | Доступно: ${available:.2f}")
-            
-            symbols = SYMBOLS[:MAX_SYMBOLS]
-            data = get_market_data(symbols)
-            
-            valid = {
-                s: d
-                for s, d in data.items()
-                if all(d.get(tf) for tf in ["1d", "1h", "1m"])
-            }
-            
-            if not valid:
-                time.sleep(INTERVAL)
-                continue
-            
-            decision, reason = analyze_with_ai(valid)
-            
-            print(f"\n🎯 {decision} | {reason}")
-            
-            # Обработка решения AI
-            if decision.startswith("buy_") or decision.startswith("sell_"):
-                act, sym = decision.split("_", 1)
-                
-                if sym in valid:
-                    qty, atr = calculate_position_size(sym, valid)
-                    
-                    if qty > 0 and atr > 0:
-                        place_order(sym, act, qty, atr)
-            
-            # ✅ КРИТИЧНО: Проверяем критичные ордера ПЕРЕД основной проверкой
-            ensure_critical_orders()
-            
-            # ВСЕГДА проверяем позиции
-            check_positions()
-            
-            display_positions_summary()
-            
-            time.sleep(INTERVAL)
-        
-        except KeyboardInterrupt:
-            print("\n" + "=" * 60)
-            print("⏹️ ОСТАНОВКА БОТА")
-            print("=" * 60)
-            display_positions_summary()
-            break
-        
-        except Exception as e:
-            print(f"❌ Ошибка: {e}")
-            traceback.print_exc()
-            time.sleep(INTERVAL)
+            start_metrics_server(METRICS_HOST, METRICS_PORT)
+            log.info(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            log.warning(f"⚠️ Сервер метрик не запущен: {e}")
+    
+    state = SharedState()
+    runner = TaskRunner(
+        [
+            PeriodicTask("market-data", MARKET_DATA_INTERVAL, refresh_market_data, market_data_schedule),
+            PeriodicTask("decision", INTERVAL, decision_cycle, decision_schedule),
+            PeriodicTask("risk", RISK_LOOP_INTERVAL, risk_cycle),
+        ] + ([PeriodicTask("metrics", METRICS_SUMMARY_INTERVAL, print_metrics_summary)] if ENABLE_METRICS else []),
+        state,
+        concurrent=CONCURRENT_TASKS,
+        shutdown_timeout=TASK_SHUTDOWN_TIMEOUT,
+    )
+    
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        log.info("\n" + "=" * 60)
+        log.info("⏹️ ОСТАНОВКА БОТА")
+        log.info("=" * 60)
+    finally:
+        display_positions_summary()
+        db.close()
+        close_hl_api()
+        stop_logging()
 
 
 if __name__ == "__main__":
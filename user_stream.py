@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Push-состояние аккаунта из WebSocket Hyperliquid: подписки orderUpdates, userFills
+и webData2 поддерживают в памяти книгу наших ордеров и позиций. Включается
+USER_STREAM_ENABLED; websocket-client импортируется лениво.
+"""
+
+import json
+import time
+import threading
+
+from config import (
+    HYPERLIQUID_ACCOUNT_ADDRESS,
+    USER_STREAM_URL,
+    USER_STREAM_STALE_SECONDS,
+    USER_STREAM_PING_SECONDS,
+)
+from bot_logging import get_logger
+
+log = get_logger("user_stream")
+
+SUBSCRIPTIONS = ("webData2", "orderUpdates", "userFills")
+
+# Статусы orderUpdates, после которых ордер уходит из книги
+TERMINAL_STATUSES = {
+    "filled", "canceled", "triggered", "rejected", "marginCanceled",
+    "reduceOnlyCanceled", "siblingFilledCanceled", "delistedCanceled",
+    "liquidatedCanceled", "scheduledCancel", "selfTradeCanceled",
+}
+
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+def _normalize_order(order):
+    """
+    Ордер из webData2 (frontend-формат: orderType строкой, isTrigger, triggerPx)
+    → формат Info.open_orders с orderType-словарём, который разбирает HyperliquidAPI.
+    """
+    order_type = order.get("orderType")
+    if isinstance(order_type, dict) or order_type is None:
+        return order
+
+    normalized = dict(order)
+    if order.get("isTrigger"):
+        normalized["orderType"] = {"trigger": {
+            "triggerPx": order.get("triggerPx"),
+            "isMarket": "Market" in order_type,
+            "tpsl": "tp" if order_type.startswith("Take Profit") else "sl",
+        }}
+    else:
+        normalized["orderType"] = {"limit": {"tif": order.get("tif") or "Gtc"}}
+    return normalized
+
+
+class UserStream:
+    def __init__(self, url=USER_STREAM_URL, address=HYPERLIQUID_ACCOUNT_ADDRESS,
+                 stale_seconds=USER_STREAM_STALE_SECONDS, ping_seconds=USER_STREAM_PING_SECONDS):
+        """
+        Книга ордеров (oid → ордер в формате Info.open_orders) и user_state аккаунта.
+        Книга «свежая», если соединение живо, получен снимок webData2 и нет пропусков
+        (новый oid без полного описания, fill по неизвестной позиции).
+        """
+        self.url = url
+        self.address = address
+        self.stale_seconds = stale_seconds
+        self.ping_seconds = ping_seconds
+
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._user_state = None
+        self._synced = False
+        self._connected = False
+        self._last_message = 0.0
+
+        self._ws = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {
+            "messages": 0, "snapshots": 0, "order_updates": 0, "fills": 0,
+            "reads": 0, "reconnects": 0, "resets": 0, "drift": 0, "gaps": 0,
+        }
+
+    # ---------- Жизненный цикл ----------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="user-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self._connected = False
+
+    def wait_ready(self, timeout=10.0):
+        """Ожидание первого снимка (True, если книга готова)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.is_fresh():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _run(self):
+        import websocket
+
+        attempt = 0
+        while not self._stop.is_set():
+            self._ws = websocket.WebSocketApp(
+                self.url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+            )
+            self._ws.run_forever()
+            self._connected = False
+            with self._lock:
+                self._synced = False
+            if self._stop.is_set():
+                break
+
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            self.stats["reconnects"] += 1
+            log.info(f"🔌 User stream: переподключение через {delay} с")
+            self._stop.wait(delay)
+
+    def _on_open(self, ws):
+        self._connected = True
+        self._last_message = time.monotonic()
+        for channel in SUBSCRIPTIONS:
+            ws.send(json.dumps({"method": "subscribe", "subscription": {"type": channel, "user": self.address}}))
+        threading.Thread(target=self._ping_loop, args=(ws,), name="user-stream-ping", daemon=True).start()
+
+    def _ping_loop(self, ws):
+        """Прикладной ping Hyperliquid ({"method": "ping"} → канал pong) держит соединение."""
+        while not self._stop.wait(self.ping_seconds):
+            if ws is not self._ws or not self._connected:
+                return
+            try:
+                ws.send(json.dumps({"method": "ping"}))
+            except Exception:
+                return
+
+    def _on_error(self, ws, error):
+        if not self._stop.is_set():
+            log.warning(f"⚠️ User stream: {error}")
+
+    def _on_close(self, ws, status_code=None, message=None):
+        self._connected = False
+
+    # ---------- Сообщения ----------
+    def _on_message(self, ws, message):
+        self._last_message = time.monotonic()
+        self.stats["messages"] += 1
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            return
+
+        channel = msg.get("channel")
+        data = msg.get("data")
+        if channel == "webData2":
+            self._apply_snapshot(data.get("clearinghouseState"), data.get("openOrders") or [])
+        elif channel == "orderUpdates":
+            self._apply_order_updates(data or [])
+        elif channel == "userFills":
+            if not data.get("isSnapshot"):
+                self._apply_fills(data.get("fills") or [])
+
+    def _apply_snapshot(self, user_state, open_orders):
+        with self._lock:
+            self._user_state = user_state
+            self._orders = {o["oid"]: _normalize_order(o) for o in open_orders}
+            self._synced = True
+        self.stats["snapshots"] += 1
+
+    def _apply_order_updates(self, updates):
+        with self._lock:
+            for update in updates:
+                order = update.get("order", {})
+                oid = order.get("oid")
+                status = update.get("status")
+                if status in TERMINAL_STATUSES:
+                    self._orders.pop(oid, None)
+                elif oid in self._orders:
+                    # Частичное исполнение: остаток ордера
+                    self._orders[oid] = dict(self._orders[oid], sz=order.get("sz", self._orders[oid].get("sz")))
+                else:
+                    # В orderUpdates нет типа ордера (tpsl, trigger): ждём снимка
+                    self._synced = False
+                    self.stats["gaps"] += 1
+        self.stats["order_updates"] += len(updates)
+
+    def _apply_fills(self, fills):
+        with self._lock:
+            for fill in fills:
+                if not self._apply_fill(fill):
+                    self._synced = False
+                    self.stats["gaps"] += 1
+        self.stats["fills"] += len(fills)
+
+    def _apply_fill(self, fill):
+        """Изменение размера позиции по fill. False — позицию не вывести (новая/переворот)."""
+        if not self._user_state:
+            return False
+        coin = fill.get("coin")
+        sz = float(fill.get("sz", 0))
+        start = float(fill.get("startPosition", 0))
+        end = start + (sz if fill.get("side") == "B" else -sz)
+
+        # Копия на запись: ранее выданные get_state() данные не меняются
+        asset_positions = list(self._user_state.get("assetPositions", []))
+        index = next(
+            (i for i, p in enumerate(asset_positions) if p.get("position", {}).get("coin") == coin), None
+        )
+        if index is None or start == 0 or (end != 0 and (end > 0) != (start > 0)):
+            return False
+
+        position = dict(asset_positions[index]["position"])
+        if abs(end) < 1e-12:
+            del asset_positions[index]
+        else:
+            if abs(end) > abs(start):
+                px = float(fill.get("px", 0))
+                entry_px = float(position.get("entryPx", 0))
+                position["entryPx"] = str((abs(start) * entry_px + sz * px) / abs(end))
+            position["szi"] = str(end)
+            asset_positions[index] = dict(asset_positions[index], position=position)
+        self._user_state = dict(self._user_state, assetPositions=asset_positions)
+        return True
+
+    # ---------- Чтение ----------
+    def is_fresh(self):
+        return (
+            self._connected
+            and self._synced
+            and time.monotonic() - self._last_message < self.stale_seconds
+        )
+
+    def get_state(self):
+        """(user_state, open_orders) из книги или None, если книга не свежая."""
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            if not self._synced or self._user_state is None:
+                return None
+            user_state = self._user_state
+            orders = list(self._orders.values())
+        self.stats["reads"] += 1
+        return user_state, orders
+
+    def reset(self, user_state, open_orders, check=True):
+        """
+        Сверка с REST: книга заменяется ответом REST. При check расхождение (набор oid
+        или размеры позиций) учитывается в stats["drift"]; после собственных действий
+        с ордерами расхождение ожидаемо (check=False).
+        """
+        with self._lock:
+            if check and self._synced and self._user_state is not None:
+                if set(self._orders) != {o["oid"] for o in open_orders} or (
+                    _position_sizes(self._user_state) != _position_sizes(user_state)
+                ):
+                    self.stats["drift"] += 1
+            self._user_state = user_state
+            self._orders = {o["oid"]: _normalize_order(o) for o in open_orders}
+            self._synced = self._connected
+        self.stats["resets"] += 1
+
+
+def _position_sizes(user_state):
+    return {
+        p["position"]["coin"]: round(float(p["position"].get("szi", 0)), 8)
+        for p in (user_state or {}).get("assetPositions", [])
+        if p.get("position")
+    }
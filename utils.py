@@ -1,7 +1,14 @@
 import os
+import re
+import json
 import time
+import threading
 import requests
 import numpy as np
+from collections import deque
+from concurrent.futures import (
+    ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeout
+)
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,14 +16,29 @@ load_dotenv()
 from config import (
     PERPLEXITY_API_KEY, PERPLEXITY_MODEL, PERPLEXITY_BASE_URL,
     OPENROUTER_API_KEY, OPENROUTER_MODEL, OPENROUTER_BASE_URL,
-    OPENROUTER_ENABLE_CACHE_CONTROL, ENABLE_TWO_LEVEL_VERIFICATION,
+    OPENROUTER_ENABLE_CACHE_CONTROL, OPENROUTER_STREAM, AI_RECORD_RESPONSES_FILE,
+    ENABLE_TWO_LEVEL_VERIFICATION,
     OPENROUTER_MODEL_LEVEL1, OPENROUTER_MODEL_LEVEL2,
     USE_PERPLEXITY, USE_OPENROUTER, SIGNAL_STRATEGY,
     SYMBOLS, LIMIT_1D, LIMIT_1H, LIMIT_1M, USE_HYPERLIQUID,
     AI_SYSTEM_PROMPT, AI_USER_DATA_TEMPLATE,
+    AI_ANALYSIS_MODE, AI_PARALLEL_MAX_WORKERS, AI_PER_SYMBOL_MIN_SCORE,
+    AI_PER_SYMBOL_SYSTEM_PROMPT, AI_REQUEST_TIMEOUT,
+    ENABLE_AI_HEDGING, AI_HEDGE_BACKUP_MODEL, AI_HEDGE_BACKUP_BASE_URL,
+    AI_HEDGE_BACKUP_API_KEY_ENV, AI_HEDGE_PERCENTILE, AI_HEDGE_MIN_SAMPLES,
+    AI_HEDGE_DEFAULT_DELAY, AI_LATENCY_WINDOW,
+    AI_PROMPT_TOKEN_BUDGET, AI_PROMPT_DROP_ORDER, OPENROUTER_INCLUDE_USAGE,
     RSI_OVERBOUGHT, RSI_OVERSOLD, STOCH_OVERBOUGHT, STOCH_OVERSOLD,
-    WILLR_OVERBOUGHT, WILLR_OVERSOLD
+    WILLR_OVERBOUGHT, WILLR_OVERSOLD,
+    PRESCREEN_SCORE_THRESHOLD, PRESCREEN_MAX_STALENESS,
+    PRESCREEN_WEIGHTS, PRESCREEN_TIMEFRAME_WEIGHTS,
+    ENABLE_MARKET_CONTEXT, MARKET_CONTEXT_MAX_AGE,
 )
+from market_context import market_context
+from metrics import metrics
+from bot_logging import get_logger
+
+log = get_logger("utils")
 
 # ========== Получение данных ==========
 def get_market_data(symbols: list):
@@ -273,6 +295,26 @@ def calculate_indicators(candles):
     
     return indicators
 
+_indicators_cache = {}
+_INDICATORS_CACHE_MAX = 64
+
+def get_cached_indicators(candles):
+    """Индикаторы с кешем по последней свече (пре-скрининг и промпт считают одно и то же)."""
+    if not candles:
+        return {}
+    
+    key = (len(candles), candles[0]["t"], candles[-1]["t"], candles[-1]["c"], candles[-1]["v"])
+    cached = _indicators_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    if len(_indicators_cache) >= _INDICATORS_CACHE_MAX:
+        _indicators_cache.clear()
+    
+    indicators = calculate_indicators(candles)
+    _indicators_cache[key] = indicators
+    return indicators
+
 def calculate_atr(candles, period: int = 14):
     """Average True Range."""
     if not candles or len(candles) < period + 1:
@@ -293,17 +335,43 @@ def calculate_atr(candles, period: int = 14):
     return float(atr)
 
 # ========== Сжатие данных для AI ==========
-def compress_market_data(data_dict_outer):
-    """Компрессия рыночных данных с индикаторами."""
-    compressed = []
+def render_context_block(symbol):
+    """Строка funding / premium / OI / 24h объёма из рыночного контекста или None."""
+    if not ENABLE_MARKET_CONTEXT:
+        return None
+    ctx = market_context.get(symbol[:-4] if symbol.endswith("USDT") else symbol, max_age=MARKET_CONTEXT_MAX_AGE)
+    if ctx is None:
+        return None
+    
+    parts = []
+    if ctx["funding"] is not None:
+        parts.append(f"Funding:{ctx['funding'] * 100:.4f}%/ч")
+    if ctx["premium"] is not None:
+        parts.append(f"Premium:{ctx['premium'] * 100:.3f}%")
+    if ctx["open_interest"] is not None:
+        parts.append(f"OI:${ctx['open_interest'] / 1e6:.2f}M")
+    if ctx["volume"] is not None:
+        parts.append(f"Vol24h:${ctx['volume'] / 1e6:.2f}M")
+    return "\n 24h: " + " ".join(parts) if parts else None
+
+def render_market_blocks(data_dict_outer):
+    """
+    Рендер рыночных данных в блоки [(symbol, [(interval, kind, text), ...]), ...].
+    kind: header | ema | rsi | osc | macd | ctx — заголовки таймфреймов не отбрасываются бюджетом.
+    """
+    rendered = []
     
     for symbol, tf_data in data_dict_outer.items():
-        summary = f"\n{symbol}:"
+        blocks = []
+        
+        context_text = render_context_block(symbol)
+        if context_text:
+            blocks.append(("24h", "ctx", context_text))
         
         for interval in ["1d", "1h", "1m"]:
             candles = tf_data.get(interval, [])
             if not candles:
-                summary += f"\n {interval}: Нет данных"
+                blocks.append((interval, "header", f"\n {interval}: Нет данных"))
                 continue
             
             last = candles[-1]
@@ -313,27 +381,27 @@ def compress_market_data(data_dict_outer):
             low_min = min(c["l"] for c in candles)
             avg_volume = sum(c["v"] for c in candles) / len(candles)
             
-            indicators = calculate_indicators(candles)
+            indicators = get_cached_indicators(candles)
             
-            summary += (
+            blocks.append((interval, "header", (
                 f"\n {interval}: {trend} "
                 f"O:{last['o']:.4f} H:{last['h']:.4f} "
                 f"L:{last['l']:.4f} C:{last['c']:.4f} | "
                 f"MaxH:{high_max:.4f} MinL:{low_min:.4f} "
                 f"Vol:{avg_volume:.2f} ({len(candles)})"
-            )
+            )))
             
             # EMA
             ema_parts = [f"{p}={indicators[f'ema{p}']:.2f}" 
                         for p in (10, 20, 50, 100, 200) 
                         if f"ema{p}" in indicators and indicators[f"ema{p}"] is not None]
             if ema_parts:
-                summary += "\n EMA: " + " ".join(ema_parts)
+                blocks.append((interval, "ema", "\n EMA: " + " ".join(ema_parts)))
             
             # RSI + состояние
             if indicators.get("rsi") is not None:
                 rsi_state = indicators.get("rsi_state", "neutral")
-                summary += f"\n RSI: {indicators['rsi']:.1f} ({rsi_state})"
+                blocks.append((interval, "rsi", f"\n RSI: {indicators['rsi']:.1f} ({rsi_state})"))
             
             # Осцилляторы OB/OS
             osc_parts = []
@@ -352,68 +420,302 @@ def compress_market_data(data_dict_outer):
                 osc_parts.append(f"WillR:{indicators['willr']:.1f}({wr_state})")
             
             if osc_parts:
-                summary += "\n OB/OS: " + " | ".join(osc_parts)
+                blocks.append((interval, "osc", "\n OB/OS: " + " | ".join(osc_parts)))
             
             # MACD
             if indicators.get("macd") is not None and indicators.get("macd_hist") is not None:
                 macd_trend = "🟢" if indicators["macd_hist"] > 0 else "🔴"
-                summary += (
+                blocks.append((interval, "macd", (
                     f"\n MACD: {macd_trend} {indicators['macd']:.2f} "
                     f"Signal:{(indicators.get('macd_signal') or 0):.2f} "
                     f"Hist:{indicators['macd_hist']:.2f}"
-                )
+                )))
         
-        compressed.append(summary)
+        rendered.append((symbol, blocks))
     
+    return rendered
+
+def join_market_blocks(rendered, dropped=frozenset()):
+    """Сборка текста промпта из блоков, без отброшенных (interval, kind)."""
+    compressed = []
+    for symbol, blocks in rendered:
+        summary = f"\n{symbol}:" + "".join(
+            text for interval, kind, text in blocks if (interval, kind) not in dropped
+        )
+        compressed.append(summary)
     return "\n".join(compressed)
 
+def compress_market_data(data_dict_outer, token_budget=None):
+    """
+    Компрессия рыночных данных с индикаторами.
+    При token_budget отбрасывает поля в порядке AI_PROMPT_DROP_ORDER, пока промпт не уложится.
+    """
+    if token_budget is None:
+        token_budget = AI_PROMPT_TOKEN_BUDGET
+    
+    with metrics.phase("prompt"):
+        return _compress_market_data(data_dict_outer, token_budget)
+
+def _compress_market_data(data_dict_outer, token_budget):
+    rendered = render_market_blocks(data_dict_outer)
+    text = join_market_blocks(rendered)
+    if not token_budget or token_budget <= 0:
+        return text
+    
+    overhead = estimate_tokens(AI_SYSTEM_PROMPT) + estimate_tokens(AI_USER_DATA_TEMPLATE)
+    dropped = set()
+    for field in AI_PROMPT_DROP_ORDER:
+        if estimate_tokens(text) + overhead <= token_budget:
+            break
+        dropped.add(tuple(field))
+        text = join_market_blocks(rendered, dropped)
+    
+    if dropped:
+        log.info(f"  ✂️ Промпт урезан до ~{estimate_tokens(text) + overhead} токенов (бюджет {token_budget}), "
+              f"отброшено полей: {len(dropped)}")
+    
+    return text
+
+# ========== Учёт токенов ==========
+def estimate_tokens(text):
+    """Грубая оценка токенов: ~4 символа ASCII или ~2.5 символа кириллицы на токен."""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / 4.0 + other_chars / 2.5) + 1
+
+_ai_usage_stats = {}
+_ai_usage_lock = threading.Lock()
+
+def record_ai_usage(model_name, usage, prompt_estimate):
+    """Накопление usage/стоимости из ответа провайдера по модели."""
+    usage = usage or {}
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    completion_tokens = int(usage.get("completion_tokens") or 0)
+    cost = float(usage.get("cost") or 0.0)
+    
+    with _ai_usage_lock:
+        stats = _ai_usage_stats.setdefault(model_name, {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "prompt_estimate": 0,
+            "cost": 0.0,
+        })
+        stats["requests"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["prompt_estimate"] += prompt_estimate
+        stats["cost"] += cost
+    
+    if usage:
+        log.info(f"  📏 {model_name}: prompt {prompt_tokens} (оценка {prompt_estimate}), "
+              f"completion {completion_tokens}, ${cost:.6f}")
+
+def get_ai_usage_stats():
+    """Копия накопленной статистики токенов и стоимости по моделям."""
+    with _ai_usage_lock:
+        return {model: dict(stats) for model, stats in _ai_usage_stats.items()}
+
+# ========== Пре-скрининг сигналов ==========
+# Решение при сбое AI (нет ответа, неверный формат, ошибка подтверждения): для торговли — как
+# hold, но базовые снимки пре-скрининга не обновляются
+AI_ERROR_DECISION = "error"
+
+_prescreen_state = {
+    "snapshots": {},      # Снимки состояния на момент последнего вызова AI
+    "last_ai_call": 0.0,
+}
+
+def build_signal_snapshot(tf_data):
+    """Дискретный снимок состояния индикаторов символа по таймфреймам."""
+    snapshot = {}
+    
+    for interval in ("1d", "1h", "1m"):
+        candles = tf_data.get(interval, [])
+        if not candles:
+            continue
+        
+        indicators = get_cached_indicators(candles)
+        
+        macd_hist = indicators.get("macd_hist")
+        if macd_hist is None:
+            macd_sign = None
+        else:
+            macd_sign = 1 if macd_hist > 0 else (-1 if macd_hist < 0 else 0)
+        
+        # Порядок EMA: периоды, отсортированные по значению
+        emas = [(p, indicators[f"ema{p}"]) for p in (10, 20, 50, 100, 200) if indicators.get(f"ema{p}") is not None]
+        ema_order = tuple(p for p, _ in sorted(emas, key=lambda x: x[1]))
+        
+        snapshot[interval] = {
+            "rsi_state": indicators.get("rsi_state"),
+            "stoch_state": indicators.get("stoch_state"),
+            "willr_state": indicators.get("willr_state"),
+            "stochrsi_state": indicators.get("stochrsi_state"),
+            "macd_sign": macd_sign,
+            "ema_order": ema_order,
+        }
+    
+    return snapshot
+
+def signal_change_score(prev_snapshot, snapshot):
+    """Взвешенный score изменений между двумя снимками."""
+    if not prev_snapshot:
+        return float("inf")
+    
+    score = 0.0
+    for interval, fields in snapshot.items():
+        prev_fields = prev_snapshot.get(interval)
+        if prev_fields is None:
+            return float("inf")
+        
+        tf_weight = PRESCREEN_TIMEFRAME_WEIGHTS.get(interval, 1.0)
+        for field, value in fields.items():
+            if prev_fields.get(field) != value:
+                score += tf_weight * PRESCREEN_WEIGHTS.get(field, 1.0)
+    
+    return score
+
+def prescreen_market_data(data_dict_outer):
+    """
+    Локальный пре-скрининг перед AI.
+    Возвращает (call_ai, scores, reason, snapshots). Снимки становятся базовыми для
+    следующего сравнения только через commit_prescreen_baseline() — после валидного
+    ответа AI, иначе изменение сигналов, вызвавшее запрос, будет оценено снова.
+    """
+    now = time.time()
+    snapshots = {symbol: build_signal_snapshot(tf_data) for symbol, tf_data in data_dict_outer.items()}
+    prev_snapshots = _prescreen_state["snapshots"]
+    
+    scores = {symbol: signal_change_score(prev_snapshots.get(symbol), snap) for symbol, snap in snapshots.items()}
+    best_symbol = max(scores, key=scores.get) if scores else None
+    best_score = scores.get(best_symbol, 0.0) if best_symbol else 0.0
+    staleness = now - _prescreen_state["last_ai_call"]
+    
+    if best_score >= PRESCREEN_SCORE_THRESHOLD:
+        reason = f"{best_symbol}: изменение сигналов (score {best_score:.1f})"
+    elif staleness >= PRESCREEN_MAX_STALENESS:
+        reason = f"Плановый вызов: {int(staleness)}с без анализа"
+    else:
+        return False, scores, f"Без изменений (max score {best_score:.1f} < {PRESCREEN_SCORE_THRESHOLD})", snapshots
+    
+    return True, scores, reason, snapshots
+
+def commit_prescreen_baseline(snapshots):
+    """Снимки пре-скрининга → базовые (вызывается после валидного ответа AI)."""
+    _prescreen_state["snapshots"] = snapshots
+    _prescreen_state["last_ai_call"] = time.time()
+
 # ========== AI API ==========
-def call_ai_api(api_url, headers, payload, api_name):
-    """Универсальный вызов AI API."""
+def parse_ai_fields(result, required_fields=("Action", "Reason")):
+    """Разбор строк вида 'Field: value' из ответа модели."""
+    result = result.replace("**", "").replace("*", "")
+    
+    fields = {}
+    for line in result.split("\n"):
+        line = line.strip()
+        for field in required_fields:
+            if field not in fields and line.startswith(field) and f"{field}:" in line:
+                fields[field] = line.split(f"{field}:", 1)[1].strip()
+    
+    if any(not fields.get(field) for field in required_fields):
+        return None
+    return fields
+
+def read_streamed_content(response):
+    """Сборка текста из SSE-потока chat/completions (stream=True). Возвращает (content, usage)."""
+    parts = []
+    usage = None
+    # Строки декодируются как UTF-8 сами: для text/event-stream без charset requests взял бы ISO-8859-1
+    for raw_line in response.iter_lines():
+        line = raw_line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        if not chunk.get("choices"):
+            continue
+        delta = chunk["choices"][0].get("delta", {})
+        parts.append(delta.get("content") or "")
+    return "".join(parts), usage
+
+_record_lock = threading.Lock()
+
+def record_ai_response(model_name, content, latency):
+    """Дозапись ответа модели в AI_RECORD_RESPONSES_FILE."""
+    if not AI_RECORD_RESPONSES_FILE:
+        return
+    record = {"model": model_name, "content": content, "latency": round(latency, 4), "ts": time.time()}
+    with _record_lock:
+        with open(AI_RECORD_RESPONSES_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def request_ai_fields(api_url, headers, payload, api_name, required_fields=("Action", "Reason")):
+    """Запрос к AI API с разбором полей ответа. Возвращает (fields, error)."""
+    endpoint = f"ai.{payload.get('model')}"
     try:
-        response = requests.post(api_url, json=payload, headers=headers, timeout=120)
+        started = time.monotonic()
+        stream = bool(payload.get("stream"))
+        with metrics.request(endpoint):
+            response = requests.post(api_url, json=payload, headers=headers, timeout=AI_REQUEST_TIMEOUT, stream=stream)
         
         if response.status_code != 200:
+            metrics.inc("api_errors_total", endpoint=endpoint)
             try:
                 error_detail = response.json()
-                print(f"❌ {api_name} error: {error_detail.get('error', {}).get('message', 'Unknown error')}")
+                log.error(f"❌ {api_name} error: {error_detail.get('error', {}).get('message', 'Unknown error')}")
             except Exception:
-                print(f"❌ {api_name} error {response.status_code}: {response.text[:200]}")
+                log.error(f"❌ {api_name} error {response.status_code}: {response.text[:200]}")
             return None, f"❌ {api_name} API error: {response.status_code}"
         
-        result_json = response.json()
-        result = result_json["choices"][0]["message"]["content"].strip()
-        result = result.replace("**", "").replace("*", "")
+        if stream:
+            result, usage = read_streamed_content(response)
+            result = result.strip()
+        else:
+            result_json = response.json()
+            result = result_json["choices"][0]["message"]["content"].strip()
+            usage = result_json.get("usage")
         
-        action_line, reason_line = None, None
-        for line in result.split("\n"):
-            line = line.strip()
-            if line.startswith("Action"):
-                action_line = line.split("Action:", 1)[1].strip()
-            elif line.startswith("Reason"):
-                reason_line = line.split("Reason:", 1)[1].strip()
+        record_ai_response(payload.get("model"), result, time.monotonic() - started)
+        prompt_text = "".join(m.get("content", "") for m in payload.get("messages", []))
+        record_ai_usage(payload.get("model"), usage, estimate_tokens(prompt_text))
         
-        if not action_line or not reason_line:
+        fields = parse_ai_fields(result, required_fields)
+        if not fields:
             return None, f"❌ {api_name} формат ответа некорректен"
         
-        return action_line, reason_line
+        return fields, None
     
     except Exception as e:
         return None, f"❌ {api_name} ошибка: {str(e)}"
 
-def call_openrouter_model(model_name, user_data, api_name="OpenRouter"):
-    """Вызов OpenRouter с указанной моделью."""
-    api_key = os.getenv("OPENROUTER_API_KEY")
+def call_ai_api(api_url, headers, payload, api_name):
+    """Универсальный вызов AI API."""
+    fields, error = request_ai_fields(api_url, headers, payload, api_name)
+    if not fields:
+        return None, error
+    return fields["Action"], fields["Reason"]
+
+def build_openrouter_request(model_name, user_data, system_prompt=AI_SYSTEM_PROMPT,
+                             base_url=None, api_key_env="OPENROUTER_API_KEY"):
+    """Формирование (url, headers, payload) для OpenRouter-совместимого API. None, если нет ключа."""
+    api_key = os.getenv(api_key_env)
     if not api_key:
-        return None, "❌ OpenRouter API ключ не найден"
+        return None
     
-    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    url = f"{base_url or OPENROUTER_BASE_URL}/chat/completions"
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
     
-    system_message = {"role": "system", "content": AI_SYSTEM_PROMPT}
+    system_message = {"role": "system", "content": system_prompt}
     if OPENROUTER_ENABLE_CACHE_CONTROL:
         system_message["cache_control"] = {"type": "ephemeral"}
     
@@ -424,8 +726,123 @@ def call_openrouter_model(model_name, user_data, api_name="OpenRouter"):
         "max_tokens": 150,
         "temperature": 0.3,
     }
+    if OPENROUTER_STREAM:
+        payload["stream"] = True
+    if OPENROUTER_INCLUDE_USAGE:
+        payload["usage"] = {"include": True}
+    
+    return url, headers, payload
+
+# ---------- Задержки моделей ----------
+_model_latencies = {}
+_model_latencies_lock = threading.Lock()
+
+def record_model_latency(model_name, seconds):
+    """Сохранение задержки успешного ответа модели."""
+    with _model_latencies_lock:
+        samples = _model_latencies.setdefault(model_name, deque(maxlen=AI_LATENCY_WINDOW))
+        samples.append(seconds)
+
+def get_model_latency_percentile(model_name, percentile):
+    """Перцентиль задержки модели или None, если замеров недостаточно."""
+    with _model_latencies_lock:
+        samples = list(_model_latencies.get(model_name, ()))
+    
+    if len(samples) < AI_HEDGE_MIN_SAMPLES:
+        return None
+    return float(np.percentile(samples, percentile))
+
+def get_hedge_delay(model_name):
+    """Время ожидания основной модели перед хедж-запросом."""
+    delay = get_model_latency_percentile(model_name, AI_HEDGE_PERCENTILE)
+    return delay if delay is not None else AI_HEDGE_DEFAULT_DELAY
+
+# ---------- Вызовы OpenRouter ----------
+_hedge_executor = ThreadPoolExecutor(max_workers=2 * AI_PARALLEL_MAX_WORKERS + 4, thread_name_prefix="ai-hedge")
+
+def _timed_openrouter_fields(model_name, user_data, api_name, system_prompt, required_fields,
+                             base_url=None, api_key_env="OPENROUTER_API_KEY"):
+    """Запрос к модели с замером задержки."""
+    request = build_openrouter_request(model_name, user_data, system_prompt, base_url, api_key_env)
+    if not request:
+        return None, "❌ OpenRouter API ключ не найден"
+    
+    url, headers, payload = request
+    started = time.monotonic()
+    fields, error = request_ai_fields(url, headers, payload, api_name, required_fields)
+    if fields:
+        record_model_latency(model_name, time.monotonic() - started)
+    return fields, error
+
+def _hedged_openrouter_fields(model_name, user_data, api_name, system_prompt, required_fields):
+    """Хеджированный запрос: резервная модель подключается по перцентилю задержки или при ошибке основной."""
+    primary = _hedge_executor.submit(
+        _timed_openrouter_fields, model_name, user_data, api_name, system_prompt, required_fields
+    )
+    
+    delay = get_hedge_delay(model_name)
+    try:
+        fields, error = primary.result(timeout=delay)
+        if fields:
+            return fields, None
+        log.warning(f"  ⚠️ {api_name}: {error} → резервная модель {AI_HEDGE_BACKUP_MODEL}")
+    except FuturesTimeout:
+        log.info(f"  ⏱️ {api_name}: нет ответа за {delay:.1f}с → хедж-запрос к {AI_HEDGE_BACKUP_MODEL}")
+    
+    backup = _hedge_executor.submit(
+        _timed_openrouter_fields,
+        AI_HEDGE_BACKUP_MODEL,
+        user_data,
+        f"{api_name} → {AI_HEDGE_BACKUP_MODEL}",
+        system_prompt,
+        required_fields,
+        AI_HEDGE_BACKUP_BASE_URL or None,
+        AI_HEDGE_BACKUP_API_KEY_ENV,
+    )
+    
+    pending = {primary, backup}
+    last_error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            fields, error = future.result()
+            if fields:
+                winner = model_name if future is primary else AI_HEDGE_BACKUP_MODEL
+                log.info(f"  ⚡ Первый валидный ответ: {winner}")
+                return fields, None
+            last_error = error
+    
+    return None, last_error
+
+def openrouter_fields(model_name, user_data, api_name="OpenRouter",
+                      system_prompt=AI_SYSTEM_PROMPT, required_fields=("Action", "Reason")):
+    """Запрос к OpenRouter с хеджированием (если включено). Возвращает (fields, error)."""
+    if ENABLE_AI_HEDGING and AI_HEDGE_BACKUP_MODEL and AI_HEDGE_BACKUP_MODEL != model_name:
+        return _hedged_openrouter_fields(model_name, user_data, api_name, system_prompt, required_fields)
+    return _timed_openrouter_fields(model_name, user_data, api_name, system_prompt, required_fields)
+
+def call_openrouter_model(model_name, user_data, api_name="OpenRouter"):
+    """Вызов OpenRouter с указанной моделью."""
+    fields, error = openrouter_fields(model_name, user_data, api_name)
+    if not fields:
+        return None, error
+    return fields["Action"], fields["Reason"]
+
+def call_openrouter_scored(model_name, user_data, api_name="OpenRouter"):
+    """Вызов OpenRouter с per-symbol промптом. Возвращает ((action, score, reason), error)."""
+    fields, error = openrouter_fields(
+        model_name, user_data, api_name, AI_PER_SYMBOL_SYSTEM_PROMPT, ("Action", "Score", "Reason")
+    )
+    if not fields:
+        return None, error
     
-    return call_ai_api(url, headers, payload, api_name)
+    action = fields["Action"].split()[0].lower().strip("|,.")
+    score_match = re.search(r"\d+(?:\.\d+)?", fields["Score"])
+    if action not in ("buy", "sell", "hold") or not score_match:
+        return None, f"❌ {api_name} формат ответа некорректен"
+    
+    score = max(0.0, min(100.0, float(score_match.group(0))))
+    return (action, score, fields["Reason"]), None
 
 def analyze_with_openrouter(data_dict_outer):
     """Анализ через OpenRouter с двухуровневой верификацией."""
@@ -434,16 +851,17 @@ def analyze_with_openrouter(data_dict_outer):
     
     compressed_data = compress_market_data(data_dict_outer)
     user_data = AI_USER_DATA_TEMPLATE.format(market_data=compressed_data)
+    log.info(f"📏 Промпт: ~{estimate_tokens(AI_SYSTEM_PROMPT) + estimate_tokens(user_data)} токенов")
     
     if not ENABLE_TWO_LEVEL_VERIFICATION:
         model_to_use = OPENROUTER_MODEL if OPENROUTER_MODEL else OPENROUTER_MODEL_LEVEL1
-        print(f"🔍 Анализ ({model_to_use})...")
+        log.info(f"🔍 Анализ ({model_to_use})...")
         action_line, reason_line = call_openrouter_model(model_to_use, user_data, f"OpenRouter ({model_to_use})")
         
         if not action_line:
-            return ("hold", reason_line)
+            return (AI_ERROR_DECISION, reason_line)
         
-        print(f"  Результат: {action_line} | {reason_line}")
+        log.info(f"  Результат: {action_line} | {reason_line}")
         
         if action_line.startswith("buy") or action_line.startswith("sell"):
             symbol = action_line.split("_", 1)[1].upper()
@@ -453,7 +871,7 @@ def analyze_with_openrouter(data_dict_outer):
         return ("hold", reason_line)
     
     # Первый уровень
-    print(f"🔍 Уровень 1 ({OPENROUTER_MODEL_LEVEL1}): первичный анализ...")
+    log.info(f"🔍 Уровень 1 ({OPENROUTER_MODEL_LEVEL1}): первичный анализ...")
     action_line, reason_line = call_openrouter_model(
         OPENROUTER_MODEL_LEVEL1,
         user_data,
@@ -461,16 +879,16 @@ def analyze_with_openrouter(data_dict_outer):
     )
     
     if not action_line:
-        return ("hold", reason_line)
+        return (AI_ERROR_DECISION, reason_line)
     
-    print(f"  Результат: {action_line} | {reason_line}")
+    log.info(f"  Результат: {action_line} | {reason_line}")
     
     needs_verification = action_line.startswith("buy") or action_line.startswith("sell")
     if not needs_verification:
         return ("hold", reason_line)
     
     # Второй уровень
-    print(f"✅ Уровень 2 ({OPENROUTER_MODEL_LEVEL2}): подтверждение сигнала...")
+    log.info(f"✅ Уровень 2 ({OPENROUTER_MODEL_LEVEL2}): подтверждение сигнала...")
     action_line2, reason_line2 = call_openrouter_model(
         OPENROUTER_MODEL_LEVEL2,
         user_data,
@@ -478,13 +896,13 @@ def analyze_with_openrouter(data_dict_outer):
     )
     
     if not action_line2:
-        print("  ⚠️ Ошибка подтверждения, сигнал отклонен")
-        return ("hold", f"Ошибка подтверждения: {reason_line2}")
+        log.warning("  ⚠️ Ошибка подтверждения, сигнал отклонен")
+        return (AI_ERROR_DECISION, f"Ошибка подтверждения: {reason_line2}")
     
-    print(f"  Результат: {action_line2} | {reason_line2}")
+    log.info(f"  Результат: {action_line2} | {reason_line2}")
     
     if not (action_line2.startswith("buy") or action_line2.startswith("sell")):
-        print("  ❌ Подтверждение отклонено: Level2 дал 'hold'")
+        log.error("  ❌ Подтверждение отклонено: Level2 дал 'hold'")
         return ("hold", f"Подтверждение отклонено: {reason_line2}")
     
     # Проверка совпадения
@@ -494,23 +912,101 @@ def analyze_with_openrouter(data_dict_outer):
     act2 = action_line2.split("_", 1)[0]
     
     if act1 == act2 and sym1 == sym2 and sym2 in data_dict_outer:
-        print(f"  ✅ Подтверждено: {act2.upper()} {sym2}")
+        log.info(f"  ✅ Подтверждено: {act2.upper()} {sym2}")
         return (action_line2, f"Подтверждено: {reason_line2}")
     
-    print(f"  ❌ Сигналы не совпали: Level1={action_line}, Level2={action_line2}")
+    log.error(f"  ❌ Сигналы не совпали: Level1={action_line}, Level2={action_line2}")
     return ("hold", f"Сигналы не совпали")
 
+def score_symbol_with_ai(symbol, tf_data, model_name):
+    """Per-symbol оценка: ((action, score, reason), error)."""
+    compressed_data = compress_market_data({symbol: tf_data})
+    user_data = AI_USER_DATA_TEMPLATE.format(market_data=compressed_data)
+    return call_openrouter_scored(model_name, user_data, f"OpenRouter ({model_name}) {symbol}")
+
+def rank_symbol_scores(results):
+    """Локальный рейтинг: сильнейший buy/sell сигнал не ниже порога. Возвращает (symbol, action, score, reason) или None."""
+    candidates = [
+        (score, symbol, action, reason)
+        for symbol, (action, score, reason) in results.items()
+        if action in ("buy", "sell") and score >= AI_PER_SYMBOL_MIN_SCORE
+    ]
+    if not candidates:
+        return None
+    
+    score, symbol, action, reason = max(candidates, key=lambda c: c[0])
+    return symbol, action, score, reason
+
+def analyze_per_symbol(data_dict_outer):
+    """Параллельный per-symbol анализ с локальным выбором победителя."""
+    symbols = [s for s, tf_data in data_dict_outer.items() if any(tf_data.values())]
+    if not symbols:
+        return ("hold", "Нет данных")
+    
+    model_to_use = OPENROUTER_MODEL_LEVEL1 if ENABLE_TWO_LEVEL_VERIFICATION else (OPENROUTER_MODEL or OPENROUTER_MODEL_LEVEL1)
+    workers = max(1, min(AI_PARALLEL_MAX_WORKERS, len(symbols)))
+    log.info(f"🔍 Per-symbol анализ ({model_to_use}): {len(symbols)} символов, {workers} потоков...")
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(score_symbol_with_ai, symbol, data_dict_outer[symbol], model_to_use): symbol
+            for symbol in symbols
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            result, error = future.result()
+            if not result:
+                log.warning(f"  ⚠️ {symbol}: {error}")
+                continue
+            results[symbol] = result
+            action, score, reason = result
+            log.info(f"  {symbol}: {action} ({score:.0f}) | {reason}")
+    
+    if not results:
+        return (AI_ERROR_DECISION, "Нет ответов AI")
+    
+    winner = rank_symbol_scores(results)
+    if not winner:
+        return ("hold", f"Нет сигналов со score ≥ {AI_PER_SYMBOL_MIN_SCORE:.0f}")
+    
+    symbol, action, score, reason = winner
+    
+    if not ENABLE_TWO_LEVEL_VERIFICATION:
+        return (f"{action}_{symbol}", f"Score {score:.0f}: {reason}")
+    
+    # Второй уровень: подтверждение только победителя
+    log.info(f"✅ Уровень 2 ({OPENROUTER_MODEL_LEVEL2}): подтверждение {action.upper()} {symbol}...")
+    result2, error2 = score_symbol_with_ai(symbol, data_dict_outer[symbol], OPENROUTER_MODEL_LEVEL2)
+    
+    if not result2:
+        log.warning("  ⚠️ Ошибка подтверждения, сигнал отклонен")
+        return (AI_ERROR_DECISION, f"Ошибка подтверждения: {error2}")
+    
+    action2, score2, reason2 = result2
+    log.info(f"  Результат: {action2} ({score2:.0f}) | {reason2}")
+    
+    if action2 != action or score2 < AI_PER_SYMBOL_MIN_SCORE:
+        log.error(f"  ❌ Сигналы не совпали: Level1={action}_{symbol}, Level2={action2} ({score2:.0f})")
+        return ("hold", "Сигналы не совпали")
+    
+    log.info(f"  ✅ Подтверждено: {action.upper()} {symbol}")
+    return (f"{action}_{symbol}", f"Подтверждено (score {score2:.0f}): {reason2}")
+
 def analyze_with_ai(data_dict_outer):
     """Главная функция анализа."""
-    print("\n" + "=" * 60)
-    print("🧠 АНАЛИЗ AI")
-    print("=" * 60)
+    log.info("\n" + "=" * 60)
+    log.info("🧠 АНАЛИЗ AI")
+    log.info("=" * 60)
     
     if USE_OPENROUTER:
-        print("🤖 OpenRouter AI анализирует...")
-        openrouter_signal = analyze_with_openrouter(data_dict_outer)
-        print("=" * 60 + "\n")
+        log.info("🤖 OpenRouter AI анализирует...")
+        if AI_ANALYSIS_MODE == "per_symbol":
+            openrouter_signal = analyze_per_symbol(data_dict_outer)
+        else:
+            openrouter_signal = analyze_with_openrouter(data_dict_outer)
+        log.info("=" * 60 + "\n")
         return openrouter_signal
     
-    print("=" * 60 + "\n")
+    log.info("=" * 60 + "\n")
     return ("hold", "❌ AI не включены")